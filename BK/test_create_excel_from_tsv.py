@@ -10,9 +10,20 @@ import tempfile
 import shutil
 from openpyxl import load_workbook
 
-# Import the main function
+# Import the main function (from this directory, falling back to the repository root)
 sys.path.insert(0, os.path.dirname(__file__))
-from create_excel_from_tsv import create_excel_from_tsv_files
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import io
+import random
+import contextlib
+import tarfile
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from create_excel_from_tsv import (create_excel_from_tsv_files, create_excel_from_rows, create_excel_from_stream,
+                                   QueryStream, GroupTree, external_sort, order_by_key, to_int, to_float)
+import create_excel_from_tsv
+from benchmark_create_excel import generate_dataset, build_group_tree
 
 def print_test_header(test_name):
     """Print a formatted test header"""
@@ -359,6 +370,555 @@ def test_scenario_5_mixed_conditions():
     print("\n✅ TEST PASSED: Mixed conditions handled correctly")
     return True
 
+def test_scenario_6_synthetic_dataset(devices=5000, engine="openpyxl"):
+    """Test with a synthetic AMM dataset from benchmark_create_excel.generate_dataset"""
+    print_test_header(f"Scenario 6: Synthetic Dataset ({devices:,} devices, {engine} engine)")
+    
+    temp_dir = tempfile.mkdtemp()
+    tsv_dir = os.path.join(temp_dir, "tsv")
+    summary = generate_dataset(tsv_dir, devices=devices)
+    print(f"Generated dataset: {summary}")
+    
+    output_excel = os.path.join(temp_dir, "test_synthetic.xlsx")
+    server_name = "TEST06"
+    
+    result = create_excel_from_tsv_files(tsv_dir, output_excel, server_name, engine=engine)
+    
+    if result != 0:
+        print("❌ FAIL: Function returned non-zero exit code")
+        shutil.rmtree(temp_dir)
+        return False
+    
+    print("\nVerifying Excel file...")
+    wb = load_workbook(output_excel, read_only=True)
+    
+    expected_rows = {
+        "GroupHierarchyPath": summary["groups"],
+        "GatewayCountByGroup": summary["active_groups"],
+        "UserListWithGroups": summary["user_permissions"],
+        "GatewaysLast30Days": 1,
+        "DeviceLevelData": devices
+    }
+    
+    all_passed = True
+    for sheet_name, rows in expected_rows.items():
+        actual_rows = sum(1 for _ in wb[sheet_name].iter_rows(min_row=2, values_only=True))
+        print(f"  {sheet_name}: expected {rows:,} rows, got {actual_rows:,}")
+        if actual_rows != rows:
+            all_passed = False
+    
+    wb.close()
+    shutil.rmtree(temp_dir)
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Synthetic dataset converted completely")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Row counts don't match the generated dataset")
+        return False
+
+def report_checks(checks):
+    """Print one line per (description, passed) check; True when all of them passed"""
+    for description, passed in checks:
+        print(f"  {'✅ PASS' if passed else '❌ FAIL'}: {description}")
+    return all(passed for _, passed in checks)
+
+def test_scenario_7_rows_api():
+    """Test that create_excel_from_rows renders row tuples and text streams like TSV lines"""
+    print_test_header("Scenario 7: Row Iterator API")
+    
+    temp_dir = tempfile.mkdtemp()
+    output_excel = os.path.join(temp_dir, "test_rows.xlsx")
+    server_name = "TEST07"
+    
+    # Row tuples (None is SQL NULL, control characters are stripped, ints may arrive as text)
+    # for one query, a text stream for another; the rest get placeholder sheets
+    query_rows = {
+        "Gateway_Count_By_Group": [("groupname", "groupid", "num_gateways"),
+                                   ("Customer A", 12, 3), ("Site\x07 B", "7", None)],
+        "User_List_With_Groups": io.StringIO("groupid\tgroupname\tusername\temail\n5\tG\tuser1\tNULL\n")
+    }
+    result = create_excel_from_rows(query_rows, output_excel, server_name)
+    
+    if result != 0:
+        print("❌ FAIL: Function returned non-zero exit code")
+        shutil.rmtree(temp_dir)
+        return False
+    
+    wb = load_workbook(output_excel, read_only=True)
+    gateways = list(wb["GatewayCountByGroup"].values)
+    users = list(wb["UserListWithGroups"].values)
+    hierarchy = list(wb["GroupHierarchyPath"].values)
+    wb.close()
+    shutil.rmtree(temp_dir)
+    
+    all_passed = report_checks([
+        ("tuple rows typed and NULL rendered",
+         gateways[1:] == [(server_name, "Customer A", 12, 3), (server_name, "Site B", 7, "NULL")]),
+        ("text stream rows typed", users[1:] == [(server_name, 5, "G", "user1", "NULL")]),
+        ("missing query gets a placeholder row", hierarchy[1][1:] == ("No Data Available",) * 4),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Row tuples and streams rendered like TSV lines")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Rows API rendering differs")
+        return False
+
+def test_scenario_8_stream_frame_failures():
+    """Test QueryStream's handling of out-of-order, failed, missing and truncated frames"""
+    print_test_header("Scenario 8: Framed Query Stream failures")
+    
+    def frames():
+        return io.StringIO(
+            "##QUERY_BEGIN Device_Level_Data\nserial\nS1\n##QUERY_END Device_Level_Data OK\n"
+            "##QUERY_BEGIN Group_Hierarchy_Path\n##QUERY_END Group_Hierarchy_Path FAILED\n"
+            "##QUERY_BEGIN Gateway_Count_By_Group\ngroupname\tgroupid\tnum_gateways\nG\t1\t2\n"
+            "##QUERY_END Gateway_Count_By_Group FAILED\n"
+            "##QUERY_BEGIN User_List_With_Groups\ngroupid\n5\n")
+    
+    stream = QueryStream(frames())
+    failed_empty = stream.get("Group_Hierarchy_Path")
+    
+    failed_lines = []
+    failed_error = None
+    try:
+        for line in stream.get("Gateway_Count_By_Group"):
+            failed_lines.append(line)
+    except RuntimeError as e:
+        failed_error = str(e)
+    
+    truncated_error = None
+    try:
+        list(stream.get("User_List_With_Groups"))
+    except RuntimeError as e:
+        truncated_error = str(e)
+    
+    missing = stream.get("Gateways_Registered_Last_30_Days")
+    spooled = list(stream.get("Device_Level_Data"))
+    
+    # End to end: the query whose frame failed after its rows gets an error sheet, the rest still convert
+    temp_dir = tempfile.mkdtemp()
+    output_excel = os.path.join(temp_dir, "test_stream.xlsx")
+    result = create_excel_from_stream(frames(), output_excel, "TEST08")
+    wb = load_workbook(output_excel, read_only=True)
+    sheetnames = wb.sheetnames
+    error_rows = list(wb["Gateway_Count_By_Group"].values) if "Gateway_Count_By_Group" in sheetnames else []
+    wb.close()
+    shutil.rmtree(temp_dir)
+    
+    all_passed = report_checks([
+        ("frame failed before any line gives None", failed_empty is None),
+        ("frame failed after lines raises once they are read",
+         len(failed_lines) == 2 and failed_error is not None and "failed after 2 lines" in failed_error),
+        ("truncated frame raises", truncated_error is not None and "Stream ended" in truncated_error),
+        ("frame that never arrived gives None", missing is None),
+        ("out-of-order frame replayed from its spool", spooled == ["serial\n", "S1\n"]),
+        ("workbook still written", result == 0 and "DeviceLevelData" in sheetnames),
+        ("failed frame gets an error sheet",
+         any("Remote query Gateway_Count_By_Group failed" in str(row[0]) for row in error_rows)),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Stream frame failures handled")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Stream frame failures mishandled")
+        return False
+
+def test_scenario_9_external_sort(rows=1000, buffer_rows=100):
+    """Test external_sort: several spilled runs merged in ORDER BY order, ties kept in input order"""
+    print_test_header(f"Scenario 9: External sort ({rows:,} rows, {buffer_rows:,}-row runs)")
+    
+    rnd = random.Random(9)
+    headers = ["groupid", "label"]
+    key = order_by_key(headers, ["groupid"], {"groupid": "int"})
+    
+    # Few distinct ids, so most rows tie; NULL sorts first and ids compare as numbers ("9" < "10")
+    ids = [None if rnd.random() < 0.05 else rnd.randint(0, 50) for _ in range(rows)]
+    lines = [f"{'NULL' if gid is None else gid}\tlabel{i}" for i, gid in enumerate(ids)]
+    tuples = [(gid, f"label{i}") for i, gid in enumerate(ids)]
+    expected = [i for _, i in sorted((-1 if gid is None else gid, i) for i, gid in enumerate(ids))]
+    
+    temp_dir = tempfile.mkdtemp()
+    sorted_lines, line_runs = external_sort(lines, key, buffer_rows, temp_dir)
+    sorted_lines = list(sorted_lines)
+    sorted_tuples, tuple_runs = external_sort(tuples, key, buffer_rows, temp_dir)
+    sorted_tuples = list(sorted_tuples)
+    in_memory, memory_runs = external_sort(lines[:buffer_rows - 1], key, buffer_rows, temp_dir)
+    shutil.rmtree(temp_dir)
+    
+    text_key = order_by_key(["name"], ["name"], {})
+    folded = list(external_sort(["b", "A", "a", "B"], text_key, 1)[0])
+    
+    all_passed = report_checks([
+        ("TSV lines spilled to one run per buffer", line_runs == rows // buffer_rows),
+        ("TSV lines merged in order, ties stable", sorted_lines == [lines[i] for i in expected]),
+        ("row tuples spilled and merged the same way",
+         tuple_runs == rows // buffer_rows and sorted_tuples == [tuples[i] for i in expected]),
+        ("input that fits one run is not spilled",
+         memory_runs == 0 and list(in_memory) == sorted(lines[:buffer_rows - 1], key=key)),
+        ("text compared case-insensitively, ties stable", folded == ["A", "a", "b", "B"]),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: External sort matches ORDER BY")
+        return True
+    else:
+        print("\n❌ TEST FAILED: External sort order differs")
+        return False
+
+def test_scenario_10_group_tree():
+    """Test GroupTree's hierarchy and fullpath against what the grp_path CTEs return"""
+    print_test_header("Scenario 10: Group tree from a flat im_group extract")
+    
+    # 1 > 2 > 3 > 4 is one chain; 5 is a top-level group with a NULL label; 7 has a dangling
+    # parent and 8/9 form a cycle, so the CTEs never reach them
+    tree = GroupTree(["1\t0\tA", "2\t1\tB", "3\t2\tC", "4\t3\tD", "5\t0\tNULL", "6\t5\tE",
+                      "7\t99\tOrphan", "8\t9\tX", "9\t8\tY", "10\t1\tF"])
+    expected_paths = {"1": "A", "2": "A...B", "3": "A...C", "4": "B...D", "6": "NULL", "7": "NULL",
+                      "8": "NULL", "0": "NULL", "NULL": "NULL", "10": "A...F"}
+    paths = {groupid: tree.fullpath(groupid) for groupid in expected_paths}
+    
+    # The synthetic tree's fullpaths follow the CTE (see benchmark_create_excel.build_group_tree)
+    groups = build_group_tree()
+    synthetic = GroupTree(f"{g['groupid']}\t{g['parentgroupid']}\t{g['label']}" for g in groups)
+    
+    all_passed = report_checks([
+        ("fullpath follows the CTE's rootname...label", paths == expected_paths),
+        ("hierarchy has reachable groups only, ordered by rootid, groupid numerically",
+         tree.hierarchy_rows() == [("1", "A", "1", "A"), ("1", "A", "2", "B"), ("1", "A", "3", "C"),
+                                   ("1", "A", "4", "D"), ("1", "A", "10", "F"),
+                                   ("5", "NULL", "5", "NULL"), ("5", "NULL", "6", "E")]),
+        ("device groupids replaced in lines and tuples",
+         list(tree.with_fullpath(["S1\t4\tx", "S2\t0\tx"], 1)) == ["S1\tB...D\tx", "S2\tNULL\tx"]
+         and list(tree.with_fullpath([("S3", 4), ("S4", None)], 1)) == [["S3", "B...D"], ["S4", None]]),
+        ("synthetic tree fullpaths match",
+         all(synthetic.fullpath(str(g["groupid"])) == g["fullpath"] for g in groups)),
+        ("synthetic hierarchy matches",
+         synthetic.hierarchy_rows() == [(str(g["rootid"]), g["rootlabel"], str(g["groupid"]), g["label"])
+                                        for g in sorted(groups, key=lambda g: (g["rootid"], g["groupid"]))]),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Group tree matches the CTE results")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Group tree differs from the CTE results")
+        return False
+
+def fail_first_parts(task):
+    """render_sheet_part stand-in for scenario 11: the workers for parts _1 and _2 fail"""
+    if task["title"].endswith(("_1", "_2")):
+        raise RuntimeError(f"worker failed on {task['title']}")
+    return render_sheet_part(task)
+
+render_sheet_part = create_excel_from_tsv.render_sheet_part
+
+def test_scenario_11_failed_parts_error_sheets(rows=120, part_rows=50):
+    """Test that failed worker parts of one split query get distinct error sheets"""
+    print_test_header(f"Scenario 11: Two failed parts of a split sheet ({rows} rows, {part_rows} per part)")
+    
+    # The workers must inherit the patched module, which only forked processes do
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("\n⚠️  TEST SKIPPED: needs the fork start method")
+        return True
+    
+    temp_dir = tempfile.mkdtemp()
+    tsv_dir = os.path.join(temp_dir, "tsv")
+    os.makedirs(tsv_dir)
+    with open(os.path.join(tsv_dir, "Device_Level_Data.tsv"), "w") as f:
+        f.write("serial\tname\tfullpath\tdevice_type\tplatform\tlast_comm\n")
+        for i in range(rows):
+            f.write(f"S{i:05d}\tRV50 {i}\tCustomer 001\tGateway\tRV50\t2026-01-01 00:00:00\n")
+    output_excel = os.path.join(temp_dir, "test_parts.xlsx")
+    
+    # Worker processes are forked explicitly (not the platform default), so they see the patched module
+    max_rows = create_excel_from_tsv.EXCEL_MAX_ROWS
+    create_excel_from_tsv.EXCEL_MAX_ROWS = part_rows
+    create_excel_from_tsv.render_sheet_part = fail_first_parts
+    create_excel_from_tsv.ProcessPoolExecutor = functools.partial(ProcessPoolExecutor,
+                                                                  mp_context=multiprocessing.get_context("fork"))
+    try:
+        result = create_excel_from_tsv_files(tsv_dir, output_excel, "TEST11", engine="native", jobs=2)
+    finally:
+        create_excel_from_tsv.EXCEL_MAX_ROWS = max_rows
+        create_excel_from_tsv.render_sheet_part = render_sheet_part
+        create_excel_from_tsv.ProcessPoolExecutor = ProcessPoolExecutor
+    
+    sheetnames = []
+    first_cells = {}
+    try:
+        wb = load_workbook(output_excel, read_only=True)
+        sheetnames = wb.sheetnames
+        first_cells = {name: [row[0] for row in wb[name].values][:2] for name in sheetnames}
+        wb.close()
+    except Exception as e:
+        print(f"  Workbook does not open: {e}")
+    shutil.rmtree(temp_dir)
+    
+    all_passed = report_checks([
+        ("workbook written and opens", result == 0 and bool(sheetnames)),
+        ("sheet titles unique", len(sheetnames) == len(set(sheetnames))),
+        ("failed parts titled after the part, in sheet order",
+         [name for name in sheetnames if name.startswith("DeviceLevelData")]
+         == ["DeviceLevelData_1", "DeviceLevelData_2", "DeviceLevelData_3"]),
+        ("failed parts hold the error",
+         all(first_cells.get(f"DeviceLevelData_{part}", [None, None])[0] == "Error"
+             and f"worker failed on DeviceLevelData_{part}" in str(first_cells[f"DeviceLevelData_{part}"][1])
+             for part in (1, 2))),
+        ("remaining part rendered", first_cells.get("DeviceLevelData_3", [None])[0] == "Server"),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Failed parts get distinct error sheets")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Failed parts' error sheets clash or are missing")
+        return False
+
+def test_scenario_12_carriage_return_in_field(rows=7, part_rows=3):
+    """Test that a '\\r' inside a MySQL value neither adds rows nor shifts columns (TSV split and stream spool)"""
+    print_test_header(f"Scenario 12: Carriage return inside a field ({rows} rows, {part_rows} per part)")
+    
+    temp_dir = tempfile.mkdtemp()
+    tsv_dir = os.path.join(temp_dir, "tsv")
+    os.makedirs(tsv_dir)
+    header = "serial\tname\tfullpath\tdevice_type\tplatform\tlast_comm\n"
+    names = [f"RV50 {i}" for i in range(rows)]
+    names[1] = "RV50\r1"
+    lines = [f"S{i:05d}\t{name}\tCustomer 001\tGateway\tRV50\tNULL\n" for i, name in enumerate(names)]
+    with open(os.path.join(tsv_dir, "Device_Level_Data.tsv"), "w", newline="") as f:
+        f.write(header)
+        f.writelines(lines)
+    output_excel = os.path.join(temp_dir, "test_cr.xlsx")
+    
+    max_rows = create_excel_from_tsv.EXCEL_MAX_ROWS
+    create_excel_from_tsv.EXCEL_MAX_ROWS = part_rows
+    try:
+        result = create_excel_from_tsv_files(tsv_dir, output_excel, "TEST12")
+    finally:
+        create_excel_from_tsv.EXCEL_MAX_ROWS = max_rows
+    
+    wb = load_workbook(output_excel, read_only=True)
+    device_rows = [row for name in wb.sheetnames if name.startswith("DeviceLevelData")
+                   for row in list(wb[name].values)[1:]]
+    wb.close()
+    shutil.rmtree(temp_dir)
+    
+    # The same value in a frame that arrives out of order, so it goes through the spool file
+    stream = QueryStream(io.StringIO("##QUERY_BEGIN Device_Level_Data\n" + header + "".join(lines)
+                                     + "##QUERY_END Device_Level_Data OK\n"))
+    stream.get("Group_Hierarchy_Path")
+    spooled = list(stream.get("Device_Level_Data"))
+    
+    all_passed = report_checks([
+        ("every row written, none dropped from the last part",
+         result == 0 and [row[1] for row in device_rows] == [f"S{i:05d}" for i in range(rows)]),
+        ("columns not shifted", all(row[5] == "RV50" for row in device_rows)),
+        ("spooled frame keeps one line per row", spooled == [header] + lines),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Carriage returns stay inside their field")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Carriage return split a row")
+        return False
+
+def test_scenario_13_numeric_converters():
+    """Test that int/float columns convert plain MySQL numbers only"""
+    print_test_header("Scenario 13: Numeric column converters")
+    
+    # int()/float() alone would accept all of these
+    loose = ["1_000", " 12 ", "12\t", "\u0661\u0662", "nan", "inf", "1_0.5", " 1.5"]
+    key = order_by_key(["id"], ["id"], {"id": "int"})
+    
+    all_passed = report_checks([
+        ("plain integers converted", [to_int(v) for v in ["12", "-5", "+7", "0"]] == [12, -5, 7, 0]),
+        ("plain decimals converted",
+         [to_float(v) for v in ["1.5", "-0.25", ".5", "5.", "1e-5", "2.5E+10", "3"]]
+         == [1.5, -0.25, 0.5, 5.0, 1e-5, 2.5e10, 3.0]),
+        ("loose or non-numeric ints stay text",
+         all(to_int(v) is v for v in loose + ["1.5", "abc", "NULL", "-", ""])),
+        ("loose or non-numeric floats stay text",
+         all(to_float(v) is v for v in loose + ["abc", "NULL", "-", ".", "1e", ""])),
+        ("loose values sort after the numbers",
+         sorted(["1_000", "20", "NULL", "3"], key=key) == ["NULL", "3", "20", "1_000"]),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Only plain numbers are converted")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Numeric converters accepted or rejected the wrong values")
+        return False
+
+def test_scenario_14_stream_arrival_order():
+    """Test that stream frames are written as they arrive and the sheets still follow QUERIES order"""
+    print_test_header("Scenario 14: Stream frames in arrival order")
+    
+    device_frame = ("##QUERY_BEGIN Device_Level_Data\nserial\tname\tfullpath\tdevice_type\tplatform\tlast_comm\n"
+                    "S1\tN1\tA...B\tgw\tRV50\t2024-01-02 03:04:05\n##QUERY_END Device_Level_Data OK\n")
+    other_frames = ("##QUERY_BEGIN Group_Hierarchy_Path\nrootid\trootgroup\tgroupid\tgroupname\n1\tA\t2\tB\n"
+                    "##QUERY_END Group_Hierarchy_Path OK\n"
+                    "##QUERY_BEGIN Gateway_Count_By_Group\ngroupname\tgroupid\tnum_gateways\nB\t2\t1\n"
+                    "##QUERY_END Gateway_Count_By_Group OK\n"
+                    "##QUERY_BEGIN User_List_With_Groups\ngroupid\tgroupname\tusername\temail\n"
+                    "##QUERY_END User_List_With_Groups OK\n")
+    # Flat im_group extract: devices come with groupids, so their frame waits for the group tree
+    flat_frames = ("##QUERY_BEGIN Device_Level_Data\nserial\tname\tgroupid\tdevice_type\tplatform\tlast_comm\n"
+                   "S1\tN1\t2\tgw\tRV50\t2024-01-02 03:04:05\n##QUERY_END Device_Level_Data OK\n"
+                   "##QUERY_BEGIN Group_Hierarchy_Path\ngroupid\tparentgroupid\tlabel\n1\t0\tA\n2\t1\tB\n"
+                   "##QUERY_END Group_Hierarchy_Path OK\n")
+    expected_sheets = ["Queries", "GroupHierarchyPath", "GatewayCountByGroup", "UserListWithGroups",
+                       "GatewaysLast30Days", "DeviceLevelData"]
+    
+    spooled = []
+    spool = QueryStream._spool
+    
+    def recording_spool(self, query_name, first=None):
+        spooled.append(query_name)
+        return spool(self, query_name, first)
+    
+    temp_dir = tempfile.mkdtemp()
+    results = {}
+    QueryStream._spool = recording_spool
+    try:
+        for label, frames, options in [("openpyxl", device_frame + other_frames, {}),
+                                       ("streaming", device_frame + other_frames, {"streaming": True}),
+                                       ("native", device_frame + other_frames, {"engine": "native"}),
+                                       ("flat groups", flat_frames, {})]:
+            del spooled[:]
+            output_excel = os.path.join(temp_dir, f"test_{label.replace(' ', '_')}.xlsx")
+            result = create_excel_from_stream(io.StringIO(frames), output_excel, "TEST14", **options)
+            wb = load_workbook(output_excel, read_only=True)
+            device_rows = list(wb["DeviceLevelData"].values)
+            results[label] = (result, list(spooled), wb.sheetnames, device_rows[1][3] if len(device_rows) > 1 else None)
+            wb.close()
+    finally:
+        QueryStream._spool = spool
+        shutil.rmtree(temp_dir)
+    
+    all_passed = report_checks(
+        [(f"{label}: Device_Level_Data framed first, nothing spooled, sheets in query order",
+          results[label][:3] == (0, [], expected_sheets) and results[label][3] == "A...B")
+         for label in ("openpyxl", "streaming", "native")]
+        + [("flat groups: only the device frame waits for the group tree",
+            results["flat groups"][:3] == (0, ["Device_Level_Data"], expected_sheets)
+            and results["flat groups"][3] == "A...B")])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Frames written in arrival order without spooling")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Frames spooled or sheets out of order")
+        return False
+
+def test_scenario_15_file_only_backends():
+    """Test that a run without a workbook backend reports its files, not an Excel file"""
+    print_test_header("Scenario 15: Per-query files without a workbook")
+    
+    temp_dir = tempfile.mkdtemp()
+    output_excel = os.path.join(temp_dir, "test_files.xlsx")
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = create_excel_from_rows({"Gateway_Count_By_Group": ["groupname\tgroupid\tnum_gateways\n", "G\t1\t2\n"]},
+                                        output_excel, "TEST15", backends=["csv.gz"])
+    files = sorted(os.listdir(temp_dir))
+    shutil.rmtree(temp_dir)
+    success = [line for line in output.getvalue().splitlines() if line.startswith("SUCCESS:")]
+    
+    all_passed = report_checks([
+        ("no workbook written", result == 0 and "test_files.xlsx" not in files),
+        ("one file per query", len(files) == 5 and all(name.endswith(".csv.gz") for name in files)),
+        ("SUCCESS line lists the files, not Excel sheets",
+         len(success) == 1 and "Excel" not in success[0] and all(name in success[0] for name in files)),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: File-only run reports its files")
+        return True
+    else:
+        print("\n❌ TEST FAILED: File-only run misreported")
+        return False
+
+def test_scenario_16_tarball_input(devices=300, part_rows=100):
+    """Test that a tarball converts like its TSV directory, streamed serially and extracted for workers"""
+    print_test_header(f"Scenario 16: Tarball input ({devices} devices, {part_rows} rows per part)")
+    
+    temp_dir = tempfile.mkdtemp()
+    tsv_dir = os.path.join(temp_dir, "tsv")
+    generate_dataset(tsv_dir, devices=devices, roots=3, depth=2, fanout=2)
+    tarball = os.path.join(temp_dir, "mysql_results_TEST16_20260101_000000.tar.gz")
+    with tarfile.open(tarball, "w:gz") as tar:
+        for name in sorted(os.listdir(tsv_dir)):
+            tar.add(os.path.join(tsv_dir, name), f"{name[:-len('.tsv')]}_TEST16_20260101_000000.tsv")
+    
+    def data_sheets(path):
+        wb = load_workbook(path, read_only=True)
+        sheets = {name: list(wb[name].values) for name in wb.sheetnames if name != "Queries"}
+        wb.close()
+        return sheets
+    
+    tmp_before = set(os.listdir(tempfile.gettempdir()))
+    max_rows = create_excel_from_tsv.EXCEL_MAX_ROWS
+    create_excel_from_tsv.EXCEL_MAX_ROWS = part_rows
+    try:
+        results = []
+        outputs = {}
+        for label, source, jobs in [("directory", tsv_dir, 1), ("tarball", tarball, 1),
+                                    ("tarball, 2 jobs", tarball, 2)]:
+            output_excel = os.path.join(temp_dir, f"test_{len(outputs)}.xlsx")
+            results.append(create_excel_from_tsv_files(source, output_excel, "TEST16", engine="native", jobs=jobs))
+            outputs[label] = data_sheets(output_excel)
+    finally:
+        create_excel_from_tsv.EXCEL_MAX_ROWS = max_rows
+    leftovers = [name for name in set(os.listdir(tempfile.gettempdir())) - tmp_before if name.startswith("tsv_")]
+    shutil.rmtree(temp_dir)
+    
+    all_passed = report_checks([
+        ("every conversion succeeded", results == [0, 0, 0]),
+        ("devices split into parts", "DeviceLevelData_3" in outputs["directory"]),
+        ("streamed tarball members match the directory", outputs["tarball"] == outputs["directory"]),
+        ("extracted tarball members match the directory", outputs["tarball, 2 jobs"] == outputs["directory"]),
+        ("extraction directory removed", leftovers == []),
+    ])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Tarball converted like its TSV directory")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Tarball conversion differs")
+        return False
+
+def test_scenario_17_row_wider_than_header():
+    """Test that columns beyond the header are sized like the others"""
+    print_test_header("Scenario 17: Row wider than its header")
+    
+    temp_dir = tempfile.mkdtemp()
+    widths = {}
+    for engine in ("openpyxl", "native"):
+        output_excel = os.path.join(temp_dir, f"test_wide_{engine}.xlsx")
+        create_excel_from_rows({"Gateways_Registered_Last_30_Days": ["gateways_registered_last_30_days\n",
+                                                                      "3\textra column value\n"]},
+                               output_excel, "TEST17", engine=engine)
+        ws = load_workbook(output_excel)["GatewaysLast30Days"]
+        widths[engine] = (ws.column_dimensions["C"].width, ws["C2"].value)
+    shutil.rmtree(temp_dir)
+    
+    all_passed = report_checks([(f"{engine}: extra column written and sized to its value",
+                                 widths[engine] == (len("extra column value") + 2, "extra column value"))
+                                for engine in widths])
+    
+    if all_passed:
+        print("\n✅ TEST PASSED: Extra columns sized")
+        return True
+    else:
+        print("\n❌ TEST FAILED: Extra columns not sized")
+        return False
+
 def run_all_tests():
     """Run all test scenarios"""
     print("\n" + "#"*80)
@@ -370,7 +930,19 @@ def run_all_tests():
         test_scenario_2_empty_tsv_files,
         test_scenario_3_header_only_tsv,
         test_scenario_4_valid_data,
-        test_scenario_5_mixed_conditions
+        test_scenario_5_mixed_conditions,
+        test_scenario_6_synthetic_dataset,
+        test_scenario_7_rows_api,
+        test_scenario_8_stream_frame_failures,
+        test_scenario_9_external_sort,
+        test_scenario_10_group_tree,
+        test_scenario_11_failed_parts_error_sheets,
+        test_scenario_12_carriage_return_in_field,
+        test_scenario_13_numeric_converters,
+        test_scenario_14_stream_arrival_order,
+        test_scenario_15_file_only_backends,
+        test_scenario_16_tarball_input,
+        test_scenario_17_row_wider_than_header
     ]
     
     results = []
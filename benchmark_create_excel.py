@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Script: benchmark_create_excel.py
+Purpose: Benchmarks for create_excel_from_tsv.py on synthetic AMM data
+         generate - write a synthetic TSV set for the five queries (group tree, users, devices)
+         writers  - time and memory-profile each writer mode, save the results as JSON
+         compare  - compare two JSON result files and flag regressions
+         sanitize - per-row cost of control-character sanitizing on a synthetic Device_Level_Data file
+Author: Infrastructure Team
+Usage: python3 benchmark_create_excel.py generate <tsv_dir> [--devices N] [--depth D] [--fanout F]
+       python3 benchmark_create_excel.py writers [--devices 10000,100000] [--modes ...] [--output results.json]
+       python3 benchmark_create_excel.py compare <baseline.json> <current.json> [--threshold 0.10]
+       python3 benchmark_create_excel.py sanitize [--rows N] [--dirty-ratio R]
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from create_excel_from_tsv import sanitize, sanitize_text, TsvRowSource
+
+CONVERTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "create_excel_from_tsv.py")
+
+# n.platform codes and names from the Device_Level_Data CASE expression, with a rough
+# share of the installed base for each (anything else is reported as "<code>_missing")
+PLATFORM_WEIGHTS = {
+    0: ("MG90", 6), 1: ("oMG2000", 1), 2: ("oMG500", 1), 4: ("MG90", 2),
+    64: ("GNX3", 1), 65: ("GNX6", 1), 100: ("ES440", 3), 101: ("ES450", 4),
+    107: ("GX400", 3), 108: ("GX440", 5), 109: ("GX450", 6), 110: ("LS300", 3),
+    113: ("RV50", 18), 114: ("MP70", 8), 115: ("RV50X", 12), 117: ("LX60", 3),
+    118: ("LX40", 6), 119: ("RV55", 10), 120: ("XR60", 2), 121: ("XR80", 3),
+    122: ("XR90", 1), 123: ("RX55", 1),
+}
+MISSING_PLATFORM_RATIO = 0.002
+
+# Platform names produced by the Device_Level_Data CASE expression
+PLATFORMS = sorted({name for name, _ in PLATFORM_WEIGHTS.values()})
+
+QUERY_HEADERS = {
+    "Group_Hierarchy_Path": ["rootid", "rootgroup", "groupid", "groupname"],
+    "Gateway_Count_By_Group": ["groupname", "groupid", "num_gateways"],
+    "User_List_With_Groups": ["groupid", "groupname", "username", "email"],
+    "Gateways_Registered_Last_30_Days": ["gateways_registered_last_30_days"],
+    "Device_Level_Data": ["serial", "name", "fullpath", "device_type", "platform", "last_comm"],
+}
+DEVICE_HEADERS = QUERY_HEADERS["Device_Level_Data"]
+
+# Writer modes benchmarked by default: name -> converter flags
+WRITER_MODES = {
+    "openpyxl": ["--engine", "openpyxl"],
+    "streaming": ["--streaming", "--engine", "openpyxl"],
+    "native": ["--engine", "native"],
+    "native-jobs4": ["--engine", "native", "--jobs", "4"],
+    # Per-query file backends on their own (no workbook)
+    "csv.gz": ["--backend", "csv.gz"],
+    "parquet": ["--backend", "parquet"],
+}
+
+# Devices without a ReportIdleTime stat have a NULL last_comm (sorted first by ORDER BY last_comm)
+NO_HEARTBEAT_RATIO = 0.01
+# Devices whose group is not under a root group have a NULL fullpath (LEFT JOIN grp_path)
+UNGROUPED_RATIO = 0.005
+ACTIVE_SECONDS = 30 * 86400
+MAX_IDLE_SECONDS = 365 * 86400
+
+
+def legacy_sanitize(value):
+    """The original per-cell sanitizer, kept as the benchmark baseline"""
+    if isinstance(value, str):
+        return re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', value)
+    return value
+
+
+def build_group_tree(roots=20, depth=4, fanout=3, seed=42):
+    """
+    Synthetic im_group tree: `roots` top-level groups, each `depth` levels deep with `fanout` children
+    fullpath follows the grp_path CTE in Device_Level_Data: root label at depth 1, then
+    CONCAT(parent's rootname, "...", label) where rootname is the parent's parent label -
+    so below depth 2 the prefix is the grandparent's label, not the full chain
+    """
+    rnd = random.Random(seed)
+    groups = []
+    next_id = 1
+    level = []
+    for r in range(roots):
+        label = f"Customer {r + 1:03d}"
+        group = {"groupid": next_id, "parentgroupid": 0, "label": label, "rootid": next_id,
+                 "rootlabel": label, "rootname": label, "fullpath": label}
+        groups.append(group)
+        level.append(group)
+        next_id += 1
+    for d in range(2, depth + 1):
+        children = []
+        for parent in level:
+            for _ in range(rnd.randint(max(1, fanout - 1), fanout + 1)):
+                label = f"{'Region' if d == 2 else 'Site'} {next_id}"
+                group = {"groupid": next_id, "parentgroupid": parent["groupid"], "label": label,
+                         "rootid": parent["rootid"], "rootlabel": parent["rootlabel"], "rootname": parent["label"],
+                         "fullpath": f"{parent['rootname']}...{label}"}
+                groups.append(group)
+                children.append(group)
+                next_id += 1
+        level = children
+    return groups
+
+
+def write_device_level_tsv(path, rows, groups=None, dirty_ratio=0.001, seed=42, now=None):
+    """
+    Write a synthetic Device_Level_Data TSV ordered by last_comm like the query
+    dirty_ratio of the names carry a control character; returns per-group active device counts
+    """
+    rnd = random.Random(seed)
+    now = now or datetime(2026, 2, 1)
+    groups = groups or build_group_tree(seed=seed)
+    codes = list(PLATFORM_WEIGHTS)
+    weights = [weight for _, weight in PLATFORM_WEIGHTS.values()]
+    active_counts = {}
+
+    no_heartbeat = int(rows * NO_HEARTBEAT_RATIO)
+    # Sorted last_comm without holding every timestamp: walk forward in random gaps
+    mean_gap = MAX_IDLE_SECONDS / max(rows - no_heartbeat, 1)
+    idle = float(MAX_IDLE_SECONDS)
+
+    with open(path, 'w') as f:
+        f.write('\t'.join(DEVICE_HEADERS) + '\n')
+        for i in range(rows):
+            code = rnd.choices(codes, weights)[0]
+            if rnd.random() < MISSING_PLATFORM_RATIO:
+                platform_name = f"{rnd.randint(200, 260)}_missing"
+            else:
+                platform_name = PLATFORM_WEIGHTS[code][0]
+            name = f"{platform_name} {i}"
+            if rnd.random() < dirty_ratio:
+                name += '\x07'
+
+            if rnd.random() < UNGROUPED_RATIO:
+                fullpath = "NULL"
+                group = None
+            else:
+                group = rnd.choice(groups)
+                fullpath = group["fullpath"]
+
+            if i < no_heartbeat:
+                last_comm = "NULL"
+            else:
+                idle = max(idle - rnd.expovariate(1 / mean_gap), 0)
+                last_comm = f"{now - timedelta(seconds=int(idle)):%Y-%m-%d %H:%M:%S}"
+                if group is not None and idle < ACTIVE_SECONDS:
+                    active_counts[group["groupid"]] = active_counts.get(group["groupid"], 0) + 1
+
+            f.write(f"{code:02X}{i:012d}\t{name}\t{fullpath}\tGateway\t{platform_name}\t{last_comm}\n")
+    return active_counts
+
+
+def write_query_tsv(path, query_name, rows):
+    """Write one query result in mysql --batch format (header line, tab-separated values)"""
+    with open(path, 'w') as f:
+        f.write('\t'.join(QUERY_HEADERS[query_name]) + '\n')
+        for row in rows:
+            f.write('\t'.join(str(value) for value in row) + '\n')
+
+
+def generate_dataset(tsv_dir, devices=10000, roots=20, depth=4, fanout=3, users=None,
+                     dirty_ratio=0.001, seed=42):
+    """
+    Write <Query>.tsv files for all five queries into tsv_dir, as the converter expects them
+    Returns a summary dict (row counts per query and the generator parameters)
+    """
+    os.makedirs(tsv_dir, exist_ok=True)
+    rnd = random.Random(seed)
+    groups = build_group_tree(roots, depth, fanout, seed)
+    by_id = {group["groupid"]: group for group in groups}
+
+    active_counts = write_device_level_tsv(os.path.join(tsv_dir, "Device_Level_Data.tsv"),
+                                           devices, groups, dirty_ratio, seed)
+
+    hierarchy = sorted(groups, key=lambda g: (g["rootid"], g["groupid"]))
+    write_query_tsv(os.path.join(tsv_dir, "Group_Hierarchy_Path.tsv"), "Group_Hierarchy_Path",
+                    [(g["rootid"], g["rootlabel"], g["groupid"], g["label"]) for g in hierarchy])
+
+    counts = sorted(((by_id[gid]["label"], gid, n) for gid, n in active_counts.items()))
+    write_query_tsv(os.path.join(tsv_dir, "Gateway_Count_By_Group.tsv"), "Gateway_Count_By_Group", counts)
+
+    users = users if users is not None else max(devices // 200, 10)
+    permissions = []
+    for u in range(users):
+        username = f"user{u:05d}"
+        for group in rnd.sample(groups, min(rnd.randint(1, 3), len(groups))):
+            permissions.append((group["groupid"], group["label"], username, f"{username}@example.com"))
+    permissions.sort(key=lambda p: (p[0], p[1]))
+    write_query_tsv(os.path.join(tsv_dir, "User_List_With_Groups.tsv"), "User_List_With_Groups", permissions)
+
+    registered = max(devices // 60, 1)
+    write_query_tsv(os.path.join(tsv_dir, "Gateways_Registered_Last_30_Days.tsv"),
+                    "Gateways_Registered_Last_30_Days", [(registered,)])
+
+    return {
+        "devices": devices, "groups": len(groups), "depth": depth, "fanout": fanout, "roots": roots,
+        "user_permissions": len(permissions), "active_groups": len(counts), "seed": seed,
+    }
+
+
+def run_converter(flags, tsv_dir, excel_file, log_file):
+    """
+    Run the converter in a child process; returns (exit code, seconds, peak RSS in MB)
+    Peak RSS comes from wait4 on the child, so each mode is measured on its own
+    """
+    with open(log_file, 'w') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, CONVERTER, *flags, tsv_dir, excel_file, "BENCH"],
+                                stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, elapsed, usage.ru_maxrss / 1024
+
+
+def git_revision():
+    """Short commit of the converter being benchmarked (None outside a git checkout)"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(CONVERTER),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_writers(device_counts, modes, output, depth, fanout, keep=False):
+    """Generate a dataset per device count, run every writer mode on it and save the results as JSON"""
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "runs": [],
+    }
+    tmp_dir = tempfile.mkdtemp(prefix="bench_writers_")
+    try:
+        for devices in device_counts:
+            tsv_dir = os.path.join(tmp_dir, f"tsv_{devices}")
+            start = time.perf_counter()
+            dataset = generate_dataset(tsv_dir, devices, depth=depth, fanout=fanout)
+            print(f"Dataset {devices:,} devices: {dataset['groups']:,} groups, "
+                  f"{dataset['user_permissions']:,} user rows ({time.perf_counter() - start:.1f}s to generate)")
+            input_bytes = sum(os.path.getsize(os.path.join(tsv_dir, name)) for name in os.listdir(tsv_dir))
+
+            for mode in modes:
+                excel_file = os.path.join(tmp_dir, f"{mode}_{devices}.xlsx")
+                log_file = os.path.join(tmp_dir, f"{mode}_{devices}.log")
+                exit_code, seconds, peak_rss_mb = run_converter(WRITER_MODES[mode], tsv_dir, excel_file, log_file)
+                # The workbook and/or the <name>_<Query>.<ext> files of per-query backends
+                output_files = glob.glob(os.path.join(tmp_dir, f"{mode}_{devices}.xlsx")) + \
+                    glob.glob(os.path.join(tmp_dir, f"{glob.escape(mode)}_{devices}_*"))
+                output_bytes = sum(os.path.getsize(path) for path in output_files)
+                run = {
+                    "mode": mode, "devices": devices, "exit_code": exit_code,
+                    "seconds": round(seconds, 3), "rows_per_sec": round(devices / seconds) if seconds else None,
+                    "peak_rss_mb": round(peak_rss_mb, 1), "input_bytes": input_bytes,
+                    "output_bytes": output_bytes, "dataset": dataset,
+                }
+                results["runs"].append(run)
+                status = "OK" if exit_code == 0 else f"FAILED (exit {exit_code}, see {log_file})"
+                print(f"  {mode:<14} {seconds:8.2f} s  {run['rows_per_sec'] or 0:>9,} rows/s  "
+                      f"{peak_rss_mb:8.1f} MB peak  {output_bytes / 1048576:7.1f} MB out   {status}")
+                if not keep:
+                    for path in output_files:
+                        os.remove(path)
+    finally:
+        if keep:
+            print(f"Kept benchmark files in {tmp_dir}")
+        else:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+    return 0 if all(run["exit_code"] == 0 for run in results["runs"]) else 1
+
+
+def compare_results(baseline_file, current_file, threshold):
+    """Print time and memory ratios per (mode, devices); returns 1 if anything regressed beyond threshold"""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(current_file) as f:
+        current = json.load(f)
+
+    base_runs = {(run["mode"], run["devices"]): run for run in baseline["runs"]}
+    print(f"Baseline {baseline.get('revision')} ({baseline.get('timestamp')}) vs "
+          f"current {current.get('revision')} ({current.get('timestamp')})")
+
+    regressions = 0
+    for run in current["runs"]:
+        base = base_runs.get((run["mode"], run["devices"]))
+        if base is None or not base["seconds"] or not base["peak_rss_mb"]:
+            continue
+        time_ratio = run["seconds"] / base["seconds"]
+        rss_ratio = run["peak_rss_mb"] / base["peak_rss_mb"]
+        flag = ""
+        if time_ratio > 1 + threshold or rss_ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"  {run['mode']:<14} {run['devices']:>9,} devices  time x{time_ratio:.2f}  "
+              f"peak RSS x{rss_ratio:.2f}{flag}")
+    return 1 if regressions else 0
+
+
+def bench_sanitize(rows, dirty_ratio):
+    """Time the legacy, per-cell and whole-row sanitizers over the same synthetic file"""
+    tmp_dir = tempfile.mkdtemp(prefix="bench_sanitize_")
+    tsv_file = os.path.join(tmp_dir, "Device_Level_Data.tsv")
+    try:
+        write_device_level_tsv(tsv_file, rows, dirty_ratio=dirty_ratio)
+        lines = list(TsvRowSource(tsv_file).rows())
+
+        variants = [
+            ("legacy re.sub per cell", lambda line: [legacy_sanitize(v) for v in line.split('\t')]),
+            ("sanitize() per cell", lambda line: [sanitize(v) for v in line.split('\t')]),
+            ("sanitize_text() per row", lambda line: sanitize_text(line).split('\t')),
+        ]
+
+        print(f"Sanitizer benchmark: {rows:,} Device_Level_Data rows, dirty ratio {dirty_ratio}")
+        baseline = None
+        for label, func in variants:
+            start = time.perf_counter()
+            for line in lines:
+                func(line)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"  {label:<26} {elapsed:8.3f} s  {elapsed / rows * 1e6:7.3f} us/row  x{baseline / elapsed:.1f}")
+    finally:
+        if os.path.exists(tsv_file):
+            os.remove(tsv_file)
+        os.rmdir(tmp_dir)
+
+
+def parse_counts(text):
+    """Comma-separated device counts, with k/M suffixes (e.g. 10k,100k,5M)"""
+    counts = []
+    for item in text.split(','):
+        item = item.strip().lower()
+        scale = {'k': 1000, 'm': 1000000}.get(item[-1:], 1)
+        counts.append(int(float(item.rstrip('km')) * scale))
+    return counts
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks for create_excel_from_tsv.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_generate = sub.add_parser("generate", help="Write a synthetic TSV set for the five queries")
+    p_generate.add_argument("tsv_dir")
+    p_generate.add_argument("--devices", type=parse_counts, default=[10000])
+    p_generate.add_argument("--roots", type=int, default=20)
+    p_generate.add_argument("--depth", type=int, default=4)
+    p_generate.add_argument("--fanout", type=int, default=3)
+    p_generate.add_argument("--seed", type=int, default=42)
+
+    p_writers = sub.add_parser("writers", help="Time and memory-profile each writer mode")
+    p_writers.add_argument("--devices", type=parse_counts, default=[10000, 100000],
+                           help="Comma-separated device counts, e.g. 10k,100k,1M,5M")
+    p_writers.add_argument("--modes", default=",".join(WRITER_MODES),
+                           help=f"Comma-separated writer modes ({', '.join(WRITER_MODES)})")
+    p_writers.add_argument("--depth", type=int, default=4)
+    p_writers.add_argument("--fanout", type=int, default=3)
+    p_writers.add_argument("--output", default=f"benchmark_results_{datetime.now():%Y%m%d_%H%M%S}.json")
+    p_writers.add_argument("--keep", action="store_true", help="Keep the generated TSVs, workbooks and logs")
+
+    p_compare = sub.add_parser("compare", help="Compare two JSON result files")
+    p_compare.add_argument("baseline")
+    p_compare.add_argument("current")
+    p_compare.add_argument("--threshold", type=float, default=0.10,
+                           help="Relative slowdown or memory growth reported as a regression (default 0.10)")
+
+    p_sanitize = sub.add_parser("sanitize", help="Per-row sanitizer cost on synthetic Device_Level_Data")
+    p_sanitize.add_argument("--rows", type=int, default=500000)
+    p_sanitize.add_argument("--dirty-ratio", type=float, default=0.001)
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        summary = generate_dataset(args.tsv_dir, args.devices[0], args.roots, args.depth, args.fanout,
+                                   seed=args.seed)
+        print(json.dumps(summary))
+    elif args.command == "writers":
+        modes = [mode.strip() for mode in args.modes.split(',')]
+        unknown = [mode for mode in modes if mode not in WRITER_MODES]
+        if unknown:
+            parser.error(f"unknown writer modes: {', '.join(unknown)}")
+        return bench_writers(args.devices, modes, args.output, args.depth, args.fanout, args.keep)
+    elif args.command == "compare":
+        return compare_results(args.baseline, args.current, args.threshold)
+    elif args.command == "sanitize":
+        bench_sanitize(args.rows, args.dirty_ratio)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
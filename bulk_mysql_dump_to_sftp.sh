@@ -12,15 +12,25 @@ SFTP_HOST="ftp.semtech.com"
 SFTP_USER="SW_AMM_UAT"
 SFTP_PASSWORD="C8t7699s"
 SFTP_REMOTE_DIR="/amm-mysql-dumps"
+SFTP_PARALLEL=4  # Parallel transfers in the single end-of-run SFTP upload session
 
 # SSH Configuration
 SSH_USER="imtadmin"
 SSH_KEY="/home/jniwalkar/.ssh/id_ed25519"
 SSH_PORT="2222"
+SSH_CONTROL_PERSIST=3600  # Seconds an idle per-server control connection stays up (closed explicitly when the server is done)
 
 # MySQL Configuration
 MYSQL_USER="root"
 MYSQL_DATABASE="inmotion"
+MYSQL_SINGLE_SESSION=false  # Set to true to run all queries over one MySQL connection in one consistent-snapshot read transaction
+REMOTE_QUERY_PARALLEL=1  # Queries run concurrently on each AMM server (one connection each; ignored with MYSQL_SINGLE_SESSION)
+REMOTE_QUERY_PARALLEL_MAX=3  # Hard cap on REMOTE_QUERY_PARALLEL, to spare the production AMM databases
+DEVICE_DATA_CHUNK_ROWS=0  # >0: extract Device_Level_Data in im_node primary-key chunks of this many nodes, sorted by last_comm on the jumphost
+SORT_ON_JUMPHOST=false  # Set to true to run the report queries without ORDER BY and sort their rows in the converter instead
+SORT_BUFFER_ROWS=200000  # Rows the converter sorts in memory at a time; larger results are spilled to disk and merged
+SORT_TMP_DIR=""  # Directory for the converter's sort spill files (empty: the system temporary directory)
+GROUP_PATHS_ON_JUMPHOST=false  # Set to true to export im_group flat and build the group hierarchy and fullpaths in the converter (no recursive CTEs on the AMM database)
 MONTHLY_RUN_DATE=15
 DATA_RETENTION_MONTHS=3
 
@@ -30,12 +40,26 @@ SUMMARY_EMAIL="sharwani@semtech.com,ataneja@semtech.com,jniwalkar@semtech.com,vg
 
 PYTHON_SCRIPT="/home/jniwalkar/AMM-DEVOPS-EDW-DATA-SCRIPTS/create_excel_from_tsv.py"
 VENV_DIR="/home/jniwalkar/AMM-DEVOPS-EDW-DATA-SCRIPTS/venv"
+EXCEL_STREAMING=false  # Set to true to write workbooks with constant memory (openpyxl write-only sheets)
+EXCEL_ENGINE="openpyxl"  # openpyxl or native (direct XLSX writer, always streaming, much faster)
+EXCEL_JOBS=1  # Worker processes rendering sheets in parallel (native engine only)
+EXCEL_BATCH=false  # Set to true to convert all servers in one Python run after the last one is collected (one interpreter start-up, concurrent workers; keeps every server's TSVs and SSH connection until then)
+EXCEL_BATCH_WORKERS=2  # Servers converted concurrently in batch mode
+EXCEL_PROFILE=""  # "cpu", "memory" or "cpu memory": write converter profiles next to the log files
+EXCEL_COLUMNAR=""  # "parquet" or "arrow": also upload one typed columnar file per query (needs pyarrow in the venv)
+SERVER_PARALLEL=1  # Servers processed concurrently (1 = one after another)
+STREAM_RESULTS=false  # Set to true to pipe query results over ssh straight into the converter (no TSV files or tarball on either side; ignores EXCEL_BATCH)
 
 # Dynamic variables
 DATE=$(date +%Y%m%d_%H%M%S)
 MONTH_YEAR=$(date +%b-%Y)
 LOG_FILE="/home/jniwalkar/AMM-DEVOPS-EDW-DATA-SCRIPTS/logs/mysql_dump_collection_${DATE}.log"
 SUMMARY_FILE="/home/jniwalkar/AMM-DEVOPS-EDW-DATA-SCRIPTS/logs/summary_${DATE}.txt"
+SSH_CONTROL_DIR="/tmp/ssh_mux_${DATE}"  # Control sockets of the per-server multiplexed SSH connections
+METRICS_FILE="/tmp/excel_metrics_${DATE}.jsonl"  # METRICS lines from the converter, one JSON object per server
+HISTORY_FILE="/home/jniwalkar/AMM-DEVOPS-EDW-DATA-SCRIPTS/logs/server_history.tsv"  # Per-server runtimes of earlier runs, used to start the longest servers first
+HISTORY_RUNS=5  # Runs kept per server in HISTORY_FILE
+HISTORY_DEFAULT_SECONDS=900  # Expected runtime of every server when there is no history at all
 
 # Server list
 declare -A SERVERS=(
@@ -69,6 +93,27 @@ declare -A SERVER_FILES
 declare -A SERVER_ERRORS
 declare -A SERVER_SFTP_STATUS
 
+# Per-server work state between collection, Excel conversion and upload
+declare -A SERVER_TSV_INPUT
+declare -A SERVER_REMOTE_TAR
+declare -A SERVER_NODATA
+declare -A SERVER_CLEANUP
+declare -A SERVER_EXCEL
+declare -A SERVER_UPLOADS  # Local files queued for the SFTP upload stage (workbook first)
+declare -A SERVER_S3  # "<path> (<size>)", FAILED, or unset when S3 upload is disabled
+
+declare -A SERVER_STEP_RC  # Return code of the last run_servers step per server
+declare -A SERVER_STAGES  # "<stage>=<seconds> ..." per server, appended by run_step and the batch conversion
+
+# Everything a server step records, copied back from parallel workers (see run_servers)
+SERVER_STATE_ARRAYS="SERVER_STATUS SERVER_FILES SERVER_ERRORS SERVER_SFTP_STATUS SERVER_TSV_INPUT SERVER_REMOTE_TAR SERVER_NODATA SERVER_CLEANUP SERVER_EXCEL SERVER_UPLOADS SERVER_S3 SERVER_STEP_RC SERVER_STAGES"
+
+# Run plan from HISTORY_FILE (see plan_server_order)
+declare -A SERVER_EXPECTED
+SERVER_QUEUE=()
+RUN_START=$SECONDS
+RUN_ESTIMATE=""
+
 # Colors
 RED='\033[0;31m'
 GREEN='\033[0;32m'
@@ -80,6 +125,22 @@ log() {
     echo -e "$(date '+%Y-%m-%d %H:%M:%S') - $1" | tee -a "$LOG_FILE"
 }
 
+relay_python_output() {
+    # Prefix converter output for the log; keep its METRICS JSON lines for the summary email
+    local line
+    while IFS= read -r line; do
+        case "$line" in
+            "METRICS "*|"["*"] METRICS "*) echo "${line#*METRICS }" >> "$METRICS_FILE" ;;
+        esac
+        echo -e "$(date '+%Y-%m-%d %H:%M:%S') - ${BLUE}  PY: ${line}${NC}"
+    done
+}
+
+metric_value() {
+    # Top-level field of a METRICS JSON line (numbers and strings only)
+    echo "$1" | grep -o "\"$2\": *[^,}]*" | head -1 | sed 's/^[^:]*: *//; s/"//g'
+}
+
 check_monthly_schedule() {
     local current_day=$(date +%d | sed 's/^0//')
     if [ "$current_day" -eq "$MONTHLY_RUN_DATE" ]; then
@@ -91,37 +152,52 @@ check_monthly_schedule() {
     fi
 }
 
-cleanup_old_data() {
-    # Cleanup SFTP (always)
-    log "${BLUE}Cleaning up SFTP data older than $DATA_RETENTION_MONTHS months...${NC}"
+sftp_session() {
+    # One authenticated lftp session running the lftp commands read from stdin; output goes to $1
+    local session_log=$1
+    {
+        echo "set sftp:auto-confirm yes"
+        echo "set net:timeout 30"
+        echo "cd ${SFTP_REMOTE_DIR}"
+        cat
+        echo "bye"
+    } | lftp -u "${SFTP_USER},${SFTP_PASSWORD}" sftp://${SFTP_HOST} > "$session_log" 2>&1
+}
 
-    if ! command -v lftp &> /dev/null; then
-        log "${YELLOW}lftp not available - skipping SFTP cleanup${NC}"
-    else
-        # Calculate date threshold (files older than this will be deleted)
-        local retention_days=$((DATA_RETENTION_MONTHS * 30))
-        local threshold_date=$(date -d "$retention_days days ago" +%Y%m%d)
-        
-        log "${BLUE}Deleting files older than $threshold_date from SFTP${NC}"
-        
-        # List and delete old files from SFTP
-        lftp -u "${SFTP_USER},${SFTP_PASSWORD}" sftp://${SFTP_HOST} << EOF >/dev/null 2>&1
-set sftp:auto-confirm yes
-cd ${SFTP_REMOTE_DIR}
-cls -1 | grep -E "^AMM.*\.xlsx$" | while read file; do
-    # Extract date from filename (format: AMMXX_YYYYMMDD_HHMMSS.xlsx)
-    file_date=\$(echo "\$file" | grep -oE "[0-9]{8}" | head -1)
-    if [ -n "\$file_date" ] && [ "\$file_date" -lt "$threshold_date" ]; then
-        rm "\$file"
-    fi
-done
-bye
+sftp_retention_commands() {
+    # lftp commands that list the remote directory into $1 and delete uploads older than
+    # DATA_RETENTION_MONTHS (date taken from the file name: AMMXX_YYYYMMDD_HHMMSS...)
+    local listing=$1
+    local retention_days=$((DATA_RETENTION_MONTHS * 30))
+    local threshold_date=$(date -d "$retention_days days ago" +%Y%m%d)
+
+    echo "$(date '+%Y-%m-%d %H:%M:%S') - Deleting SFTP files older than $threshold_date" >> "$LOG_FILE"
+
+    cat << EOF
+cls -1 > ${listing}
+!awk -v threshold=${threshold_date} '/^AMM.*\.(xlsx|parquet|arrow)$/ && match(\$0, /[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]/) && substr(\$0, RSTART, 8) + 0 < threshold { print "rm " \$0 }' ${listing} > ${listing}.rm
+source ${listing}.rm
 EOF
+}
 
-        if [ $? -eq 0 ]; then
-            log "${GREEN}SFTP cleanup completed${NC}"
+cleanup_old_data() {
+    # SFTP retention normally runs inside the upload session (upload_sftp_batch); pass "sftp"
+    # to give it a session of its own (cleanup-only runs)
+    if [ "$1" = sftp ]; then
+        log "${BLUE}Cleaning up SFTP data older than $DATA_RETENTION_MONTHS months...${NC}"
+
+        if ! command -v lftp &> /dev/null; then
+            log "${YELLOW}lftp not available - skipping SFTP cleanup${NC}"
         else
-            log "${YELLOW}SFTP cleanup had some issues${NC}"
+            local listing="/tmp/sftp_listing_${DATE}"
+            sftp_retention_commands "$listing" | sftp_session "/tmp/sftp_cleanup_${DATE}.log"
+
+            if [ $? -eq 0 ]; then
+                log "${GREEN}SFTP cleanup completed${NC}"
+            else
+                log "${YELLOW}SFTP cleanup had some issues${NC}"
+            fi
+            rm -f "$listing" "${listing}.rm" "/tmp/sftp_cleanup_${DATE}.log"
         fi
     fi
 
@@ -176,19 +252,63 @@ create_monthly_directory() {
     fi
 }
 
+ssh_control_path() {
+    echo "$SSH_CONTROL_DIR/$1.sock"
+}
+
+server_ssh() {
+    # ssh <server> <command>: runs over the server's control connection (a fresh login if there is none)
+    local server_name=$1
+    shift
+    ssh -i "$SSH_KEY" -p "$SSH_PORT" -o ConnectTimeout=10 -o StrictHostKeyChecking=no -o ControlPath="$(ssh_control_path "$server_name")" "$SSH_USER@${SERVERS[$server_name]}" "$@"
+}
+
+server_scp() {
+    # scp over the server's control connection; remote paths are given as $SSH_USER@<ip>:<path>
+    local server_name=$1
+    shift
+    scp -i "$SSH_KEY" -P "$SSH_PORT" -o ConnectTimeout=10 -o StrictHostKeyChecking=no -o ControlPath="$(ssh_control_path "$server_name")" -q "$@"
+}
+
+close_ssh_master() {
+    # Tear down one server's control connection (no-op if it is not open)
+    local server_name=$1
+    local control_path=$(ssh_control_path "$server_name")
+    [ -S "$control_path" ] || return 0
+    ssh -o ControlPath="$control_path" -O exit "$SSH_USER@${SERVERS[$server_name]}" >/dev/null 2>&1
+    rm -f "$control_path"
+}
+
+close_ssh_masters() {
+    # Tear down every control connection still open (end of run, or on exit)
+    local control_path
+    for control_path in "$SSH_CONTROL_DIR"/*.sock; do
+        [ -S "$control_path" ] && close_ssh_master "$(basename "$control_path" .sock)"
+    done
+    rm -rf "$SSH_CONTROL_DIR"
+}
+
 test_ssh_connection() {
+    # Open the server's multiplexed control connection (the only SSH handshake of its run) and
+    # check it; every later ssh/scp for this server reuses it until close_ssh_master
     local server_name=$1
     local server_ip=${SERVERS[$server_name]}
+    local control_path=$(ssh_control_path "$server_name")
 
     log "${BLUE}Testing SSH: $server_name ($server_ip)${NC}"
 
-    ssh -i "$SSH_KEY" -p "$SSH_PORT" -o ConnectTimeout=10 -o StrictHostKeyChecking=no "$SSH_USER@$server_ip" "echo 'OK'" >/dev/null 2>&1
+    mkdir -p "$SSH_CONTROL_DIR" && chmod 700 "$SSH_CONTROL_DIR"
+    close_ssh_master "$server_name"
 
-    if [ $? -eq 0 ]; then
+    if ssh -i "$SSH_KEY" -p "$SSH_PORT" -o ConnectTimeout=10 -o StrictHostKeyChecking=no -o ServerAliveInterval=60 \
+           -o ControlMaster=yes -o ControlPath="$control_path" -o ControlPersist="$SSH_CONTROL_PERSIST" \
+           -f -N "$SSH_USER@$server_ip" >/dev/null 2>&1 \
+       && server_ssh "$server_name" "echo 'OK'" >/dev/null 2>&1; then
         log "${GREEN}SSH successful${NC}"
         return 0
     else
         log "${RED}SSH failed${NC}"
+        close_ssh_master "$server_name"
         SERVER_STATUS[$server_name]="FAILED"
         SERVER_ERRORS[$server_name]="SSH connection failed"
         return 1
@@ -227,8 +347,13 @@ check_environment() {
     fi
 
     "$VENV_DIR/bin/python3" -c "import openpyxl" 2>/dev/null || "$VENV_DIR/bin/pip" install --quiet openpyxl
+    if [ -n "$EXCEL_COLUMNAR" ]; then
+        "$VENV_DIR/bin/python3" -c "import pyarrow" 2>/dev/null || "$VENV_DIR/bin/pip" install --quiet pyarrow || log "${YELLOW}pyarrow install failed - columnar export will be skipped${NC}"
+    fi
 
     [ ! -f "$PYTHON_SCRIPT" ] && { log "${RED}Python script not found: $PYTHON_SCRIPT${NC}"; exit 1; }
+    [ ! -f "$(dirname "$PYTHON_SCRIPT")/xlsx_stream_writer.py" ] && { log "${RED}xlsx_stream_writer.py not found next to $PYTHON_SCRIPT${NC}"; exit 1; }
+    [ ! -f "$(dirname "$PYTHON_SCRIPT")/columnar_export.py" ] && { log "${RED}columnar_export.py not found next to $PYTHON_SCRIPT${NC}"; exit 1; }
 
     log "${GREEN}Environment ready${NC}"
 }
@@ -243,59 +368,141 @@ SERVER_NAME="SERVER_NAME_PLACEHOLDER"
 DATE="DATE_PLACEHOLDER"
 MYSQL_USER="MYSQL_USER_PLACEHOLDER"
 MYSQL_DATABASE="MYSQL_DATABASE_PLACEHOLDER"
+STREAM="STREAM_PLACEHOLDER"
+SINGLE_SESSION="SINGLE_SESSION_PLACEHOLDER"
+QUERY_PARALLEL="QUERY_PARALLEL_PLACEHOLDER"
+CHUNK_ROWS="CHUNK_ROWS_PLACEHOLDER"
+UNSORTED="UNSORTED_PLACEHOLDER"
+FLAT_GROUPS="FLAT_GROUPS_PLACEHOLDER"
+STREAM_LOCK="/tmp/stream_lock_${SERVER_NAME}_${DATE}"
+
+# Stream mode: query results go to fd 3 (the caller's stdout, piped through gzip), messages to stderr
+if [ "$STREAM" = true ]; then
+    exec 3>&1 1>&2
+fi
 
 echo "=== Starting Export on ${SERVER_NAME} ==="
 
 MYSQL_PASSWORD=$(sudo cat /mnt/amm_data/opt/tomcat/webapps/inmotion/config/amm_secure_data 2>/dev/null)
 [ -z "$MYSQL_PASSWORD" ] && echo "WARNING: Empty password" || echo "Password OK"
 
-echo "Testing MySQL..."
-
-# Retry MySQL connection up to 5 times with longer delays
-RETRY_COUNT=0
 MAX_RETRIES=5
-MYSQL_CONNECTED=false
 
-while [ $RETRY_COUNT -lt $MAX_RETRIES ]; do
-    if [ -n "$MYSQL_PASSWORD" ]; then
-        # Add connection timeout of 10 seconds
-        if sudo mysql -u $MYSQL_USER -p"$MYSQL_PASSWORD" $MYSQL_DATABASE --connect-timeout=10 -e "SELECT 1" >/dev/null 2>&1; then
-            MYSQL_CONNECTED=true
-            break
+wait_for_mysql() {
+    echo "Testing MySQL..."
+
+    # Retry MySQL connection up to 5 times with longer delays
+    local retry_count=0
+
+    while [ $retry_count -lt $MAX_RETRIES ]; do
+        if [ -n "$MYSQL_PASSWORD" ]; then
+            # Add connection timeout of 10 seconds
+            sudo mysql -u $MYSQL_USER -p"$MYSQL_PASSWORD" $MYSQL_DATABASE --connect-timeout=10 -e "SELECT 1" >/dev/null 2>&1 && break
+        else
+            sudo mysql -u $MYSQL_USER $MYSQL_DATABASE --connect-timeout=10 -e "SELECT 1" >/dev/null 2>&1 && break
+        fi
+
+        retry_count=$((retry_count + 1))
+        if [ $retry_count -lt $MAX_RETRIES ]; then
+            echo "MySQL connection attempt $retry_count failed, retrying in 5 seconds..."
+            sleep 5
         fi
+    done
+
+    if [ $retry_count -eq $MAX_RETRIES ]; then
+        echo "ERROR: MySQL connection failed after $MAX_RETRIES attempts"
+        exit 1
+    fi
+
+    echo "MySQL connection: SUCCESS"
+}
+
+mysql_batch() {
+    # Several statements (chunked Device_Level_Data) print one header per result set: only the
+    # first is kept. Every query has a numeric or date column, so no data line equals its header
+    if [ -n "$MYSQL_PASSWORD" ]; then
+        sudo mysql -u $MYSQL_USER -p"$MYSQL_PASSWORD" $MYSQL_DATABASE --batch -e "$1"
     else
-        if sudo mysql -u $MYSQL_USER $MYSQL_DATABASE --connect-timeout=10 -e "SELECT 1" >/dev/null 2>&1; then
-            MYSQL_CONNECTED=true
-            break
+        sudo mysql -u $MYSQL_USER $MYSQL_DATABASE --batch -e "$1"
+    fi | awk 'NR == 1 { header = $0 } NR == 1 || $0 != header'
+    return ${PIPESTATUS[0]}
+}
+
+stream_query() {
+    # Write one framed result to fd 3 as mysql produces it; the converter on the jumphost parses
+    # it on arrival. A failed query is framed as FAILED so its sheet becomes a placeholder
+    # Parallel queries share fd 3 through STREAM_LOCK: the query holding it streams live, the
+    # others spool their result and send the whole frame once the lock is theirs. The converter
+    # writes frames as they arrive, except that with FLAT_GROUPS it needs Group_Hierarchy_Path's
+    # before Device_Level_Data's: that one waits for the group frame and then for the lock instead
+    local query_name=$1
+    local query_sql=$2
+    local rows_file="/tmp/rows_${query_name}_${SERVER_NAME}_${DATE}"
+    local spool_file=""
+    local status
+
+    echo "Running: $query_name (streamed)"
+
+    if [ "$QUERY_PARALLEL" -gt 1 ]; then
+        exec 9>>"$STREAM_LOCK"
+        if [ "$FLAT_GROUPS" = true ] && [ "$query_name" = "Device_Level_Data" ]; then
+            until [ -e "${STREAM_LOCK}_Group_Hierarchy_Path" ]; do
+                sleep 1
+            done
+            flock 9
+        else
+            flock -n 9 || spool_file="/tmp/spool_${query_name}_${SERVER_NAME}_${DATE}"
         fi
     fi
 
-    RETRY_COUNT=$((RETRY_COUNT + 1))
-    if [ $RETRY_COUNT -lt $MAX_RETRIES ]; then
-        echo "MySQL connection attempt $RETRY_COUNT failed, retrying in 5 seconds..."
-        sleep 5
+    if [ -n "$spool_file" ]; then
+        mysql_batch "$query_sql" 2>/tmp/err_${query_name}.log | awk -v rows_file="$rows_file" '{ print } END { print NR > rows_file }' > "$spool_file"
+        status=${PIPESTATUS[0]}
+        flock 9
+        { echo "##QUERY_BEGIN ${query_name}"; cat "$spool_file"; } >&3
+        rm -f "$spool_file"
+    else
+        echo "##QUERY_BEGIN ${query_name}" >&3
+        mysql_batch "$query_sql" 2>/tmp/err_${query_name}.log | awk -v rows_file="$rows_file" '{ print } END { print NR > rows_file }' >&3
+        status=${PIPESTATUS[0]}
     fi
-done
+    local lines=$(cat "$rows_file" 2>/dev/null || echo 0)
+    rm -f "$rows_file"
 
-if [ "$MYSQL_CONNECTED" = false ]; then
-    echo "ERROR: MySQL connection failed after $MAX_RETRIES attempts"
-    exit 1
-fi
+    if [ $status -ne 0 ]; then
+        echo "##QUERY_END ${query_name} FAILED" >&3
+        [ "$QUERY_PARALLEL" -gt 1 ] && touch "${STREAM_LOCK}_${query_name}"
+        echo "  FAILED: $query_name"
+        [ -f /tmp/err_${query_name}.log ] && cat /tmp/err_${query_name}.log
+        echo "QUERY_ERROR_${query_name}"
+        return 1
+    fi
 
-echo "MySQL connection: SUCCESS"
+    if [ $lines -eq 0 ]; then
+        echo "No Data Available" >&3
+        echo "  NO_DATA: $query_name (empty)"
+        echo "QUERY_NODATA_${query_name}"
+    elif [ $lines -eq 1 ]; then
+        echo "  NO_DATA: $query_name (header only)"
+        echo "QUERY_NODATA_${query_name}"
+    else
+        echo "  SUCCESS: $query_name ($((lines-1)) rows)"
+    fi
+    echo "##QUERY_END ${query_name} OK" >&3
+    [ "$QUERY_PARALLEL" -gt 1 ] && touch "${STREAM_LOCK}_${query_name}"
+    return 0
+}
 
 run_query() {
     local query_name=$1
     local query_sql=$2
     local output_file="/tmp/${query_name}_${SERVER_NAME}_${DATE}.tsv"
 
+    [ "$STREAM" = true ] && { stream_query "$query_name" "$query_sql"; return; }
+
     echo "Running: $query_name"
 
-    if [ -n "$MYSQL_PASSWORD" ]; then
-        sudo mysql -u $MYSQL_USER -p"$MYSQL_PASSWORD" $MYSQL_DATABASE --batch -e "$query_sql" > "$output_file" 2>/tmp/err_${query_name}.log
-    else
-        sudo mysql -u $MYSQL_USER $MYSQL_DATABASE --batch -e "$query_sql" > "$output_file" 2>/tmp/err_${query_name}.log
-    fi
+    mysql_batch "$query_sql" > "$output_file" 2>/tmp/err_${query_name}.log
 
     if [ $? -ne 0 ]; then
         echo "  FAILED: $query_name"
@@ -316,29 +523,280 @@ run_query() {
     return 0
 }
 
-QUERY_SUCCESS=0
+mysql_session() {
+    # One client connection running the SQL script on stdin; --force carries on past a failed query
+    if [ -n "$MYSQL_PASSWORD" ]; then
+        sudo mysql -u $MYSQL_USER -p"$MYSQL_PASSWORD" $MYSQL_DATABASE --connect-timeout=10 --batch --force
+    else
+        sudo mysql -u $MYSQL_USER $MYSQL_DATABASE --connect-timeout=10 --batch --force
+    fi
+}
 
-QUERY1='WITH RECURSIVE grp_path (groupid, label, rootid, rootlabel) AS (SELECT groupid, label, groupid AS rootid, label AS rootlabel FROM im_group WHERE parentgroupid = 0 UNION ALL SELECT c.groupid, c.label, sup.rootid, sup.rootlabel FROM grp_path AS sup JOIN im_group c ON sup.groupid = c.parentgroupid) SELECT rootid, rootlabel AS rootgroup, groupid, label AS groupname FROM grp_path ORDER BY rootid, groupid;'
-run_query "Group_Hierarchy_Path" "$QUERY1" && QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+session_sql() {
+    # Every query inside one read-only consistent-snapshot transaction, so all result sets see the
+    # same point in time; marker rows frame each result, and @@error_count right after a query
+    # tells whether it failed. Chunked Device_Level_Data's temporary tables are created first
+    [ -n "$DEVICE_CHUNK_SETUP" ] && echo "$DEVICE_CHUNK_SETUP"
+    echo "SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;"
+    echo "START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY;"
+    local i
+    for i in "${!QUERY_NAMES[@]}"; do
+        echo "SELECT '##QUERY_BEGIN ${QUERY_NAMES[$i]}' AS '##MARK';"
+        echo "${QUERY_SQL[$i]}"
+        echo "SELECT CONCAT('##QUERY_END ${QUERY_NAMES[$i]} ', IF(@@error_count = 0, 'OK', 'FAILED')) AS '##MARK';"
+    done
+    echo "COMMIT;"
+}
 
-QUERY2='SELECT grp.label AS groupname, grp.groupid, count(*) AS num_gateways FROM im_group grp JOIN im_node node ON grp.groupid = node.groupid JOIN im_lateststatitem latest ON latest.nodeid = node.nodeid JOIN im_stat stat ON latest.statid = stat.statid WHERE grp.groupid IS NOT NULL AND node.groupid <> 0 AND stat.statlabel = '\''ReportIdleTime'\'' AND latest.value < 2592000 GROUP BY grp.groupid, grp.label ORDER BY grp.label, grp.groupid;'
-run_query "Gateway_Count_By_Group" "$QUERY2" && QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+split_session_output() {
+    # Route the session's output: each query's lines to its own TSV file (stream mode: framed to
+    # stdout, like stream_query), and "<query> STARTED|OK|FAILED <lines>" lines to the status file $1
+    # A query made of several statements (chunked Device_Level_Data) keeps only its first header
+    # line and fails if any of its ##CHUNK markers says FAILED
+    awk -v stream="$STREAM" -v suffix="_${SERVER_NAME}_${DATE}.tsv" -v status_file="$1" '
+        function emit(line) { if (stream == "true") print line; else print line > out }
+        $0 == "##MARK" {
+            if ((getline mark) <= 0) exit
+            split(mark, f, " ")
+            if (f[1] == "##QUERY_BEGIN") {
+                name = f[2]
+                lines = 0
+                chunk_failed = 0
+                out = "/tmp/" name suffix
+                if (stream == "true") print mark
+                print name, "STARTED", 0 > status_file
+            } else if (f[1] == "##CHUNK") {
+                if (f[2] != "OK") chunk_failed = 1
+            } else if (f[1] == "##QUERY_END") {
+                status = (f[3] == "OK" && !chunk_failed) ? "OK" : "FAILED"
+                if (status == "OK" && lines == 0) emit("No Data Available")
+                if (stream == "true") { print "##QUERY_END " name " " status; fflush() } else if (status == "OK" || lines > 0) close(out)
+                print name, status, lines > status_file
+                name = ""
+            }
+            next
+        }
+        name != "" && lines > 0 && $0 == header { next }
+        name != "" { if (lines == 0) header = $0; emit($0); lines++ }
+        END { if (name != "" && stream == "true") print "##QUERY_END " name " FAILED" }
+    '
+}
 
-QUERY3='SELECT perm.groupid, g.label AS groupname, u.loginname AS username, u.email FROM im_user u JOIN im_permissiongroup perm ON u.userid = perm.userid JOIN im_group g ON perm.groupid = g.groupid ORDER BY perm.groupid, g.label;'
-run_query "User_List_With_Groups" "$QUERY3" && QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+run_session() {
+    # Single-session mode: connect once (retrying only while nothing has run) and run every query
+    # in session_sql, then report each one like run_query does
+    local status_file="/tmp/session_status_${SERVER_NAME}_${DATE}"
+    local attempt=0
+
+    echo "Running ${#QUERY_NAMES[@]} queries in one MySQL session (consistent snapshot)"
 
+    while [ $attempt -lt $MAX_RETRIES ]; do
+        : > "$status_file"
+        if [ "$STREAM" = true ]; then
+            session_sql | mysql_session 2>/tmp/err_session.log | split_session_output "$status_file" >&3
+        else
+            session_sql | mysql_session 2>/tmp/err_session.log | split_session_output "$status_file"
+        fi
+        [ -s "$status_file" ] && break
+
+        attempt=$((attempt + 1))
+        if [ $attempt -lt $MAX_RETRIES ]; then
+            echo "MySQL session attempt $attempt failed, retrying in 5 seconds..."
+            sleep 5
+        fi
+    done
+
+    [ -s "$status_file" ] || { cat /tmp/err_session.log; echo "ERROR: MySQL connection failed after $MAX_RETRIES attempts"; exit 1; }
+    echo "MySQL connection: SUCCESS"
+
+    local name status lines failed=0
+    for name in "${QUERY_NAMES[@]}"; do
+        read -r status lines < <(awk -v query="$name" '$1 == query { status = $2; lines = $3 } END { print status, lines + 0 }' "$status_file")
+
+        if [ "$status" != "OK" ]; then
+            echo "  FAILED: $name"
+            rm -f "/tmp/${name}_${SERVER_NAME}_${DATE}.tsv"
+            echo "QUERY_ERROR_${name}"
+            failed=$((failed + 1))
+            continue
+        fi
+
+        if [ $lines -eq 0 ]; then
+            echo "  NO_DATA: $name (empty)"
+            echo "QUERY_NODATA_${name}"
+        elif [ $lines -eq 1 ]; then
+            echo "  NO_DATA: $name (header only)"
+            echo "QUERY_NODATA_${name}"
+        else
+            echo "  SUCCESS: $name ($((lines-1)) rows)"
+        fi
+        QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+    done
+
+    [ $failed -gt 0 ] && cat /tmp/err_session.log
+    rm -f "$status_file"
+}
+
+QUERY1='WITH RECURSIVE grp_path (groupid, label, rootid, rootlabel) AS (SELECT groupid, label, groupid AS rootid, label AS rootlabel FROM im_group WHERE parentgroupid = 0 UNION ALL SELECT c.groupid, c.label, sup.rootid, sup.rootlabel FROM grp_path AS sup JOIN im_group c ON sup.groupid = c.parentgroupid) SELECT rootid, rootlabel AS rootgroup, groupid, label AS groupname FROM grp_path ORDER BY rootid, groupid;'
+QUERY2='SELECT grp.label AS groupname, grp.groupid, count(*) AS num_gateways FROM im_group grp JOIN im_node node ON grp.groupid = node.groupid JOIN im_lateststatitem latest ON latest.nodeid = node.nodeid JOIN im_stat stat ON latest.statid = stat.statid WHERE grp.groupid IS NOT NULL AND node.groupid <> 0 AND stat.statlabel = '\''ReportIdleTime'\'' AND latest.value < 2592000 GROUP BY grp.groupid, grp.label ORDER BY grp.label, grp.groupid;'
+QUERY3='SELECT perm.groupid, g.label AS groupname, u.loginname AS username, u.email FROM im_user u JOIN im_permissiongroup perm ON u.userid = perm.userid JOIN im_group g ON perm.groupid = g.groupid ORDER BY perm.groupid, g.label;'
 QUERY4='SELECT COUNT(*) AS gateways_registered_last_30_days FROM im_audit WHERE time > DATE_SUB(NOW(), INTERVAL 30 DAY) AND text LIKE '\''%create node %'\'';'
-run_query "Gateways_Registered_Last_30_Days" "$QUERY4" && QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+QUERY5_SELECT='WITH RECURSIVE grp_path (path_grpid, label, rootid, rootname, fullpath) AS (SELECT groupid, label, groupid AS rootid, label AS rootname, label AS fullpath FROM im_group WHERE parentgroupid = 0 UNION ALL SELECT c.groupid, c.label, sup.rootid, sup.label, CONCAT(sup.rootname, "...", c.label) FROM im_group c INNER JOIN grp_path sup ON sup.path_grpid = c.parentgroupid), hbt (statnode, statval) AS (SELECT l.nodeid, l.value FROM im_lateststatitem l INNER JOIN im_stat s ON s.statid = l.statid WHERE s.statlabel = "ReportIdleTime") SELECT n.label AS serial, n.name, grp_path.fullpath, n.type AS device_type, CASE WHEN n.platform = 0 THEN "MG90" WHEN n.platform = 1 THEN "oMG2000" WHEN n.platform = 2 THEN "oMG500" WHEN n.platform = 4 THEN "MG90" WHEN n.platform = 64 THEN "GNX3" WHEN n.platform = 65 THEN "GNX6" WHEN n.platform = 100 THEN "ES440" WHEN n.platform = 101 THEN "ES450" WHEN n.platform = 107 THEN "GX400" WHEN n.platform = 108 THEN "GX440" WHEN n.platform = 109 THEN "GX450" WHEN n.platform = 110 THEN "LS300" WHEN n.platform = 113 THEN "RV50" WHEN n.platform = 114 THEN "MP70" WHEN n.platform = 115 THEN "RV50X" WHEN n.platform = 117 THEN "LX60" WHEN n.platform = 118 THEN "LX40" WHEN n.platform = 119 THEN "RV55" WHEN n.platform = 120 THEN "XR60" WHEN n.platform = 121 THEN "XR80" WHEN n.platform = 122 THEN "XR90" WHEN n.platform = 123 THEN "RX55" ELSE CONCAT(n.platform, "_missing") END AS platform, DATE_SUB(NOW(), INTERVAL statval SECOND) as last_comm FROM im_node n LEFT JOIN grp_path ON path_grpid = n.groupid LEFT JOIN hbt ON statnode = n.nodeid'
+QUERY5="$QUERY5_SELECT ORDER BY last_comm;"
+
+run_queries_parallel() {
+    # Run the queries as background jobs, at most QUERY_PARALLEL at a time (none depends on another),
+    # Device_Level_Data first as it takes longest, so in stream mode it usually holds the live stream.
+    # Group_Hierarchy_Path comes right after it, which it may wait for (see stream_query). Each job's
+    # messages go to its own log, replayed in query order once every job has finished, and its exit
+    # status to its own file
+    local order=() i name rc
+    for i in "${!QUERY_NAMES[@]}"; do
+        [ "${QUERY_NAMES[$i]}" = "Device_Level_Data" ] && order=("$i" "${order[@]}") || order+=("$i")
+    done
 
+    echo "Running ${#QUERY_NAMES[@]} queries, up to $QUERY_PARALLEL at a time"
 
+    for i in "${order[@]}"; do
+        name=${QUERY_NAMES[$i]}
+        while [ $(jobs -rp | wc -l) -ge "$QUERY_PARALLEL" ]; do
+            wait -n
+        done
+        (
+            run_query "$name" "${QUERY_SQL[$i]}" > "/tmp/qlog_${name}_${SERVER_NAME}_${DATE}" 2>&1
+            echo $? > "/tmp/qrc_${name}_${SERVER_NAME}_${DATE}"
+        ) &
+    done
+    wait
+
+    for name in "${QUERY_NAMES[@]}"; do
+        cat "/tmp/qlog_${name}_${SERVER_NAME}_${DATE}" 2>/dev/null
+        rc=$(cat "/tmp/qrc_${name}_${SERVER_NAME}_${DATE}" 2>/dev/null || echo 1)
+        [ "$rc" -eq 0 ] && QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+        rm -f "/tmp/qlog_${name}_${SERVER_NAME}_${DATE}" "/tmp/qrc_${name}_${SERVER_NAME}_${DATE}"
+        rm -f "${STREAM_LOCK}_${name}"
+    done
+    rm -f "$STREAM_LOCK"
+}
 
+device_chunk_ctes() {
+    # The WITH clause of Device_Level_Data's statement (grp_path and hbt, or hbt alone with FLAT_GROUPS)
+    echo "${QUERY5_SELECT%% SELECT n.label AS serial*}"
+}
 
+device_chunks_setup_sql() {
+    # Empty session temporary tables for the group paths and heartbeats, shaped by the CTEs, which
+    # device_chunks_sql fills once per session instead of every chunk re-running them. This is DDL,
+    # which a read-only transaction does not allow, so run_session issues it before the snapshot
+    local ctes=$(device_chunk_ctes)
+    [[ $ctes == *grp_path* ]] && echo "CREATE TEMPORARY TABLE chunk_grp_path (INDEX (path_grpid)) $ctes SELECT path_grpid, fullpath FROM grp_path LIMIT 0;"
+    echo "CREATE TEMPORARY TABLE chunk_hbt (INDEX (statnode)) $ctes SELECT statnode, statval FROM hbt LIMIT 0;"
+}
 
-QUERY5='WITH RECURSIVE grp_path (path_grpid, label, rootid, rootname, fullpath) AS (SELECT groupid, label, groupid AS rootid, label AS rootname, label AS fullpath FROM im_group WHERE parentgroupid = 0 UNION ALL SELECT c.groupid, c.label, sup.rootid, sup.label, CONCAT(sup.rootname, "...", c.label) FROM im_group c INNER JOIN grp_path sup ON sup.path_grpid = c.parentgroupid), hbt (statnode, statval) AS (SELECT l.nodeid, l.value FROM im_lateststatitem l INNER JOIN im_stat s ON s.statid = l.statid WHERE s.statlabel = "ReportIdleTime") SELECT n.label AS serial, n.name, grp_path.fullpath, n.type AS device_type, CASE WHEN n.platform = 0 THEN "MG90" WHEN n.platform = 1 THEN "oMG2000" WHEN n.platform = 2 THEN "oMG500" WHEN n.platform = 4 THEN "MG90" WHEN n.platform = 64 THEN "GNX3" WHEN n.platform = 65 THEN "GNX6" WHEN n.platform = 100 THEN "ES440" WHEN n.platform = 101 THEN "ES450" WHEN n.platform = 107 THEN "GX400" WHEN n.platform = 108 THEN "GX440" WHEN n.platform = 109 THEN "GX450" WHEN n.platform = 110 THEN "LS300" WHEN n.platform = 113 THEN "RV50" WHEN n.platform = 114 THEN "MP70" WHEN n.platform = 115 THEN "RV50X" WHEN n.platform = 117 THEN "LX60" WHEN n.platform = 118 THEN "LX40" WHEN n.platform = 119 THEN "RV55" WHEN n.platform = 120 THEN "XR60" WHEN n.platform = 121 THEN "XR80" WHEN n.platform = 122 THEN "XR90" WHEN n.platform = 123 THEN "RX55" ELSE CONCAT(n.platform, "_missing") END AS platform, DATE_SUB(NOW(), INTERVAL statval SECOND) as last_comm FROM im_node n LEFT JOIN grp_path ON path_grpid = n.groupid LEFT JOIN hbt ON statnode = n.nodeid ORDER BY last_comm;'
-run_query "Device_Level_Data" "$QUERY5" && QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+device_chunks_sql() {
+    # Device_Level_Data as short primary-key range statements over im_node, CHUNK_ROWS nodes each,
+    # run on one connection (user variables carry the last nodeid) against the temporary tables
+    # from device_chunks_setup_sql, filled here (inside the snapshot) with one CTE run each.
+    # The final statement takes whatever is left, so nodes added after the count are not lost.
+    # No ORDER BY: the rows come in nodeid order and the jumphost sorts them by last_comm (converter --sort)
+    # With "marked", every statement is followed by a ##CHUNK marker row for split_session_output
+    local nodes=$1
+    local marked=$2
+    local chunks=$((nodes / CHUNK_ROWS + 1))
+    local chunk_mark="SELECT CONCAT('##CHUNK ', IF(@@error_count = 0, 'OK', 'FAILED')) AS '##MARK';"
+    local ctes=$(device_chunk_ctes)
+    local select="SELECT n.label AS serial${QUERY5_SELECT#* SELECT n.label AS serial}"
+    local i
+
+    select=${select//grp_path/chunk_grp_path}
+    select=${select/JOIN hbt ON/JOIN chunk_hbt ON}
+    if [[ $ctes == *grp_path* ]]; then
+        echo "INSERT INTO chunk_grp_path $ctes SELECT path_grpid, fullpath FROM grp_path;"
+        [ "$marked" = marked ] && echo "$chunk_mark"
+    fi
+    echo "INSERT INTO chunk_hbt $ctes SELECT statnode, statval FROM hbt;"
+    [ "$marked" = marked ] && echo "$chunk_mark"
+
+    echo "SET @last_nodeid := -1;"
+    for ((i = 1; i < chunks; i++)); do
+        echo "SELECT MAX(nodeid) INTO @chunk_end FROM (SELECT nodeid FROM im_node WHERE nodeid > @last_nodeid ORDER BY nodeid LIMIT ${CHUNK_ROWS}) AS chunk;"
+        [ "$marked" = marked ] && echo "$chunk_mark"
+        echo "$select WHERE n.nodeid > @last_nodeid AND n.nodeid <= @chunk_end;"
+        [ "$marked" = marked ] && echo "$chunk_mark"
+        # No nodes left (deleted since the count): @chunk_end is NULL, keep the last bound
+        echo "SET @last_nodeid := COALESCE(@chunk_end, @last_nodeid);"
+    done
+    echo "$select WHERE n.nodeid > @last_nodeid;"
+}
 
+QUERY_NAMES=("Group_Hierarchy_Path" "Gateway_Count_By_Group" "User_List_With_Groups" "Gateways_Registered_Last_30_Days" "Device_Level_Data")
+QUERY_SQL=("$QUERY1" "$QUERY2" "$QUERY3" "$QUERY4" "$QUERY5")
+
+# Group paths on the jumphost: Group_Hierarchy_Path exports im_group as it is and Device_Level_Data
+# each device's groupid, with no grp_path CTE; the converter rebuilds the hierarchy and fullpath
+if [ "$FLAT_GROUPS" = true ]; then
+    QUERY_SQL[0]='SELECT groupid, parentgroupid, label FROM im_group;'
+    QUERY5_SELECT=${QUERY5_SELECT/WITH RECURSIVE grp_path*), hbt /WITH hbt }
+    QUERY5_SELECT=${QUERY5_SELECT/grp_path.fullpath/n.groupid}
+    QUERY5_SELECT=${QUERY5_SELECT/ LEFT JOIN grp_path ON path_grpid = n.groupid/}
+    QUERY_SQL[4]="$QUERY5_SELECT ORDER BY last_comm;"
+fi
+
+# Sorting on the jumphost: drop each query's trailing ORDER BY so MySQL does no filesort
+if [ "$UNSORTED" = true ]; then
+    for i in "${!QUERY_SQL[@]}"; do
+        [[ ${QUERY_SQL[$i]} == *" ORDER BY "*";" ]] && QUERY_SQL[$i]="${QUERY_SQL[$i]% ORDER BY *};"
+    done
+fi
+
+use_device_chunks() {
+    # Swap Device_Level_Data's statement for its chunked form (CHUNK_ROWS > 0), sized by an
+    # im_node count; $1 is passed on to device_chunks_sql. With "marked" (single session) the
+    # temporary tables are left in DEVICE_CHUNK_SETUP for session_sql, else they lead the statement
+    [ "$CHUNK_ROWS" -gt 0 ] || return 0
+    local nodes=$(mysql_batch "SELECT COUNT(*) FROM im_node;" 2>/dev/null | tail -1)
+    if ! [ "$nodes" -ge 0 ] 2>/dev/null; then
+        echo "WARNING: im_node count failed - extracting Device_Level_Data in one statement"
+        return 0
+    fi
+    echo "Device_Level_Data: $nodes nodes, extracted in chunks of $CHUNK_ROWS"
+    if [ "$1" = marked ]; then
+        DEVICE_CHUNK_SETUP=$(device_chunks_setup_sql)
+        QUERY_SQL[4]=$(device_chunks_sql "$nodes" marked)
+    else
+        QUERY_SQL[4]="$(device_chunks_setup_sql)"$'\n'"$(device_chunks_sql "$nodes")"
+    fi
+}
+
+QUERY_SUCCESS=0
+DEVICE_CHUNK_SETUP=""
 
+if [ "$QUERY_PARALLEL" -gt 1 ] && [ "$STREAM" = true ] && ! command -v flock >/dev/null 2>&1; then
+    echo "WARNING: flock not available - running queries one at a time"
+    QUERY_PARALLEL=1
+fi
+
+if [ "$SINGLE_SESSION" = true ]; then
+    use_device_chunks marked
+    run_session
+elif [ "$QUERY_PARALLEL" -gt 1 ]; then
+    wait_for_mysql
+    use_device_chunks
+    run_queries_parallel
+else
+    wait_for_mysql
+    use_device_chunks
+    for i in "${!QUERY_NAMES[@]}"; do
+        run_query "${QUERY_NAMES[$i]}" "${QUERY_SQL[$i]}" && QUERY_SUCCESS=$((QUERY_SUCCESS + 1))
+    done
+fi
 
+if [ "$STREAM" = true ]; then
+    rm -f /tmp/err_*.log
+    [ $QUERY_SUCCESS -eq 0 ] && { echo "ERROR: No query succeeded"; exit 1; }
+    echo "SUCCESS: Results streamed ($QUERY_SUCCESS queries)"
+    exit 0
+fi
 
 TSV_COUNT=$(ls -1 /tmp/*_${SERVER_NAME}_${DATE}.tsv 2>/dev/null | wc -l)
 [ $TSV_COUNT -eq 0 ] && { echo "ERROR: No TSV files"; exit 1; }
@@ -364,24 +822,118 @@ REMOTE_SCRIPT
     sed -i "s/DATE_PLACEHOLDER/$DATE/g" "$script_path"
     sed -i "s/MYSQL_USER_PLACEHOLDER/$MYSQL_USER/g" "$script_path"
     sed -i "s/MYSQL_DATABASE_PLACEHOLDER/$MYSQL_DATABASE/g" "$script_path"
+    sed -i "s/STREAM_PLACEHOLDER/$STREAM_RESULTS/g" "$script_path"
+    sed -i "s/SINGLE_SESSION_PLACEHOLDER/$MYSQL_SINGLE_SESSION/g" "$script_path"
+
+    # Never more concurrent queries than the production database is allowed to take
+    local query_parallel=$REMOTE_QUERY_PARALLEL
+    [ "$query_parallel" -gt "$REMOTE_QUERY_PARALLEL_MAX" ] && query_parallel=$REMOTE_QUERY_PARALLEL_MAX
+    [ "$query_parallel" -lt 1 ] && query_parallel=1
+    sed -i "s/QUERY_PARALLEL_PLACEHOLDER/$query_parallel/g" "$script_path"
+    sed -i "s/CHUNK_ROWS_PLACEHOLDER/$DEVICE_DATA_CHUNK_ROWS/g" "$script_path"
+    sed -i "s/UNSORTED_PLACEHOLDER/$SORT_ON_JUMPHOST/g" "$script_path"
+    sed -i "s/FLAT_GROUPS_PLACEHOLDER/$GROUP_PATHS_ON_JUMPHOST/g" "$script_path"
 
     echo "$script_path"
 }
 
+add_profile_args() {
+    # Append the EXCEL_PROFILE, EXCEL_COLUMNAR and jumphost sort switches to the caller's py_args array
+    [[ " $EXCEL_PROFILE " == *" cpu "* ]] && py_args+=(--profile-cpu)
+    [[ " $EXCEL_PROFILE " == *" memory "* ]] && py_args+=(--profile-memory)
+    [ -n "$EXCEL_PROFILE" ] && py_args+=(--profile-dir "$(dirname "$LOG_FILE")")
+    [ -n "$EXCEL_COLUMNAR" ] && py_args+=(--columnar "$EXCEL_COLUMNAR")
+    if [ "$SORT_ON_JUMPHOST" = true ] || [ "$DEVICE_DATA_CHUNK_ROWS" -gt 0 ]; then
+        py_args+=(--sort --sort-buffer-rows "$SORT_BUFFER_ROWS")
+        [ -n "$SORT_TMP_DIR" ] && py_args+=(--sort-dir "$SORT_TMP_DIR")
+    fi
+}
+
+columnar_files_for() {
+    # Columnar files the converter wrote next to an Excel file (<name>_<Query>.parquet/.arrow)
+    local base="${1%.xlsx}"
+    ls "${base}"_*.parquet "${base}"_*.arrow 2>/dev/null
+}
+
 create_excel_from_tsv() {
     local server_name=$1
-    local tsv_dir=$2
+    local tsv_input=$2  # TSV directory or results tarball
     local excel_output=$3
 
     log "${BLUE}Creating Excel for $server_name...${NC}"
 
-    stdbuf -oL -eL "$VENV_DIR/bin/python3" -u "$PYTHON_SCRIPT" "$tsv_dir" "$excel_output" "$server_name" | while IFS= read -r line; do
-        echo -e "$(date '+%Y-%m-%d %H:%M:%S') - ${BLUE}  PY: ${line}${NC}"
-    done
+    local py_args=()
+    [ "$EXCEL_STREAMING" = true ] && py_args+=(--streaming)
+    py_args+=(--engine "$EXCEL_ENGINE" --jobs "$EXCEL_JOBS")
+    add_profile_args
+
+    stdbuf -oL -eL "$VENV_DIR/bin/python3" -u "$PYTHON_SCRIPT" "${py_args[@]}" "$tsv_input" "$excel_output" "$server_name" | relay_python_output
 
     [ -f "$excel_output" ] && { log "${GREEN}Excel created${NC}"; return 0; } || { log "${RED}Excel failed${NC}"; return 1; }
 }
 
+create_excel_batch() {
+    # Convert all collected servers in one Python run; sets SERVER_EXCEL for each successful server
+    local manifest="/tmp/excel_batch_${DATE}.tsv"
+    local results="/tmp/excel_batch_${DATE}.out"
+
+    : > "$manifest"
+    for srv in "$@"; do
+        printf '%s\t%s\t%s\n' "${SERVER_TSV_INPUT[$srv]}" "/tmp/${srv}_$(date +%Y%m%d_%H%M%S).xlsx" "$srv" >> "$manifest"
+    done
+
+    log "${BLUE}Creating Excel for $# servers (batch, $EXCEL_BATCH_WORKERS workers)...${NC}"
+
+    local py_args=()
+    [ "$EXCEL_STREAMING" = true ] && py_args+=(--streaming)
+    py_args+=(--engine "$EXCEL_ENGINE" --jobs "$EXCEL_JOBS" --batch "$manifest" --batch-workers "$EXCEL_BATCH_WORKERS")
+    add_profile_args
+
+    stdbuf -oL -eL "$VENV_DIR/bin/python3" -u "$PYTHON_SCRIPT" "${py_args[@]}" | tee "$results" | relay_python_output
+
+    # BATCH_RESULT|<server>|<exit_code>|<excel_file>|<seconds>
+    while IFS='|' read -r tag srv code excel_file seconds; do
+        [ "$tag" = "BATCH_RESULT" ] || continue
+        SERVER_STAGES[$srv]="${SERVER_STAGES[$srv]}excel=${seconds%.*} "
+        if [ "$code" = "0" ] && [ -f "$excel_file" ]; then
+            SERVER_EXCEL[$srv]="$excel_file"
+            log "${GREEN}Excel created for $srv (${seconds}s)${NC}"
+        else
+            log "${RED}Excel failed for $srv (exit $code)${NC}"
+        fi
+    done < "$results"
+
+    rm -f "$manifest" "$results"
+}
+
+stream_excel_over_ssh() {
+    # Stream mode: run the remote script with its result frames gzipped over the ssh channel and
+    # converted as they arrive; remote messages go to output_file
+    # Returns 0 on success, 1 if the remote script failed, 2 if the converter failed. The converter
+    # is checked first: when it dies mid-stream, ssh dies of SIGPIPE and fails too
+    local server_name=$1
+    local server_ip=$2
+    local output_file=$3
+    local excel_output=$4
+
+    local py_args=()
+    [ "$EXCEL_STREAMING" = true ] && py_args+=(--streaming)
+    py_args+=(--engine "$EXCEL_ENGINE" --stream)
+    add_profile_args
+
+    server_ssh "$server_name" "set -o pipefail; bash /tmp/mysql_dump_script_${server_name}.sh | gzip -1" 2> "$output_file" \
+        | stdbuf -oL -eL "$VENV_DIR/bin/python3" -u "$PYTHON_SCRIPT" "${py_args[@]}" - "$excel_output" "$server_name" \
+        | relay_python_output
+    local status=("${PIPESTATUS[@]}")
+
+    if [ "${status[1]}" -ne 0 ] || [ ! -f "$excel_output" ]; then
+        log "${RED}Converter failed (exit ${status[1]}, ssh exit ${status[0]})${NC}"
+        return 2
+    fi
+    [ "${status[0]}" -ne 0 ] && return 1
+    return 0
+}
+
 upload_to_s3() {
     local file_path=$1
     local s3_path="s3://$BUCKET/$MONTH_YEAR/$(basename $file_path)"
@@ -401,45 +953,87 @@ upload_to_s3() {
     return 1
 }
 
-upload_to_sftp() {
-    local file_path=$1
-    local server_name=$2
+upload_sftp_batch() {
+    # Push every file queued in SERVER_UPLOADS over one lftp session with SFTP_PARALLEL parallel
+    # transfers, run the SFTP retention in the same session, then check each file against the
+    # post-upload listing and set SERVER_SFTP_STATUS, SERVER_FILES and (on failure) SERVER_STATUS
+    local servers=() files=() srv
 
-    if ! command -v lftp &> /dev/null; then
-        echo "$(date '+%Y-%m-%d %H:%M:%S') - SFTP skipped - lftp not installed" >> "$LOG_FILE"
-        SERVER_SFTP_STATUS[$server_name]="FAILED"
-        return 1
-    fi
+    for srv in $(echo "${!SERVER_UPLOADS[@]}" | tr ' ' '\n' | sort); do
+        [ -n "${SERVER_UPLOADS[$srv]}" ] || continue
+        servers+=("$srv")
+        files+=(${SERVER_UPLOADS[$srv]})
+    done
 
-    local filename=$(basename "$file_path")
-    local filesize=$(ls -lh "$file_path" | awk '{print $5}')
+    local listing="/tmp/sftp_listing_${DATE}"
+    local session_log="/tmp/sftp_upload_${DATE}.log"
+    local session_rc=1
 
-    echo "$(date '+%Y-%m-%d %H:%M:%S') - Uploading to SFTP: ${SFTP_HOST}${SFTP_REMOTE_DIR}/${filename}" >> "$LOG_FILE"
+    if command -v lftp &> /dev/null; then
+        log "${BLUE}Uploading ${#files[@]} files for ${#servers[@]} servers to SFTP (one session, $SFTP_PARALLEL parallel transfers)...${NC}"
+        rm -f "$listing"
+        {
+            [ ${#files[@]} -gt 0 ] && echo "mput -P ${SFTP_PARALLEL} ${files[*]}"
+            sftp_retention_commands "$listing"
+        } | sftp_session "$session_log"
+        session_rc=$?
+        [ $session_rc -eq 0 ] && log "${GREEN}SFTP session completed${NC}" || log "${YELLOW}SFTP session had some issues${NC}"
+    else
+        log "${RED}SFTP skipped - lftp not installed${NC}"
+    fi
 
-    lftp -u "${SFTP_USER},${SFTP_PASSWORD}" sftp://${SFTP_HOST} << EOF >/tmp/sftp_${server_name}.log 2>&1
-set sftp:auto-confirm yes
-set net:timeout 30
-cd ${SFTP_REMOTE_DIR}
-put ${file_path}
-bye
-EOF
+    local f name size sftp_path sftp_size ok columnar
+    for srv in "${servers[@]}"; do
+        ok=true
+        columnar=0
+        sftp_path=""
+        for f in ${SERVER_UPLOADS[$srv]}; do
+            name=$(basename "$f")
+            size=$(ls -lh "$f" | awk '{print $5}')
+            if grep -qxF "$name" "$listing" 2>/dev/null && ! grep -F "$name" "$session_log" 2>/dev/null | grep -qi "error\|failed"; then
+                log "${GREEN}SFTP: $name ($size) uploaded${NC}"
+            else
+                log "${RED}SFTP: $name ($size) failed${NC}"
+                ok=false
+            fi
+            if [ -z "$sftp_path" ]; then
+                sftp_path="${SFTP_HOST}${SFTP_REMOTE_DIR}/${name}"
+                sftp_size=$size
+            else
+                columnar=$((columnar + 1))
+            fi
+        done
+        rm -f ${SERVER_UPLOADS[$srv]}
 
-    if [ $? -eq 0 ] && ! grep -qi "error\|failed" /tmp/sftp_${server_name}.log; then
-        echo "$(date '+%Y-%m-%d %H:%M:%S') - SFTP upload successful" >> "$LOG_FILE"
-        SERVER_SFTP_STATUS[$server_name]="SUCCESS"
-        rm -f /tmp/sftp_${server_name}.log
-        # Return path and size
-        echo "${SFTP_HOST}${SFTP_REMOTE_DIR}/${filename}|${filesize}"
-        return 0
-    fi
+        if [ "$ok" != true ]; then
+            SERVER_SFTP_STATUS[$srv]="FAILED"
+            SERVER_STATUS[$srv]="FAILED"
+            SERVER_ERRORS[$srv]="SFTP upload failed"
+            continue
+        fi
+        SERVER_SFTP_STATUS[$srv]="SUCCESS"
 
-    echo "$(date '+%Y-%m-%d %H:%M:%S') - SFTP upload failed" >> "$LOG_FILE"
-    SERVER_SFTP_STATUS[$server_name]="FAILED"
-    rm -f /tmp/sftp_${server_name}.log
-    return 1
+        # Build file location info
+        if [ "$ENABLE_S3_UPLOAD" = true ] && [ "${SERVER_S3[$srv]}" != "FAILED" ]; then
+            SERVER_FILES[$srv]="S3: ${SERVER_S3[$srv]}
+SFTP: $sftp_path ($sftp_size)"
+        else
+            SERVER_FILES[$srv]="SFTP: $sftp_path ($sftp_size)"
+            [ "$ENABLE_S3_UPLOAD" = true ] && SERVER_FILES[$srv]="${SERVER_FILES[$srv]}
+S3: FAILED"
+        fi
+        [ $columnar -gt 0 ] && SERVER_FILES[$srv]="${SERVER_FILES[$srv]}
+Columnar: $columnar ${EXCEL_COLUMNAR} files next to the workbook"
+    done
+
+    [ $session_rc -ne 0 ] && [ -f "$session_log" ] && cat "$session_log" >> "$LOG_FILE"
+    rm -f "$listing" "${listing}.rm" "$session_log"
+    SERVER_UPLOADS=()
 }
 
-process_server() {
+collect_server() {
+    # Run the queries on one server and leave its results tarball in SERVER_TSV_INPUT, ready for Excel conversion
+    # (with STREAM_RESULTS the results are converted on arrival and the Excel file is left in SERVER_EXCEL)
     local server_name=$1
     local server_ip=${SERVERS[$server_name]}
 
@@ -451,7 +1045,7 @@ process_server() {
     local script_path=$(create_mysql_dump_script "$server_name")
 
     log "${BLUE}Copying script...${NC}"
-    if ! scp -i "$SSH_KEY" -P "$SSH_PORT" -q "$script_path" "$SSH_USER@$server_ip:/tmp/" 2>/dev/null; then
+    if ! server_scp "$server_name" "$script_path" "$SSH_USER@$server_ip:/tmp/" 2>/dev/null; then
         log "${RED}SCP failed${NC}"
         SERVER_STATUS[$server_name]="FAILED"
         SERVER_ERRORS[$server_name]="SCP script copy failed"
@@ -463,9 +1057,19 @@ process_server() {
 
     log "${BLUE}Executing queries...${NC}"
     local output_file="/tmp/remote_out_${server_name}_${DATE}.log"
-
-    ssh -i "$SSH_KEY" -p "$SSH_PORT" "$SSH_USER@$server_ip" "bash /tmp/mysql_dump_script_${server_name}.sh" > "$output_file" 2>&1
-    local exit_code=$?
+    local excel_file=""
+    local exit_code
+
+    if [ "$STREAM_RESULTS" = true ]; then
+        # Results are converted while the queries run; the Excel file is ready when ssh returns
+        excel_file="/tmp/${server_name}_$(date +%Y%m%d_%H%M%S).xlsx"
+        log "${BLUE}Streaming results into Excel for $server_name...${NC}"
+        stream_excel_over_ssh "$server_name" "$server_ip" "$output_file" "$excel_file"
+        exit_code=$?
+    else
+        server_ssh "$server_name" "bash /tmp/mysql_dump_script_${server_name}.sh" > "$output_file" 2>&1
+        exit_code=$?
+    fi
 
     log "${BLUE}Remote output:${NC}"
     grep -v "WARNING\|Sierra Wireless\|affiliates\|authorized\|expectation\|intercepted\|disciplinary" "$output_file" | while read line; do
@@ -490,7 +1094,19 @@ process_server() {
     
     log "${BLUE}Analysis: NoData=$query_nodata, Errors=$query_errors${NC}"
 
-    [ $exit_code -ne 0 ] && { log "${RED}Remote script failed${NC}"; SERVER_STATUS[$server_name]="FAILED"; SERVER_ERRORS[$server_name]="Script execution failed"; rm -f "$script_path" "$output_file"; return 1; }
+    # Any non-zero exit (including ssh's 255) is a remote failure, except stream mode's 2 (converter failed)
+    local remote_failed=$exit_code
+    [ "$STREAM_RESULTS" = true ] && [ $exit_code -eq 2 ] && remote_failed=0
+    [ $remote_failed -ne 0 ] && { log "${RED}Remote script failed${NC}"; SERVER_STATUS[$server_name]="FAILED"; SERVER_ERRORS[$server_name]="Script execution failed"; rm -f "$script_path" "$output_file" "$excel_file"; return 1; }
+
+    if [ "$STREAM_RESULTS" = true ]; then
+        SERVER_NODATA[$server_name]=$query_nodata
+        SERVER_CLEANUP[$server_name]="$script_path $output_file"
+        [ $exit_code -eq 2 ] && { rm -f "$excel_file"; excel_failed "$server_name"; return 1; }
+        log "${GREEN}Excel created${NC}"
+        SERVER_EXCEL[$server_name]="$excel_file"
+        return 0
+    fi
 
     local tar_file=$(grep "DUMP_FILE:" "$output_file" | awk '{print $2}')
     [ -z "$tar_file" ] && { log "${RED}No tar file${NC}"; SERVER_STATUS[$server_name]="FAILED"; SERVER_ERRORS[$server_name]="No output"; rm -f "$script_path" "$output_file"; return 1; }
@@ -498,59 +1114,56 @@ process_server() {
     log "${BLUE}Downloading tar...${NC}"
     local local_tar="/tmp/mysql_results_${server_name}_${DATE}.tar.gz"
 
-    scp -i "$SSH_KEY" -P "$SSH_PORT" -q "$SSH_USER@$server_ip:$tar_file" "$local_tar" 2>/dev/null || { log "${RED}Download failed${NC}"; SERVER_STATUS[$server_name]="FAILED"; SERVER_ERRORS[$server_name]="SCP download failed"; rm -f "$script_path" "$output_file"; return 1; }
+    server_scp "$server_name" "$SSH_USER@$server_ip:$tar_file" "$local_tar" 2>/dev/null || { log "${RED}Download failed${NC}"; SERVER_STATUS[$server_name]="FAILED"; SERVER_ERRORS[$server_name]="SCP download failed"; rm -f "$script_path" "$output_file"; return 1; }
 
     log "${GREEN}Downloaded ($(ls -lh $local_tar | awk '{print $5}'))${NC}"
 
-    tar -tzf "$local_tar" >/dev/null 2>&1 || { log "${RED}Corrupted tar${NC}"; SERVER_STATUS[$server_name]="FAILED"; SERVER_ERRORS[$server_name]="Corrupted tar"; rm -f "$local_tar" "$script_path" "$output_file"; return 1; }
-
-    local tsv_dir="/tmp/tsv_${server_name}_${DATE}"
-    mkdir -p "$tsv_dir"
-    tar -xzf "$local_tar" -C "$tsv_dir" 2>/dev/null
-
-    for tsv in "$tsv_dir"/*_${server_name}_${DATE}.tsv; do
-        [ -f "$tsv" ] && mv "$tsv" "$tsv_dir/$(basename "$tsv" | sed "s/_${server_name}_${DATE}//")"
-    done
+    # The tarball is passed to Python as-is: its TSV members are streamed without extracting (with
+    # EXCEL_JOBS > 1 the converter extracts them to a temporary directory for its workers), and a
+    # corrupted archive is reported as an Excel failure
+    SERVER_TSV_INPUT[$server_name]="$local_tar"
+    SERVER_REMOTE_TAR[$server_name]="$tar_file"
+    SERVER_NODATA[$server_name]=$query_nodata
+    SERVER_CLEANUP[$server_name]="$local_tar $script_path $output_file"
+    return 0
+}
 
-    # New filename format: SERVERNAME_YYYYMMDD_HHMMSS.xlsx
-    local excel_file="/tmp/${server_name}_$(date +%Y%m%d_%H%M%S).xlsx"
+excel_failed() {
+    local server_name=$1
+    log "${RED}Excel failed${NC}"
+    SERVER_STATUS[$server_name]="FAILED"
+    SERVER_ERRORS[$server_name]="Excel creation failed"
+    rm -rf ${SERVER_CLEANUP[$server_name]}
+}
 
-    create_excel_from_tsv "$server_name" "$tsv_dir" "$excel_file" || { log "${RED}Excel failed${NC}"; SERVER_STATUS[$server_name]="FAILED"; SERVER_ERRORS[$server_name]="Excel creation failed"; rm -rf "$tsv_dir" "$local_tar" "$script_path" "$output_file"; return 1; }
+finish_server() {
+    # Upload the server's Excel file to S3, queue it and its columnar files for the SFTP upload
+    # stage (upload_sftp_batch), record its status and clean up the remaining work files
+    local server_name=$1
+    local excel_file=$2
+    local server_ip=${SERVERS[$server_name]}
+    local query_nodata=${SERVER_NODATA[$server_name]}
+    local tar_file=${SERVER_REMOTE_TAR[$server_name]}
 
     # Upload to S3 (if enabled)
-    local s3_status="DISABLED"
-    local s3_path=""
-    local s3_size=""
-    
     if [ "$ENABLE_S3_UPLOAD" = true ]; then
         log "${BLUE}Uploading to S3...${NC}"
         local s3_result=$(upload_to_s3 "$excel_file" "$server_name")
         if [ $? -eq 0 ]; then
-            s3_path=$(echo "$s3_result" | cut -d'|' -f1)
-            s3_size=$(echo "$s3_result" | cut -d'|' -f2)
-            s3_status="SUCCESS"
+            SERVER_S3[$server_name]="$(echo "$s3_result" | cut -d'|' -f1) ($(echo "$s3_result" | cut -d'|' -f2))"
             log "${GREEN}S3 upload successful${NC}"
         else
-            s3_status="FAILED"
+            SERVER_S3[$server_name]="FAILED"
             log "${YELLOW}S3 upload failed (non-critical)${NC}"
         fi
     else
         log "${YELLOW}S3 upload disabled${NC}"
     fi
 
-    # Upload to SFTP (mandatory)
-    log "${BLUE}Uploading to SFTP...${NC}"
-    local sftp_result=$(upload_to_sftp "$excel_file" "$server_name")
-    if [ $? -ne 0 ]; then
-        log "${RED}SFTP upload failed${NC}"
-        SERVER_STATUS[$server_name]="FAILED"
-        SERVER_ERRORS[$server_name]="SFTP upload failed"
-        rm -rf "$tsv_dir" "$local_tar" "$excel_file" "$script_path" "$output_file"
-        return 1
-    fi
-
-    local sftp_path=$(echo "$sftp_result" | cut -d'|' -f1)
-    local sftp_size=$(echo "$sftp_result" | cut -d'|' -f2)
+    # SFTP (mandatory) happens for all servers at once; a failed upload turns the status into FAILED
+    local columnar_files=($(columnar_files_for "$excel_file"))
+    SERVER_UPLOADS[$server_name]="$excel_file ${columnar_files[*]}"
+    log "${BLUE}Queued for SFTP: $((1 + ${#columnar_files[@]})) files${NC}"
 
     # Set status
     if [ $query_nodata -eq 5 ]; then
@@ -560,23 +1173,32 @@ process_server() {
         SERVER_STATUS[$server_name]="SUCCESS"
     fi
 
-    # Build file location info
-    if [ "$ENABLE_S3_UPLOAD" = true ] && [ "$s3_status" = "SUCCESS" ]; then
-        SERVER_FILES[$server_name]="S3: $s3_path ($s3_size)
-SFTP: $sftp_path ($sftp_size)"
-    else
-        SERVER_FILES[$server_name]="SFTP: $sftp_path ($sftp_size)"
-        [ "$ENABLE_S3_UPLOAD" = true ] && SERVER_FILES[$server_name]="${SERVER_FILES[$server_name]}
-S3: FAILED"
-    fi
-
-    rm -rf "$tsv_dir" "$local_tar" "$excel_file" "$script_path" "$output_file"
-    ssh -i "$SSH_KEY" -p "$SSH_PORT" "$SSH_USER@$server_ip" "rm -f $tar_file /tmp/mysql_dump_script_${server_name}.sh" 2>/dev/null
+    rm -rf ${SERVER_CLEANUP[$server_name]}
+    server_ssh "$server_name" "rm -f $tar_file /tmp/mysql_dump_script_${server_name}.sh" 2>/dev/null
 
     log "${GREEN}✓ Done: $server_name${NC}"
     return 0
 }
 
+process_server() {
+    local server_name=$1
+
+    collect_server "$server_name" || { close_ssh_master "$server_name"; return 1; }
+
+    if [ "$STREAM_RESULTS" != true ]; then
+        # New filename format: SERVERNAME_YYYYMMDD_HHMMSS.xlsx
+        local excel_file="/tmp/${server_name}_$(date +%Y%m%d_%H%M%S).xlsx"
+
+        create_excel_from_tsv "$server_name" "${SERVER_TSV_INPUT[$server_name]}" "$excel_file" || { excel_failed "$server_name"; close_ssh_master "$server_name"; return 1; }
+        SERVER_EXCEL[$server_name]="$excel_file"
+    fi
+
+    finish_server "$server_name" "${SERVER_EXCEL[$server_name]}"
+    local rc=$?
+    close_ssh_master "$server_name"
+    return $rc
+}
+
 generate_email_summary() {
     local success=$1
     local total=$2
@@ -601,6 +1223,7 @@ Date: $(date)
 OVERALL:
 Total: $total | Success: $success | No Data: $nodata | Failed: $failed
 Success Rate: ${rate}%
+Run Time: $(( (SECONDS - RUN_START) / 60 ))m${RUN_ESTIMATE:+ (estimated $((RUN_ESTIMATE / 60))m)}
 
 DETAILED STATUS:
 ========================================
@@ -634,6 +1257,22 @@ EOF
         echo "---" >> "$SUMMARY_FILE"
     done
 
+    if [ -s "$METRICS_FILE" ]; then
+        echo "" >> "$SUMMARY_FILE"
+        echo "EXCEL CONVERSION METRICS:" >> "$SUMMARY_FILE"
+        local metrics srv rows seconds rate rss bytes
+        while IFS= read -r metrics; do
+            srv=$(metric_value "$metrics" server)
+            rows=$(metric_value "$metrics" rows)
+            seconds=$(metric_value "$metrics" total_seconds)
+            rate=$(metric_value "$metrics" rows_per_sec)
+            rss=$(metric_value "$metrics" peak_rss_mb)
+            bytes=$(metric_value "$metrics" output_bytes)
+            echo "$srv: $rows rows in ${seconds}s (${rate} rows/s), peak RSS ${rss} MB, Excel $((bytes / 1048576)) MB" >> "$SUMMARY_FILE"
+        done < <(sort "$METRICS_FILE")
+        rm -f "$METRICS_FILE"
+    fi
+
     cat >> "$SUMMARY_FILE" << EOF
 
 STORAGE:
@@ -678,16 +1317,203 @@ EOF
     fi
 }
 
+upload_server() {
+    # Batch mode upload step for one collected server
+    local srv=$1
+    log "${YELLOW}===== Uploading: $srv =====${NC}"
+    local rc=1
+    if [ -n "${SERVER_EXCEL[$srv]}" ]; then
+        finish_server "$srv" "${SERVER_EXCEL[$srv]}"
+        rc=$?
+    else
+        excel_failed "$srv"
+    fi
+    close_ssh_master "$srv"
+    return $rc
+}
+
+run_step() {
+    # Run one server step, recording its return code in SERVER_STEP_RC and its duration in SERVER_STAGES
+    local step=$1
+    local srv=$2
+    local start=$SECONDS
+
+    "$step" "$srv"
+    SERVER_STEP_RC[$srv]=$?
+    SERVER_STAGES[$srv]="${SERVER_STAGES[$srv]}${step%_server}=$((SECONDS - start)) "
+    return ${SERVER_STEP_RC[$srv]}
+}
+
+server_worker() {
+    # Background worker: run one server step with its output in its own files, then write the
+    # server's entries of SERVER_STATE_ARRAYS (return code and stage times included) to a result file
+    local step=$1
+    local srv=$2
+    local work_dir=$3
+
+    exec > "$work_dir/$srv.out" 2>&1
+    LOG_FILE="$work_dir/$srv.log"
+
+    run_step "$step" "$srv"
+
+    local name
+    for name in $SERVER_STATE_ARRAYS; do
+        local -n state=$name
+        [ -n "${state[$srv]+_}" ] && printf '%s[%q]=%q\n' "$name" "$srv" "${state[$srv]}"
+    done > "$work_dir/$srv.result.tmp"
+    mv "$work_dir/$srv.result.tmp" "$work_dir/$srv.result"
+}
+
+collect_workers() {
+    # Replay and load every finished worker: its console output and log are written in one
+    # piece, so servers running side by side never interleave
+    local work_dir=$1
+    local result srv
+    for result in "$work_dir"/*.result; do
+        [ -f "$result" ] || continue
+        srv=$(basename "$result" .result)
+        cat "$work_dir/$srv.out"
+        [ -f "$work_dir/$srv.log" ] && cat "$work_dir/$srv.log" >> "$LOG_FILE"
+        source "$result"
+        rm -f "$result" "$work_dir/$srv.out" "$work_dir/$srv.log"
+        log "====="
+    done
+}
+
+run_servers() {
+    # Run one step (process_server, collect_server, upload_server) for each given server, up to
+    # SERVER_PARALLEL at a time; return codes land in SERVER_STEP_RC
+    local step=$1
+    shift
+
+    if [ "$SERVER_PARALLEL" -le 1 ]; then
+        local srv
+        for srv in "$@"; do
+            run_step "$step" "$srv"
+            log "====="
+        done
+        return 0
+    fi
+
+    local work_dir=$(mktemp -d "/tmp/server_workers_${DATE}_XXXXXX")
+    log "${BLUE}Running $step for $# servers, $SERVER_PARALLEL at a time...${NC}"
+
+    local srv
+    for srv in "$@"; do
+        while [ $(jobs -rp | wc -l) -ge "$SERVER_PARALLEL" ]; do
+            wait -n
+            collect_workers "$work_dir"
+        done
+        log "${BLUE}Started: $srv${NC}"
+        server_worker "$step" "$srv" "$work_dir" &
+    done
+    wait
+    collect_workers "$work_dir"
+
+    # A worker that was killed leaves output but no result
+    for srv in "$@"; do
+        [ -f "$work_dir/$srv.out" ] || continue
+        cat "$work_dir/$srv.out"
+        [ -f "$work_dir/$srv.log" ] && cat "$work_dir/$srv.log" >> "$LOG_FILE"
+        log "${RED}Worker for $srv exited without a result${NC}"
+        SERVER_STATUS[$srv]="FAILED"
+        SERVER_ERRORS[$srv]="Worker exited without a result"
+        SERVER_STEP_RC[$srv]=1
+    done
+    rm -rf "$work_dir"
+}
+
+plan_server_order() {
+    # Fill SERVER_QUEUE with the servers ordered longest expected runtime first, so the heaviest
+    # ones never start last, and log the estimated run time for SERVER_PARALLEL workers
+    # Expected runtime: mean total of the server's runs in HISTORY_FILE; servers without history
+    # are expected to take as long as the slowest known server (so they start early), or
+    # HISTORY_DEFAULT_SECONDS when there is no history at all
+    local srv secs
+    SERVER_EXPECTED=()
+    if [ -f "$HISTORY_FILE" ]; then
+        while IFS=$'\t' read -r srv secs; do
+            [[ ${SERVERS[$srv]+_} ]] && SERVER_EXPECTED[$srv]=$secs
+        done < <(awk -F'\t' '{ sum[$2] += $3; runs[$2]++ } END { for (s in sum) printf "%s\t%d\n", s, sum[s] / runs[s] }' "$HISTORY_FILE")
+    fi
+
+    local default=$HISTORY_DEFAULT_SECONDS
+    [ ${#SERVER_EXPECTED[@]} -gt 0 ] && default=$(printf '%s\n' "${SERVER_EXPECTED[@]}" | sort -n | tail -1)
+    local unknown=0
+    for srv in "${!SERVERS[@]}"; do
+        [ -n "${SERVER_EXPECTED[$srv]}" ] && continue
+        SERVER_EXPECTED[$srv]=$default
+        unknown=$((unknown + 1))
+    done
+
+    SERVER_QUEUE=($(for srv in "${!SERVERS[@]}"; do echo "${SERVER_EXPECTED[$srv]} $srv"; done | sort -k1,1nr -k2,2 | awk '{ print $2 }'))
+
+    # Greedy schedule of the queue on SERVER_PARALLEL workers: the busiest worker's load is the run time
+    RUN_ESTIMATE=$(for srv in "${SERVER_QUEUE[@]}"; do echo "${SERVER_EXPECTED[$srv]}"; done | awk -v workers="$SERVER_PARALLEL" '
+        BEGIN { if (workers < 1) workers = 1 }
+        { best = 1; for (w = 2; w <= workers; w++) if (load[w] < load[best]) best = w; load[best] += $1 }
+        END { longest = 0; for (w = 1; w <= workers; w++) if (load[w] > longest) longest = load[w]; print longest }')
+
+    log "${BLUE}Server order (expected seconds): $(for srv in "${SERVER_QUEUE[@]}"; do printf '%s=%s ' "$srv" "${SERVER_EXPECTED[$srv]}"; done)${NC}"
+    [ $unknown -gt 0 ] && log "${YELLOW}$unknown servers without history, expected ${default}s each${NC}"
+    log "${BLUE}Estimated run time: $((RUN_ESTIMATE / 60))m, ETA $(date -d "+${RUN_ESTIMATE} seconds" '+%H:%M')${NC}"
+}
+
+record_server_history() {
+    # Append this run's stage times and row counts for every server that completed, keeping the
+    # last HISTORY_RUNS runs per server
+    # Line: <date> <server> <total seconds> <rows> <stage>=<seconds>,... (tab-separated)
+    local srv stage total rows metrics
+    mkdir -p "$(dirname "$HISTORY_FILE")"
+    for srv in "${!SERVERS[@]}"; do
+        [ "${SERVER_STATUS[$srv]}" = "SUCCESS" ] || [ "${SERVER_STATUS[$srv]}" = "NO_DATA" ] || continue
+        total=0
+        for stage in ${SERVER_STAGES[$srv]}; do
+            total=$((total + ${stage#*=}))
+        done
+        rows=0
+        if [ -s "$METRICS_FILE" ]; then
+            metrics=$(grep -F "\"server\": \"$srv\"" "$METRICS_FILE" | tail -1)
+            [ -n "$metrics" ] && rows=$(metric_value "$metrics" rows)
+        fi
+        printf '%s\t%s\t%s\t%s\t%s\n' "$DATE" "$srv" "$total" "${rows:-0}" "$(echo ${SERVER_STAGES[$srv]} | tr ' ' ',')" >> "$HISTORY_FILE"
+    done
+
+    [ -f "$HISTORY_FILE" ] || return 0
+    tac "$HISTORY_FILE" | awk -F'\t' -v keep="$HISTORY_RUNS" '++runs[$2] <= keep' | tac > "${HISTORY_FILE}.tmp" && mv "${HISTORY_FILE}.tmp" "$HISTORY_FILE"
+}
+
 process_all_servers() {
     local success=0
 
     log "${BLUE}Starting ${#SERVERS[@]} servers...${NC}"
+    plan_server_order
+
+    if [ "$EXCEL_BATCH" = true ] && [ "$STREAM_RESULTS" != true ]; then
+        # Collect every server first, convert them all in one Python run, then upload
+        run_servers collect_server "${SERVER_QUEUE[@]}"
+
+        local collected=()
+        for srv in "${SERVER_QUEUE[@]}"; do
+            [ "${SERVER_STEP_RC[$srv]}" = "0" ] && collected+=("$srv")
+        done
+
+        if [ ${#collected[@]} -gt 0 ]; then
+            create_excel_batch "${collected[@]}"
+            run_servers upload_server "${collected[@]}"
+        fi
+    else
+        run_servers process_server "${SERVER_QUEUE[@]}"
+    fi
+
+    upload_sftp_batch
 
     for srv in "${!SERVERS[@]}"; do
-        process_server "$srv" && [ "${SERVER_STATUS[$srv]}" == "SUCCESS" ] && success=$((success + 1))
-        log "====="
+        [ "${SERVER_STEP_RC[$srv]}" = "0" ] && [ "${SERVER_STATUS[$srv]}" == "SUCCESS" ] && success=$((success + 1))
     done
 
+    record_server_history
+
     generate_email_summary "$success" "${#SERVERS[@]}"
 }
 
@@ -710,6 +1536,7 @@ test_connections_only() {
     local ok=0
     for srv in "${!SERVERS[@]}"; do
         test_ssh_connection "$srv" && ok=$((ok + 1))
+        close_ssh_master "$srv"
     done
     log "${BLUE}Results: $ok/${#SERVERS[@]} OK${NC}"
 }
@@ -721,6 +1548,7 @@ main() {
     local single=""
 
     mkdir -p "$(dirname "$LOG_FILE")"
+    trap close_ssh_masters EXIT
 
     log "${BLUE}=== MySQL Dump Started ===${NC}"
     log "${BLUE}Date: $(date)${NC}"
@@ -749,19 +1577,20 @@ main() {
     check_environment
 
     [ "$test_only" = true ] && { test_connections_only; exit 0; }
-    [ "$cleanup_only" = true ] && { cleanup_old_data; exit 0; }
+    [ "$cleanup_only" = true ] && { cleanup_old_data sftp; exit 0; }
 
     [ "$force" = false ] && ! check_monthly_schedule && { log "${YELLOW}Use --force${NC}"; exit 0; }
 
     # Create S3 monthly directory if S3 upload is enabled
     create_monthly_directory
     
-    # Cleanup old data
+    # Cleanup old data (SFTP retention runs in the upload session)
     cleanup_old_data
 
     if [ -n "$single" ]; then
         process_server "$single"
         local res=$?
+        upload_sftp_batch
         local count=0
         [ $res -eq 0 ] && [ "${SERVER_STATUS[$single]}" == "SUCCESS" ] && count=1
         generate_email_summary "$count" 1
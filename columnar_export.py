@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Script: columnar_export.py
+Purpose: Columnar export of query results used by create_excel_from_tsv.py (--columnar / --backend)
+         Writes one file per query next to the workbook - Parquet, or Arrow IPC when pyarrow
+         was built without Parquet support - with the Server column first and typed columns
+         (int, float, datetime) from the per-query column_types. Rows are buffered per column
+         and flushed as a row group every ROW_GROUP_ROWS rows, so memory stays bounded while
+         the TSV is streamed.
+         pyarrow is optional: without it the export is skipped with a warning.
+Author: Infrastructure Team
+"""
+
+import os
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+except ImportError:  # Excel output does not depend on it
+    pa = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+COLUMNAR_FORMATS = ("parquet", "arrow")
+FILE_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Rows buffered per column before a row group (Parquet) or record batch (Arrow IPC) is written
+ROW_GROUP_ROWS = 100000
+
+# mysql --batch writes SQL NULL as this literal; columnar files store a real null instead
+MYSQL_NULL = "NULL"
+
+# Python type a converted value must have to be stored in a typed column (anything else -> null)
+TYPE_CHECKS = {"int": int, "float": (int, float), "datetime": datetime}
+
+
+def resolve_format(requested):
+    """
+    Format that can actually be written for the requested one, or None without pyarrow
+    Parquet falls back to Arrow IPC when pyarrow has no Parquet support
+    """
+    if pa is None:
+        return None
+    if requested == "parquet" and pq is None:
+        return "arrow"
+    return requested
+
+
+def columnar_path(excel_file, query_name, fmt):
+    """<workbook name without .xlsx>_<Query>.<ext>, next to the workbook"""
+    return f"{os.path.splitext(excel_file)[0]}_{query_name}{FILE_EXTENSIONS[fmt]}"
+
+
+def arrow_type(column_type):
+    return {"int": pa.int64(), "float": pa.float64(), "datetime": pa.timestamp("s")}.get(column_type, pa.string())
+
+
+class ColumnarWriter:
+    """
+    Streams the rows of one query into a columnar file
+    Headers and rows are the ones the sheets receive (Server column first, values converted);
+    values that failed conversion in a typed column, and literal NULLs, are stored as null
+    """
+
+    def __init__(self, path, headers, types, fmt):
+        self.path = path
+        self.fmt = fmt
+        self.column_types = [types.get(header) for header in headers]
+        self.schema = pa.schema([pa.field(header, arrow_type(column_type))
+                                 for header, column_type in zip(headers, self.column_types)])
+        self.columns = [[] for _ in headers]
+        self.buffered = 0
+        self.rows_written = 0
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema, compression="snappy")
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def write_row(self, values):
+        columns = self.columns
+        for idx in range(len(columns)):
+            columns[idx].append(values[idx] if idx < len(values) else None)
+        self.buffered += 1
+        if self.buffered >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def write_rows(self, rows):
+        for values in rows:
+            self.write_row(values)
+
+    def flush(self):
+        """Write the buffered rows as one row group / record batch"""
+        if not self.buffered:
+            return
+        arrays = []
+        for column_type, values, field in zip(self.column_types, self.columns, self.schema):
+            expected = TYPE_CHECKS.get(column_type)
+            if expected is None:
+                values = [None if value == MYSQL_NULL else value for value in values]
+            else:
+                values = [value if isinstance(value, expected) and not isinstance(value, bool) else None
+                          for value in values]
+            arrays.append(pa.array(values, field.type))
+        batch = pa.record_batch(arrays, schema=self.schema)
+        if self.fmt == "parquet":
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self.rows_written += self.buffered
+        self.columns = [[] for _ in self.columns]
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        return self.rows_written
+
@@ -3,75 +3,1629 @@
 Script: create_excel_from_tsv.py
 Purpose: Convert TSV query results to Excel file with multiple sheets
          Automatically splits large datasets into multiple sheets if they exceed Excel's row limit
+         Optional streaming mode writes rows through write-only worksheets to keep memory flat
+         Optional native engine (xlsx_stream_writer.py) writes the XLSX parts directly, bypassing openpyxl
+         With the native engine, sheets (including split parts) can be rendered in parallel worker processes
+         Batch mode converts many servers from one manifest in a single interpreter (one warm import)
+         Input can be a directory of <Query>.tsv files or the downloaded mysql_results tar.gz itself
+         Reports per-phase timings, throughput and peak memory as a METRICS JSON line
+         Optional CPU (cProfile) and memory (tracemalloc) profiles are written to the logs directory
+         Optional columnar export (columnar_export.py) writes a Parquet/Arrow file per query next to the workbook
+         create_excel_from_rows() writes the same workbook from row iterators or streams (no TSV files)
+         --stream reads every query from one framed (optionally gzipped) stream, e.g. piped from ssh
+         --sort orders every query by its SQL ORDER BY here (external merge sort in bounded memory), so the
+         remote SQL can run without ORDER BY
+         Every output format is a RowSink backend (openpyxl, openpyxl-streaming, native, csv.gz, parquet,
+         arrow) fed the same header and row batches; --backend picks them per run
          Uses unbuffered output for real-time progress reporting
 Author: Infrastructure Team
-Usage: python3 create_excel_from_tsv.py <tsv_directory> <output_excel_file> <server_name>
+Usage: python3 create_excel_from_tsv.py [--streaming] [--engine openpyxl|native] [--jobs N] [--columnar parquet|arrow]
+                                       [--backend NAME ...] [--sort [--sort-buffer-rows N] [--sort-dir DIR]]
+                                       <tsv_directory|results.tar.gz> <output_excel_file> <server_name>
+       python3 create_excel_from_tsv.py [options] --stream <stream_file|-> <output_excel_file> <server_name>
+       python3 create_excel_from_tsv.py [options] --batch <manifest.tsv> [--batch-workers N]
+       Profiling: [--profile-cpu] [--profile-memory] [--profile-dir DIR]
 """
 
 import sys
 import re
 import os
+import csv
+import io
+import json
+import gzip
+import resource
+import cProfile
+import pstats
+import tracemalloc
+import tarfile
+import tempfile
+import shutil
+import heapq
+import pickle
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice, chain
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
 from datetime import datetime
-import re
+from xlsx_stream_writer import (XlsxStreamWorkbook, XlsxStreamSheet, STYLE_DEFAULT, STYLE_HEADER, STYLE_WRAP_TOP,
+                                STYLE_ERROR)
+from columnar_export import COLUMNAR_FORMATS, MYSQL_NULL, ColumnarWriter, columnar_path, resolve_format
+
+# Control characters that are not allowed in XLSX cell text (tab, newline and carriage return are kept)
+CONTROL_CHARS = ''.join(chr(code) for code in [*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F])
+_CONTROL_CHARS_RE = re.compile('[' + re.escape(CONTROL_CHARS) + ']')
+_CONTROL_CHARS_TABLE = str.maketrans('', '', CONTROL_CHARS)
+
+
+def sanitize_text(text):
+    """
+    Strip control characters from a string
+    Clean text (almost every value) costs one precompiled regex scan and is returned as-is;
+    dirty text is stripped in bulk with a translation table
+    """
+    if _CONTROL_CHARS_RE.search(text) is None:
+        return text
+    return text.translate(_CONTROL_CHARS_TABLE)
+
 
 def sanitize(value):
+    """Strip control characters from string values, other types pass through unchanged"""
     if isinstance(value, str):
-        return re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', value)
+        return sanitize_text(value)
     return value
 
 
+def sanitize_row(values):
+    """Sanitize every value of a row (list or tuple), returns a list"""
+    return [sanitize_text(value) if isinstance(value, str) else value for value in values]
+
+
+
 # Force unbuffered output
 sys.stdout.reconfigure(line_buffering=True) if hasattr(sys.stdout, 'reconfigure') else None
 
 # Excel row limit (1,048,576 rows total, reserve 1 for header)
 EXCEL_MAX_ROWS = 1048575  # Maximum data rows per sheet
 
-def create_excel_from_tsv_files(tsv_dir, excel_file, server_name):
+# Workbook writer engines selectable from the CLI
+ENGINES = ("openpyxl", "native")
+
+# Output backends (--backend, repeatable): at most one workbook, any number of per-query file formats
+WORKBOOK_BACKENDS = ("openpyxl", "openpyxl-streaming", "native")
+BACKENDS = WORKBOOK_BACKENDS + ("csv.gz",) + COLUMNAR_FORMATS
+
+# gzip level for CSV.gz output (the gzip CLI default; 9 costs far more CPU for little gain)
+CSV_GZIP_LEVEL = 6
+
+# Datasets above this size report progress while rows are written, every PROGRESS_ROWS rows
+LARGE_DATASET_ROWS = 100000
+PROGRESS_ROWS = 100000
+
+# Auto-fit: longest rendered value + 2, capped at this width
+MAX_COLUMN_WIDTH = 50
+
+# Write-only worksheets emit column widths before the first row, so their widths
+# come from this many leading rows, buffered before anything is appended
+WIDTH_PREVIEW_ROWS = 1000
+
+# Header styling shared by every sheet
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+HEADER_FILL = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+ERROR_FONT = Font(bold=True, color="FF0000")
+
+# openpyxl (font, fill, alignment) for the xlsx_stream_writer style ids the sinks pass around
+OPENPYXL_STYLES = {
+    STYLE_HEADER: (HEADER_FONT, HEADER_FILL, HEADER_ALIGNMENT),
+    STYLE_WRAP_TOP: (None, None, Alignment(wrap_text=True, vertical="top")),
+    STYLE_ERROR: (ERROR_FONT, None, None),
+}
+
+
+# Read size for the binary line-counting pass
+COUNT_CHUNK_BYTES = 1024 * 1024
+
+# Frame markers around each query's mysql --batch output in a --stream input (see QueryStream)
+STREAM_BEGIN = "##QUERY_BEGIN "
+STREAM_END = "##QUERY_END "
+
+# Rows held in memory per sorted run with --sort; larger inputs are spilled to temporary files and merged
+SORT_BUFFER_ROWS = 200000
+
+# Lines read and converted per batch; read/parse time is measured per batch, not per row
+METRICS_BATCH_ROWS = 10000
+
+# Profiles go next to the mysql_dump_collection_*.log files unless --profile-dir is given
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+PROFILE_REPORT_LINES = 40
+
+
+class _BoundedReader(io.RawIOBase):
+    """Raw reader that returns at most `size` bytes from an already positioned stream"""
+
+    def __init__(self, raw, size):
+        self.raw = raw
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:self.remaining]
+        data = self.raw.read(len(view))
+        view[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class TarTsvMember:
     """
-    Create an Excel file with multiple sheets from TSV files
-    Automatically splits sheets if data exceeds Excel's row limit
-    
-    Args:
-        tsv_dir: Directory containing TSV files
-        excel_file: Output Excel file path
-        server_name: Name of the server (for Server column)
+    A query TSV stored inside the downloaded mysql_results tar.gz
+    Located by its data offset in the uncompressed stream, so it can be re-read without
+    extracting the archive. gzip cannot seek, so every open() decompresses the archive from
+    its start up to the member again: fine for the serial count and data passes, too costly
+    per worker part, which is why --jobs > 1 extracts the TSVs instead (extract_tar_tsv_members)
     """
-    
-    # Abbreviated sheet names to avoid 31-character Excel limit
-    # Maps full query name to abbreviated sheet name
-    sheet_name_mapping = {
-        "Group_Hierarchy_Path": "GroupHierarchyPath",
-        "Gateway_Count_By_Group": "GatewayCountByGroup",
-        "User_List_With_Groups": "UserListWithGroups",
-        "Gateways_Registered_Last_30_Days": "GatewaysLast30Days",
-        "Device_Level_Data": "DeviceLevelData"
-    }
-    
-    # Expected column headers for each query (when no data)
-    # These match the SELECT columns from each query's SQL
-    expected_columns = {
-        "Group_Hierarchy_Path": ["rootid", "rootgroup", "groupid", "groupname"],
-        "Gateway_Count_By_Group": ["groupname", "groupid", "num_gateways"],
-        "User_List_With_Groups": ["groupid", "groupname", "username", "email"],
-        "Gateways_Registered_Last_30_Days": ["gateways_registered_last_30_days"],
-       "Device_Level_Data": ["serial", "name", "fullpath", "device_type", "platform", "last_comm"]
-
-    }
-    
-    # Map TSV filenames (without extension) to query names for lookup
-    tsv_to_query_map = {
-        "Group_Hierarchy_Path": "Group_Hierarchy_Path",
-        "Gateway_Count_By_Group": "Gateway_Count_By_Group", 
-        "User_List_With_Groups": "User_List_With_Groups",
-        "Gateways_Registered_Last_30_Days": "Gateways_Registered_Last_30_Days",
-        "Device_Level_Data": "Device_Level_Data"
-    }
-    
-    # Query definitions for "Queries" index sheet
-    queries = {
-        "Group_Hierarchy_Path": """WITH RECURSIVE grp_path (groupid, label, rootid, rootlabel) AS
+
+    def __init__(self, tarball, name, offset, size):
+        self.tarball = tarball
+        self.name = name
+        self.offset = offset
+        self.size = size
+
+    def open(self, start=0):
+        """Binary file object over the member's bytes, starting `start` bytes into the member"""
+        raw = gzip.open(self.tarball, 'rb')
+        raw.seek(self.offset + start)
+        return io.BufferedReader(_BoundedReader(raw, self.size - start), COUNT_CHUNK_BYTES)
+
+    def __str__(self):
+        return f"{self.tarball}:{self.name}"
+
+
+def is_tar_input(path):
+    """True when the converter input is a tarball rather than a TSV directory"""
+    return os.path.isfile(path) and tarfile.is_tarfile(path)
+
+
+def _tar_tsv_members(tar, query_names):
+    """
+    (query name, member) for each query's TSV, in archive order
+    Members are named <Query>_<server>_<date>.tsv (or plain <Query>.tsv); the longest query
+    name that matches the member name wins
+    """
+    by_length = sorted(query_names, key=len, reverse=True)
+    for member in tar:
+        if not member.isfile() or not member.name.endswith('.tsv'):
+            continue
+        stem = os.path.basename(member.name)[:-len('.tsv')]
+        for query_name in by_length:
+            if stem == query_name or stem.startswith(query_name + '_'):
+                yield query_name, member
+                break
+
+
+def index_tar_tsv_members(tarball, query_names):
+    """Find each query's TSV in a mysql_results tar.gz in one streaming pass. Returns {query_name: TarTsvMember}"""
+    with tarfile.open(tarball, 'r|gz') as tar:
+        return {query_name: TarTsvMember(tarball, member.name, member.offset_data, member.size)
+                for query_name, member in _tar_tsv_members(tar, query_names)}
+
+
+def extract_tar_tsv_members(tarball, query_names, tmp_dir):
+    """
+    Write each query's TSV from a mysql_results tar.gz to tmp_dir as <Query>.tsv, in one
+    streaming pass, for worker processes that each re-read a part. Returns {query_name: path}
+    """
+    paths = {}
+    with tarfile.open(tarball, 'r|gz') as tar:
+        for query_name, member in _tar_tsv_members(tar, query_names):
+            path = os.path.join(tmp_dir, f"{query_name}.tsv")
+            with tar.extractfile(member) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, COUNT_CHUNK_BYTES)
+            paths[query_name] = path
+    return paths
+
+
+def open_tsv(tsv_file, start=0):
+    """Open a TSV (file path or TarTsvMember) in binary mode, positioned `start` bytes in"""
+    if isinstance(tsv_file, TarTsvMember):
+        return tsv_file.open(start)
+    f = open(tsv_file, 'rb')
+    f.seek(start)
+    return f
+
+
+def count_tsv_lines(tsv_file):
+    """
+    Count lines in one binary pass without keeping the file in memory
+    A final line without a trailing newline still counts as a line
+    """
+    lines = 0
+    last_chunk = b''
+    with open_tsv(tsv_file) as f:
+        while True:
+            chunk = f.read(COUNT_CHUNK_BYTES)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last_chunk = chunk
+    if last_chunk and not last_chunk.endswith(b'\n'):
+        lines += 1
+    return lines
+
+
+class TsvRowSource:
+    """
+    Streaming view of a query TSV file
+    The header line is read eagerly, data rows are yielded lazily by rows()
+    """
+
+    # rows() yields raw TSV lines (see IterRowSource for row tuples)
+    parse = None
+
+    def __init__(self, tsv_file):
+        self.tsv_file = tsv_file
+        self.total_lines = count_tsv_lines(tsv_file)
+        self.header_line = None
+        if self.total_lines > 0:
+            with io.TextIOWrapper(open_tsv(tsv_file), newline='\n') as f:
+                self.header_line = f.readline().rstrip('\n')
+
+    @property
+    def total_rows(self):
+        """Number of data rows (lines after the header)"""
+        return max(self.total_lines - 1, 0)
+
+    @property
+    def has_rows(self):
+        return self.total_lines > 1
+
+    @property
+    def headers(self):
+        return self.header_line.split('\t') if self.header_line is not None else []
+
+    def is_placeholder(self):
+        """True for the 'No Data Available' file written by the remote script for empty results"""
+        return self.total_lines == 1 and self.header_line.strip() == "No Data Available"
+
+    def rows(self, start_offset=None):
+        """
+        Yield data lines (without trailing newline) one at a time, skipping the header
+        start_offset (from find_line_offsets) starts reading at that byte position instead
+        """
+        # Lines end at '\n' only, as count_tsv_lines counts them: a '\r' inside a field stays in the field
+        with io.TextIOWrapper(open_tsv(self.tsv_file, start_offset or 0), newline='\n') as f:
+            if start_offset is None:
+                f.readline()
+            for line in f:
+                yield line.rstrip('\n')
+
+
+# Sentinel for "iterator exhausted" (a data row can be an empty line or tuple)
+_NO_ROW = object()
+
+
+def tsv_value(value):
+    """
+    One value rendered the way mysql --batch writes it: None -> NULL, datetime as
+    YYYY-MM-DD HH:MM:SS, everything else via str(); strings are sanitized
+    """
+    if isinstance(value, str):
+        return sanitize_text(value)
+    if value is None:
+        return MYSQL_NULL
+    if isinstance(value, bytes):
+        return sanitize_text(value.decode('utf-8', 'replace'))
+    return str(value)
+
+
+def tsv_values(row):
+    """Row tuple -> list of TSV strings, so iterator rows are sized and typed exactly like TSV lines"""
+    return [tsv_value(value) for value in row]
+
+
+class IterRowSource:
+    """
+    Rows of one query that do not come from a TSV file: an in-memory iterable or a stream
+    The iterable yields the header first, then the data rows, either as row tuples/lists
+    (any value types, None for SQL NULL) or as TSV text lines - e.g. a text or binary file
+    object, a mysql --batch pipe or a generator
+    The row count is unknown up front (total_rows is None); the first data row is read
+    ahead so empty and header-only results are recognised like the equivalent TSV files
+    """
+
+    def __init__(self, rows):
+        if hasattr(rows, 'read') and not isinstance(rows, io.TextIOBase):
+            rows = io.TextIOWrapper(rows, newline='\n')
+        self._rows = iter(rows)
+        header = next(self._rows, None)
+        self.is_text = isinstance(header, str)
+        if header is None:
+            self.headers = []
+        elif self.is_text:
+            self.headers = header.rstrip('\r\n').split('\t')
+        else:
+            self.headers = [str(name) for name in header]
+        self.parse = None if self.is_text else tsv_values
+        self._first = next(self._rows, _NO_ROW)
+
+    total_rows = None
+
+    @property
+    def has_rows(self):
+        return self._first is not _NO_ROW
+
+    def is_placeholder(self):
+        """True for the single 'No Data Available' line the remote script writes for empty results"""
+        return not self.has_rows and [name.strip() for name in self.headers] == ["No Data Available"]
+
+    def rows(self):
+        """Yield the data rows once: TSV lines without line ending, or row tuples as given"""
+        if not self.has_rows:
+            return
+        rows = chain([self._first], self._rows)
+        if self.is_text:
+            for line in rows:
+                yield line.rstrip('\r\n')
+        else:
+            yield from rows
+
+
+def open_query_stream(path):
+    """
+    Text stream over a --stream input: a file, or '-' for stdin
+    gzip input (the remote script's frames piped through gzip -1) is detected by its magic bytes
+    Lines end at '\n' only, as mysql --batch writes them ('\r' can be part of a value)
+    """
+    raw = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    if not isinstance(raw, io.BufferedReader):
+        raw = io.BufferedReader(raw, COUNT_CHUNK_BYTES)
+    if raw.peek(2)[:2] == b'\x1f\x8b':
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, newline='\n')
+
+
+class QueryStream:
+    """
+    All query results of one server arriving as a single framed text stream, e.g. the remote
+    dump script's stdout piped through ssh, so no TSV file or tarball exists on either side:
+        ##QUERY_BEGIN <query name>
+        <mysql --batch output: header line, then data lines>
+        ##QUERY_END <query name> OK|FAILED
+    write_workbook reads it through frames(), in arrival order, so no frame is copied to disk; get()
+    reads it in any given order instead, spooling a frame that arrives before its turn to a
+    temporary file. A query whose frame failed before any line, or never arrived, gets None
+    (placeholder sheet, like the TSV the tar path removes); a failure after lines were handed
+    out raises while they are read
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.current = None  # Query name of the frame being read
+        self.spooled = {}  # Query name -> (temporary file, lines, error)
+
+    def _frame_lines(self):
+        """Lines of the current frame up to its end marker, raising if the remote query failed"""
+        query_name = self.current
+        lines = 0
+        for line in self.stream:
+            if line.startswith(STREAM_END):
+                self.current = None
+                if line.split()[-1] != "OK":
+                    raise RuntimeError(f"Remote query {query_name} failed after {lines:,} lines")
+                return
+            lines += 1
+            yield line
+        self.current = None
+        raise RuntimeError(f"Stream ended inside {query_name} after {lines:,} lines")
+
+    def _next_frame(self):
+        """Skip what is left of the current frame; return the next frame's query name (None at the end)"""
+        if self.current is not None:
+            try:
+                for _ in self._frame_lines():
+                    pass
+            except RuntimeError:
+                pass  # Already reported by whoever was reading the frame
+        for line in self.stream:
+            if line.startswith(STREAM_BEGIN):
+                self.current = line[len(STREAM_BEGIN):].strip()
+                return self.current
+        return None
+
+    def _spool(self, query_name, first=None):
+        spool = tempfile.TemporaryFile('w+', newline='\n')
+        lines = 0
+        error = None
+        if first is not None:
+            spool.write(first)
+            lines += 1
+        try:
+            for line in self._frame_lines():
+                spool.write(line)
+                lines += 1
+        except RuntimeError as e:
+            error = e
+        self.spooled[query_name] = (spool, lines, error)
+
+    def _replay(self, spool, error):
+        with spool:
+            spool.seek(0)
+            yield from spool
+        if error is not None:
+            raise error
+
+    def get(self, query_name, default=None):
+        """Lines of one query's frame (header first), or default if it failed empty or never arrived"""
+        if query_name in self.spooled:
+            spool, lines, error = self.spooled.pop(query_name)
+            if error is not None and lines == 0:
+                spool.close()
+                return default
+            return self._replay(spool, error)
+
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return default
+            if frame == query_name:
+                break
+            self._spool(frame)
+
+        lines = self._frame_lines()
+        try:
+            first = next(lines, None)
+        except RuntimeError:
+            return default
+        return [] if first is None else chain([first], lines)
+
+    def frames(self, queries, after=None):
+        """
+        (query name, lines or None) for every one of queries: each frame as it arrives, then the
+        queries whose frame never arrived. after(query name, header line) may name another query
+        that has to be handed over first; the frame is then spooled until that one has been
+        """
+        handed = set()
+        waiting = {}  # Query name -> frames spooled until it has been handed over
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            if frame not in queries or frame in handed:
+                continue
+            lines = self._frame_lines()
+            try:
+                first = next(lines, None)
+                rows = [] if first is None else chain([first], lines)
+            except RuntimeError:
+                first = rows = None
+            if first is not None and after is not None:
+                before = after(frame, first)
+                if before is not None and before not in handed:
+                    self._spool(frame, first)
+                    waiting.setdefault(before, []).append(frame)
+                    continue
+            handed.add(frame)
+            yield frame, rows
+            for query_name in waiting.pop(frame, []):
+                handed.add(query_name)
+                yield query_name, self.get(query_name)
+        for query_name in queries:
+            if query_name not in handed:
+                yield query_name, self.get(query_name)
+
+
+def find_line_offsets(tsv_file, line_numbers):
+    """
+    Byte offset at which each of the given 0-based line numbers starts, in one binary pass
+    Used to hand each split part of a large TSV to its own worker process
+    """
+    targets = sorted(line_numbers)
+    offsets = {}
+    lines_seen = 0
+    position = 0
+    next_target = 0
+    with open_tsv(tsv_file) as f:
+        while next_target < len(targets):
+            chunk = f.read(COUNT_CHUNK_BYTES)
+            if not chunk:
+                break
+            chunk_lines = chunk.count(b'\n')
+            # Line N starts right after the N-th newline
+            while next_target < len(targets) and targets[next_target] <= lines_seen + chunk_lines:
+                needed = targets[next_target] - lines_seen
+                idx = -1
+                for _ in range(needed):
+                    idx = chunk.index(b'\n', idx + 1)
+                offsets[targets[next_target]] = position + idx + 1
+                next_target += 1
+            lines_seen += chunk_lines
+            position += len(chunk)
+    return [offsets[number] for number in line_numbers]
+
+
+def is_native(ws):
+    """True when the worksheet comes from the native streaming writer"""
+    return isinstance(ws, XlsxStreamSheet)
+
+
+def is_write_only(ws):
+    """True when the worksheet belongs to a write-only (streaming) workbook"""
+    return getattr(getattr(ws, 'parent', None), 'write_only', False)
+
+
+def set_column_width(ws, col_idx, width):
+    """Set a column width on any worksheet type (1-based column index)"""
+    if is_native(ws):
+        ws.set_column_width(col_idx, width)
+    else:
+        ws.column_dimensions[get_column_letter(col_idx)].width = width
+
+
+def styled_cell(ws, value, style):
+    """Build a styled cell that can be appended to a write-only worksheet"""
+    return style_cell(WriteOnlyCell(ws, value=value), style)
+
+
+def write_header_row(ws, headers):
+    """
+    Write the styled header row as row 1
+    Write-only and native worksheets get the whole row appended once, regular ones are set cell by cell
+    """
+    if is_native(ws):
+        ws.append(headers, style=STYLE_HEADER)
+        return
+
+    if is_write_only(ws):
+        ws.append([styled_cell(ws, header, STYLE_HEADER) for header in headers])
+        return
+
+    for col_idx, header in enumerate(headers, start=1):
+        style_cell(ws.cell(row=1, column=col_idx, value=header), STYLE_HEADER)
+
+
+def set_column_widths(ws, widths):
+    """Set the widths of columns 1..len(widths)"""
+    for col_idx, width in enumerate(widths, start=1):
+        set_column_width(ws, col_idx, width)
+
+
+def style_cell(cell, style):
+    """Apply one of the xlsx_stream_writer STYLE_* ids to an openpyxl cell"""
+    font, fill, alignment = OPENPYXL_STYLES[style]
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
+
+def fixed_widths(num_data_columns):
+    """Server column at 15, every data column at 20 (sheets without data rows)"""
+    return [15] + [20] * num_data_columns
+
+
+# Converters receive values from already sanitized rows, so unparseable values are returned as-is.
+# int() and float() also accept surrounding whitespace, '_' digit separators, non-ASCII digits and
+# nan/inf, none of which MySQL emits for a number, so values must match the plain form first
+_INT_RE = re.compile(r'[-+]?[0-9]+')
+_FLOAT_RE = re.compile(r'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?')
+
+
+def to_int(value):
+    """Integer column; values that are not plain integers (e.g. NULL) stay as text"""
+    if _INT_RE.fullmatch(value) is None:
+        return value
+    return int(value)
+
+
+def to_float(value):
+    """Decimal column; values that are not plain numbers (e.g. NULL) stay as text"""
+    if _FLOAT_RE.fullmatch(value) is None:
+        return value
+    return float(value)
+
+
+def to_datetime(value):
+    """MySQL DATETIME column (YYYY-MM-DD HH:MM:SS[.ffffff]); anything else (e.g. NULL) stays as text"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+
+# Column type names used in column_types, mapped to their converters ("str" needs no conversion)
+COLUMN_CONVERTERS = {
+    "int": to_int,
+    "float": to_float,
+    "datetime": to_datetime,
+}
+
+
+class RowConverter:
+    """
+    Per-sheet row conversion built once from the declared column types
+    Only typed columns are touched; text columns pass straight through
+    """
+
+    def __init__(self, headers, types):
+        self.typed_columns = [(col_idx, COLUMN_CONVERTERS[types[header]])
+                              for col_idx, header in enumerate(headers)
+                              if types.get(header, "str") != "str"]
+        self.min_width = self.typed_columns[-1][0] + 1 if self.typed_columns else 0
+
+    def convert(self, values):
+        """Convert a list of sanitized values in place and return it"""
+        if len(values) >= self.min_width:
+            for col_idx, convert in self.typed_columns:
+                values[col_idx] = convert(values[col_idx])
+        else:
+            # Ragged (short) row - convert only the typed columns that are present
+            for col_idx, convert in self.typed_columns:
+                if col_idx < len(values):
+                    values[col_idx] = convert(values[col_idx])
+        return values
+
+
+class ColumnWidthTracker:
+    """
+    Running max of rendered value length per data column, updated as rows are written
+    so auto-fit needs no pass over the finished sheet
+    """
+
+    def __init__(self, headers):
+        self.lengths = [len(header) for header in headers]
+
+    def update(self, values):
+        """Fold one row of raw (string) values into the running max; a row wider than the header adds columns"""
+        lengths = self.lengths
+        if len(values) == len(lengths):
+            self.lengths = list(map(max, lengths, map(len, values)))
+            return
+        if len(values) > len(lengths):
+            lengths.extend([0] * (len(values) - len(lengths)))
+        for col_idx, value in enumerate(values):
+            if len(value) > lengths[col_idx]:
+                lengths[col_idx] = len(value)
+
+    def widths(self):
+        return [min(length + 2, MAX_COLUMN_WIDTH) for length in self.lengths]
+
+
+def auto_widths(server_name, tracker):
+    """Server column sized from its header and value, data columns from the tracker"""
+    return [min(max(len("Server"), len(server_name)) + 2, MAX_COLUMN_WIDTH)] + tracker.widths()
+
+
+class RowSink:
+    """
+    Output backend the converter writes through
+    Each sheet is begin_sheet(), any number of write_rows() batches and end_sheet(); headers
+    and rows start with the Server column. Column widths go to begin_sheet when they are known
+    up front (fixed widths, or the preview widths of a widths_first backend), else to end_sheet
+    query names the query a sheet's rows belong to (None for the Queries index and error sheets);
+    end_query() follows the last sheet of a query, so per-query files span all split parts
+    """
+
+    # True when widths must reach begin_sheet, before any row is written
+    widths_first = False
+
+    def begin_sheet(self, title, headers, widths=None, query=None, styles=None):
+        """headers=None writes no header row; styles is one STYLE_* id per column for write_rows"""
+        raise NotImplementedError
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def write_notice(self, values, style=STYLE_DEFAULT):
+        """Placeholder / error row: shown in workbooks, never part of the query's data"""
+
+    def end_sheet(self, widths=None):
+        pass
+
+    def retitle_sheet(self, title):
+        """Rename the sheet begun last (a streamed query turned out to need a split)"""
+
+    def end_query(self, failed=False):
+        """All sheets of the current query are written; failed drops what was written for it"""
+
+    def sheet_count(self):
+        """Sheets begun (or reserved) so far; a query's sheets are the span between two counts"""
+        return 0
+
+    def order_sheets(self, spans):
+        """Reorder the sheets: those outside every (start, end) span stay first, then each span in turn"""
+
+    def save(self):
+        pass
+
+
+def ordered_sheets(sheets, spans):
+    """sheets rearranged as RowSink.order_sheets describes"""
+    spanned = set()
+    for start, end in spans:
+        spanned.update(range(start, end))
+    order = [index for index in range(len(sheets)) if index not in spanned]
+    for start, end in spans:
+        order.extend(range(start, end))
+    return [sheets[index] for index in order]
+
+
+class OpenpyxlSink(RowSink):
+    """
+    Workbook written with openpyxl
+    write_only=True uses write-only worksheets: rows are flushed as they are appended instead of
+    being held as Cell objects until save, but widths have to be known before the first row
+    """
+
+    def __init__(self, excel_file, write_only=False):
+        self.excel_file = excel_file
+        self.wb = Workbook(write_only=write_only)
+        if not write_only:
+            self.wb.remove(self.wb.active)
+        self.widths_first = write_only
+        self.ws = None
+        self.styles = None
+
+    def begin_sheet(self, title, headers, widths=None, query=None, styles=None):
+        self.ws = self.wb.create_sheet(title)
+        self.styles = styles
+        if widths is not None:
+            set_column_widths(self.ws, widths)
+        if headers is not None:
+            write_header_row(self.ws, headers)
+
+    def write_rows(self, rows):
+        if self.styles is None:
+            append = self.ws.append
+            for row in rows:
+                append(row)
+            return
+        for row in rows:
+            self._append_styled(row, self.styles)
+
+    def write_notice(self, values, style=STYLE_DEFAULT):
+        self._append_styled(values, [style] * len(values))
+
+    def _append_styled(self, values, styles):
+        ws = self.ws
+        if self.wb.write_only:
+            ws.append([styled_cell(ws, value, style) if style else value for value, style in zip(values, styles)])
+            return
+        ws.append(values)
+        for col_idx, style in enumerate(styles, start=1):
+            if style:
+                style_cell(ws.cell(row=ws.max_row, column=col_idx), style)
+
+    def end_sheet(self, widths=None):
+        if widths is not None:
+            set_column_widths(self.ws, widths)
+
+    def retitle_sheet(self, title):
+        self.ws.title = title
+
+    def sheet_count(self):
+        return len(self.wb._sheets)
+
+    def order_sheets(self, spans):
+        self.wb._sheets = ordered_sheets(self.wb._sheets, spans)
+
+    def save(self):
+        self.wb.save(self.excel_file)
+
+
+class NativeXlsxSink(RowSink):
+    """
+    Workbook written by xlsx_stream_writer: rows are rendered straight to SpreadsheetML
+    Widths may be set before or after the rows; sheets can also be rendered by worker
+    processes into parts reserved with reserve_sheet()
+    """
+
+    def __init__(self, excel_file):
+        self.excel_file = excel_file
+        self.wb = XlsxStreamWorkbook()
+        self.ws = None
+        self.style = STYLE_DEFAULT
+
+    def _new_sheet(self, title):
+        return self.wb.create_sheet(title)
+
+    def begin_sheet(self, title, headers, widths=None, query=None, styles=None):
+        self.ws = self._new_sheet(title)
+        self.style = styles if styles is not None else STYLE_DEFAULT
+        if widths is not None:
+            set_column_widths(self.ws, widths)
+        if headers is not None:
+            write_header_row(self.ws, headers)
+
+    def write_rows(self, rows):
+        append = self.ws.append
+        style = self.style
+        for row in rows:
+            append(row, style)
+
+    def write_notice(self, values, style=STYLE_DEFAULT):
+        self.ws.append(values, style=style)
+
+    def end_sheet(self, widths=None):
+        if widths is not None:
+            set_column_widths(self.ws, widths)
+
+    def retitle_sheet(self, title):
+        self.ws.title = title
+
+    def reserve_sheet(self):
+        """(tmp_dir, index, slot) for a sheet rendered by a worker process, see place_sheet()"""
+        tmp_dir, index = self.wb.reserve_part()
+        self.wb.sheets.append(None)
+        return tmp_dir, index, len(self.wb.sheets) - 1
+
+    def place_sheet(self, slot, sheet=None):
+        """Put a worker-rendered sheet into its slot; without one, the last sheet written here moves there"""
+        self.wb.sheets[slot] = sheet if sheet is not None else self.wb.sheets.pop()
+
+    def sheet_count(self):
+        return len(self.wb.sheets)
+
+    def order_sheets(self, spans):
+        self.wb.sheets = ordered_sheets(self.wb.sheets, spans)
+
+    def save(self):
+        self.wb.save(self.excel_file)
+
+
+class NativePartSink(NativeXlsxSink):
+    """Renders one sheet into a part reserved by the main process (--jobs worker side)"""
+
+    def __init__(self, tmp_dir, index):
+        self.tmp_dir = tmp_dir
+        self.index = index
+        self.ws = None
+        self.style = STYLE_DEFAULT
+
+    def _new_sheet(self, title):
+        return XlsxStreamSheet(title, self.tmp_dir, self.index)
+
+    def save(self):
+        self.ws.close()
+
+
+class QueryFileSink(RowSink):
+    """
+    Base for backends writing one file per query next to the workbook (<excel name>_<Query>.<ext>)
+    Split parts of a query go into the same file; queries without data rows still get a
+    header-only file, so every month has the same set of files. Queries/error sheets and
+    notice rows are not query data and are skipped
+    """
+
+    label = None
+
+    def __init__(self, backend, excel_file, column_types):
+        self.backend = backend
+        self.excel_file = excel_file
+        self.column_types = column_types
+        self.writer = None
+        self.active = False
+
+    def path_for(self, query_name):
+        raise NotImplementedError
+
+    def open_writer(self, path, headers, types):
+        """Writer with write_rows(rows) and close() returning the number of rows written"""
+        raise NotImplementedError
+
+    def begin_sheet(self, title, headers, widths=None, query=None, styles=None):
+        self.active = query is not None
+        if self.active and self.writer is None:
+            self.path = self.path_for(query)
+            self.writer = self.open_writer(self.path, headers, self.column_types.get(query, {}))
+
+    def write_rows(self, rows):
+        if self.active:
+            self.writer.write_rows(rows)
+
+    def end_query(self, failed=False):
+        self.active = False
+        if self.writer is None:
+            return
+        rows = self.writer.close()
+        self.writer = None
+        if failed:
+            # A partial file would look complete to the loader
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        elif rows:
+            print(f"  {self.label} file: {self.path} ({rows:,} rows)")
+        else:
+            print(f"  {self.label} file (no rows): {self.path}")
+
+    def save(self):
+        self.end_query()
+
+
+class CsvGzWriter:
+    """Gzipped CSV with a header row, written in batches"""
+
+    def __init__(self, path, headers):
+        self.file = gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=CSV_GZIP_LEVEL)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(headers)
+        self.rows_written = 0
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        self.rows_written += len(rows)
+
+    def close(self):
+        self.file.close()
+        return self.rows_written
+
+
+class CsvGzSink(QueryFileSink):
+    """One <excel name>_<Query>.csv.gz per query"""
+
+    label = "CSV"
+
+    def path_for(self, query_name):
+        return f"{os.path.splitext(self.excel_file)[0]}_{query_name}.csv.gz"
+
+    def open_writer(self, path, headers, types):
+        return CsvGzWriter(path, headers)
+
+
+class ColumnarSink(QueryFileSink):
+    """One Parquet or Arrow IPC file per query, typed from column_types (columnar_export.py)"""
+
+    label = "Columnar"
+
+    def path_for(self, query_name):
+        return columnar_path(self.excel_file, query_name, self.backend)
+
+    def open_writer(self, path, headers, types):
+        return ColumnarWriter(path, headers, types, self.backend)
+
+
+class SinkGroup(RowSink):
+    """Fans every call out to several sinks, e.g. a workbook plus per-query Parquet files"""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.widths_first = any(sink.widths_first for sink in sinks)
+
+    def begin_sheet(self, title, headers, widths=None, query=None, styles=None):
+        for sink in self.sinks:
+            sink.begin_sheet(title, headers, widths, query, styles)
+
+    def write_rows(self, rows):
+        for sink in self.sinks:
+            sink.write_rows(rows)
+
+    def write_notice(self, values, style=STYLE_DEFAULT):
+        for sink in self.sinks:
+            sink.write_notice(values, style)
+
+    def end_sheet(self, widths=None):
+        for sink in self.sinks:
+            sink.end_sheet(widths)
+
+    def retitle_sheet(self, title):
+        for sink in self.sinks:
+            sink.retitle_sheet(title)
+
+    def end_query(self, failed=False):
+        for sink in self.sinks:
+            sink.end_query(failed)
+
+    def save(self):
+        for sink in self.sinks:
+            sink.save()
+
+
+def make_sink(backend, excel_file, column_types):
+    """Sink for one BACKENDS name; columnar names must already be resolved (resolve_format)"""
+    if backend == "openpyxl":
+        return OpenpyxlSink(excel_file)
+    if backend == "openpyxl-streaming":
+        return OpenpyxlSink(excel_file, write_only=True)
+    if backend == "native":
+        return NativeXlsxSink(excel_file)
+    if backend == "csv.gz":
+        return CsvGzSink(backend, excel_file, column_types)
+    return ColumnarSink(backend, excel_file, column_types)
+
+
+def default_backends(engine="openpyxl", streaming=False, columnar=None):
+    """Backends selected by the --engine / --streaming / --columnar shorthands"""
+    if engine == "native":
+        workbook = "native"
+    else:
+        workbook = "openpyxl-streaming" if streaming else "openpyxl"
+    return [workbook] + ([columnar] if columnar else [])
+
+
+class ConversionMetrics:
+    """
+    Per-phase timings and throughput for one workbook
+    Worker-rendered sheets are merged in, so phase totals can exceed wall-clock time
+    """
+
+    # count: line-count pass, groups: group tree from an im_group extract, sort: sorted runs and spills,
+    # read: pulling lines, parse: sanitize, split, widths and typing, write: appending rows, save: wb.save
+    PHASES = ("count", "groups", "sort", "read", "parse", "write", "save")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+        self.sheets = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def add_sheet(self, sheet_name, rows, seconds):
+        self.sheets.append({"sheet": sheet_name, "rows": rows, "seconds": round(seconds, 3),
+                            "rows_per_sec": round(rows / seconds) if seconds else None})
+
+    def merge(self, other):
+        for phase, seconds in other.phases.items():
+            self.add(phase, seconds)
+        self.sheets.extend(other.sheets)
+
+    def summary(self, server_name, engine, output_files):
+        """JSON-serialisable summary; scalar fields come first so the shell can grep them"""
+        total = time.perf_counter() - self.start
+        rows = sum(sheet["rows"] for sheet in self.sheets)
+        return {
+            "server": server_name,
+            "engine": engine,
+            "rows": rows,
+            "total_seconds": round(total, 3),
+            "rows_per_sec": round(rows / total) if total else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "output_bytes": sum(os.path.getsize(path) for path in output_files if os.path.exists(path)),
+            "phases": {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+            "sheets": self.sheets,
+        }
+
+
+class MemoryProfiler:
+    """
+    tracemalloc snapshots taken at the end of each sheet, appended to a text report
+    Each entry shows current/peak traced memory, the top allocation sites and the
+    growth since the previous snapshot; the peak is reset after every snapshot
+    A running cProfile profiler is paused while snapshots are taken so it doesn't
+    report tracemalloc's own work
+    """
+
+    TOP_SITES = 15
+    FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+               tracemalloc.Filter(False, "<unknown>"))
+
+    def __init__(self, report_file, cpu_profiler=None):
+        self.report_file = report_file
+        self.cpu_profiler = cpu_profiler
+        self.previous = None
+        self.report = None
+
+    def start(self):
+        self.report = open(self.report_file, 'w')
+        self.report.write(f"tracemalloc profile started {datetime.now():%Y-%m-%d %H:%M:%S}\n")
+        self.report.write("Worker processes (--jobs, batch pool) are not traced from the parent\n")
+        tracemalloc.start()
+
+    def snapshot(self, label):
+        if self.cpu_profiler is not None:
+            self.cpu_profiler.disable()
+        try:
+            self._write_snapshot(label)
+        finally:
+            if self.cpu_profiler is not None:
+                self.cpu_profiler.enable()
+
+    def _write_snapshot(self, label):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        self.report.write(f"\n=== {label}: current {current / 1048576:.1f} MB, peak {peak / 1048576:.1f} MB ===\n")
+        self.report.write("Top allocation sites:\n")
+        for stat in snapshot.statistics("lineno")[:self.TOP_SITES]:
+            self.report.write(f"  {stat}\n")
+        if self.previous is not None:
+            self.report.write("Growth since previous snapshot:\n")
+            for stat in snapshot.compare_to(self.previous, "lineno")[:self.TOP_SITES]:
+                self.report.write(f"  {stat}\n")
+        self.report.flush()
+        self.previous = snapshot
+        tracemalloc.reset_peak()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.report.close()
+        print(f"Memory profile written to {self.report_file}")
+
+
+def write_cpu_report(profiler, report_file):
+    """Hot-function report sorted by own time and by cumulative time, plus the raw .prof for other viewers"""
+    profiler.dump_stats(os.path.splitext(report_file)[0] + ".prof")
+    with open(report_file, 'w') as f:
+        f.write("Worker processes (--jobs, batch pool) are not profiled from the parent\n")
+        stats = pstats.Stats(profiler, stream=f).strip_dirs()
+        f.write("\n=== Sorted by internal time ===\n")
+        stats.sort_stats("tottime").print_stats(PROFILE_REPORT_LINES)
+        f.write("\n=== Sorted by cumulative time ===\n")
+        stats.sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+    print(f"CPU profile written to {report_file}")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process or any worker it waited for, in MB"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def convert_batches(lines, converter, tracker=None, metrics=None, parse=None):
+    """
+    Yield lists of converted rows from raw TSV lines
+    Each raw line is sanitized in one scan before it is split (tab is not stripped);
+    with parse (e.g. tsv_values for row tuples) each item is turned into its list of strings instead;
+    the width tracker sees the rendered strings before typing
+    Lines are pulled and converted in batches of METRICS_BATCH_ROWS so read and parse
+    time can be measured without a timer call per row, and sinks get whole batches
+    """
+    lines = iter(lines)
+    while True:
+        start = time.perf_counter()
+        batch = list(islice(lines, METRICS_BATCH_ROWS))
+        read_done = time.perf_counter()
+        rows = []
+        if parse is None:
+            for line in batch:
+                values = sanitize_text(line).split('\t')
+                if tracker is not None:
+                    tracker.update(values)
+                rows.append(converter.convert(values))
+        else:
+            for item in batch:
+                values = parse(item)
+                if tracker is not None:
+                    tracker.update(values)
+                rows.append(converter.convert(values))
+        if metrics is not None:
+            metrics.add("read", read_done - start)
+            metrics.add("parse", time.perf_counter() - read_done)
+        if not rows:
+            return
+        yield rows
+
+
+def write_table(sink, title, headers, lines, server_name, converter, is_large_dataset, total_rows, metrics=None,
+                query=None, parse=None):
+    """
+    Write one data sheet through the sink: styled header row, data rows and auto-fit column widths
+    Widths are tracked over every row and passed to end_sheet; a widths_first sink instead
+    gets widths from the first WIDTH_PREVIEW_ROWS rows, which are buffered so the widths
+    can reach begin_sheet before any row
+    With metrics, time not spent reading or parsing is booked as write time
+    parse is passed on to convert_batches (row tuples instead of TSV lines)
+    """
+    start = time.perf_counter()
+    before = metrics.phases["read"] + metrics.phases["parse"] if metrics is not None else 0.0
+    lines = iter(lines)
+    tracker = ColumnWidthTracker(headers)
+
+    if sink.widths_first:
+        preview = list(convert_batches(islice(lines, WIDTH_PREVIEW_ROWS), converter, tracker, metrics, parse))
+        sink.begin_sheet(title, ["Server"] + headers, auto_widths(server_name, tracker), query)
+        # Remaining lines are converted without width tracking
+        batches = chain(preview, convert_batches(lines, converter, metrics=metrics, parse=parse))
+        rows_written = write_data_rows(sink, batches, server_name, is_large_dataset, total_rows)
+        sink.end_sheet()
+    else:
+        sink.begin_sheet(title, ["Server"] + headers, query=query)
+        rows_written = write_data_rows(sink, convert_batches(lines, converter, tracker, metrics, parse),
+                                       server_name, is_large_dataset, total_rows)
+        sink.end_sheet(auto_widths(server_name, tracker))
+
+    if metrics is not None:
+        elapsed = time.perf_counter() - start
+        metrics.add("write", elapsed - (metrics.phases["read"] + metrics.phases["parse"] - before))
+        metrics.add_sheet(title, rows_written, elapsed)
+    return rows_written
+
+
+def write_data_rows(sink, batches, server_name, is_large_dataset, total_rows):
+    """
+    Hand batches of converted rows (Server column prepended) to the sink
+    total_rows is only used for progress lines and may be None (streamed rows)
+    Returns the number of rows written
+    """
+    start = time.perf_counter()
+    rows_written = 0
+    next_progress = PROGRESS_ROWS
+    for batch in batches:
+        sink.write_rows([[server_name] + values for values in batch])
+        rows_written += len(batch)
+
+        # Show progress for large datasets
+        if is_large_dataset and rows_written >= next_progress:
+            rate = rows_written / (time.perf_counter() - start)
+            total = f"/{total_rows:,}" if total_rows is not None else ""
+            print(f"    Progress: {rows_written:,}{total} rows written ({rate:,.0f} rows/s)")
+            sys.stdout.flush()  # Flush progress updates
+            next_progress = (rows_written // PROGRESS_ROWS + 1) * PROGRESS_ROWS
+    return rows_written
+
+
+def write_fixed_sheet(sink, title, headers, server_name, query, notice=None):
+    """
+    Sheet without data rows (missing, placeholder or header-only TSV): Server column plus headers
+    at fixed widths, and optionally one notice row of `notice` under every data column
+    """
+    sink.begin_sheet(title, ["Server"] + headers, fixed_widths(len(headers)), query)
+    if notice is not None:
+        sink.write_notice([server_name] + [notice] * len(headers))
+    sink.end_sheet()
+    sink.end_query()
+
+
+def part_sheet_name(base_sheet_name, part):
+    """Split sheet name <name>_<part>, shortened to stay within Excel's 31 characters"""
+    sheet_name = f"{base_sheet_name}_{part}"
+    if len(sheet_name) > 31:
+        sheet_name = f"{base_sheet_name[:25]}_{part}"
+    return sheet_name
+
+
+def write_unsized_query(sink, base_sheet_name, headers, rows, server_name, converter, metrics=None,
+                        memory_profiler=None, query=None, parse=None):
+    """
+    Write a query whose row count is not known up front (IterRowSource), EXCEL_MAX_ROWS per sheet
+    The first sheet gets the plain name; when another row turns up after it is full, it is
+    renamed <name>_1 and the rest go to <name>_2, <name>_3, ... - the same sheets a split
+    of a counted TSV produces
+    Returns the number of sheets and of rows written
+    """
+    rows = iter(rows)
+    part = 1
+    sheet_name = base_sheet_name
+    rows_written = 0
+    while True:
+        rows_written += write_table(sink, sheet_name, headers, islice(rows, EXCEL_MAX_ROWS), server_name, converter,
+                                    True, None, metrics, query, parse)
+        if memory_profiler is not None:
+            memory_profiler.snapshot(f"after sheet {sheet_name}")
+        
+        next_row = next(rows, _NO_ROW)
+        if next_row is _NO_ROW:
+            return part, rows_written
+        
+        if part == 1:
+            sheet_name = part_sheet_name(base_sheet_name, 1)
+            sink.retitle_sheet(sheet_name)
+            if metrics is not None:
+                metrics.sheets[-1]["sheet"] = sheet_name
+            print(f"  More than {EXCEL_MAX_ROWS:,} rows - '{base_sheet_name}' renamed to '{sheet_name}'")
+        part += 1
+        sheet_name = part_sheet_name(base_sheet_name, part)
+        print(f"  Creating '{sheet_name}'")
+        sys.stdout.flush()  # Flush immediately
+        rows = chain([next_row], rows)
+
+
+def render_sheet_part(task):
+    """
+    Worker process entry point: render one data sheet (or split part) with the native writer
+    Returns the finished XlsxStreamSheet, the CPU seconds spent and the sheet's metrics
+    """
+    cpu_start = time.process_time()
+    metrics = ConversionMetrics()
+    sink = NativePartSink(task["tmp_dir"], task["index"])
+    lines = islice(TsvRowSource(task["tsv_file"]).rows(task["start_offset"]), task["row_count"])
+    write_table(sink, task["title"], task["headers"], lines, task["server_name"],
+                RowConverter(task["headers"], task["types"]), task["is_large_dataset"], task["row_count"], metrics)
+    sink.save()
+    return sink.ws, time.process_time() - cpu_start, metrics
+
+
+def render_query_files(task):
+    """
+    Worker process entry point: stream one query's TSV through the per-query file backends
+    Used with --jobs, where the sheets themselves are rendered in separate processes
+    Returns the query's metrics
+    """
+    metrics = ConversionMetrics()
+    sink = SinkGroup([make_sink(backend, task["excel_file"], {task["query"]: task["types"]})
+                      for backend in task["backends"]])
+    lines = islice(TsvRowSource(task["tsv_file"]).rows(), task["row_count"])
+    try:
+        write_table(sink, task["query"], task["headers"], lines, task["server_name"],
+                    RowConverter(task["headers"], task["types"]), False, task["row_count"], metrics, task["query"])
+    except Exception:
+        sink.end_query(failed=True)
+        raise
+    sink.end_query()
+    return metrics
+
+
+def order_by_key(headers, columns, types):
+    """
+    Sort key for rows (TSV lines or row tuples) reproducing an ascending MySQL ORDER BY on columns:
+    NULL first, int/float columns by number, other columns by their text as mysql --batch prints it
+    (fixed-width dates sort correctly), casefolded as an approximation of the case-insensitive
+    collation. Numeric columns holding non-numbers sort after the numbers
+    """
+    parts = []
+    for column in columns:
+        kind = types.get(column, "str")
+        number = COLUMN_CONVERTERS[kind] if kind in ("int", "float") else None
+        parts.append((headers.index(column), number, kind == "str"))
+
+    def key(row):
+        fields = row.split('\t') if isinstance(row, str) else tsv_values(row)
+        result = []
+        for index, number, fold in parts:
+            value = fields[index] if index < len(fields) else ""
+            if value == MYSQL_NULL:
+                result.append((0,))
+            elif number is not None:
+                converted = number(value)
+                result.append((1, converted) if converted is not value else (2, value))
+            else:
+                result.append((1, value.casefold() if fold else value))
+        return result
+
+    return key
+
+
+def _write_run(run, tmp_dir):
+    """Spill one sorted run to an anonymous temporary file: TSV lines as text, row tuples pickled"""
+    if isinstance(run[0], str):
+        spill = tempfile.TemporaryFile('w+', dir=tmp_dir, newline='\n')
+        for line in run:
+            spill.write(line)
+            spill.write('\n')
+    else:
+        spill = tempfile.TemporaryFile('w+b', dir=tmp_dir)
+        pickler = pickle.Pickler(spill, pickle.HIGHEST_PROTOCOL)
+        for row in run:
+            pickler.dump(row)
+            pickler.clear_memo()
+    spill.seek(0)
+    return spill
+
+
+def _read_run(spill):
+    """Rows of one spilled run, in order"""
+    if 'b' not in spill.mode:
+        for line in spill:
+            yield line[:-1]
+        return
+    unpickler = pickle.Unpickler(spill)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+
+def _merge_runs(runs, key):
+    """Merge the spilled runs into one sorted stream; the temporary files go when it ends"""
+    try:
+        yield from heapq.merge(*[_read_run(spill) for spill in runs], key=key)
+    finally:
+        for spill in runs:
+            spill.close()
+
+
+def external_sort(rows, key, buffer_rows=None, tmp_dir=None):
+    """
+    Sort rows of any size with at most buffer_rows of them in memory at a time
+    Rows are read in runs of buffer_rows, each run is sorted and spilled to a temporary file in
+    tmp_dir, and the runs are merged lazily. Input that fits in one run is never spilled.
+    Rows with equal keys keep their input order
+    Returns (iterator over the sorted rows, number of spilled runs)
+    """
+    buffer_rows = buffer_rows or SORT_BUFFER_ROWS
+    rows = iter(rows)
+    runs = []
+    try:
+        while True:
+            run = list(islice(rows, buffer_rows))
+            if not run:
+                break
+            run.sort(key=key)
+            if not runs and len(run) < buffer_rows:
+                return iter(run), 0
+            runs.append(_write_run(run, tmp_dir))
+            del run
+    except BaseException:
+        for spill in runs:
+            spill.close()
+        raise
+    return _merge_runs(runs, key), len(runs)
+
+
+class GroupTree:
+    """
+    im_group (groupid, parentgroupid, label) as an in-memory parent index, so the jumphost can
+    compute what the grp_path recursive CTEs compute on the server: Group_Hierarchy_Path and
+    Device_Level_Data's fullpath. Like the CTEs, only groups below a top-level group
+    (parentgroupid 0) are in the tree. Roots and paths are memoised per groupid
+    Ids and labels are kept as mysql --batch prints them (strings, NULL as "NULL")
+    """
+
+    def __init__(self, rows, parse=None):
+        self.parent = {}
+        self.label = {}
+        for row in rows:
+            fields = parse(row) if parse is not None else row.split('\t')
+            if len(fields) < 3:
+                continue
+            groupid, parentgroupid, label = fields[:3]
+            self.parent[groupid] = parentgroupid
+            self.label[groupid] = label
+        self._roots = {}
+        self._paths = {}
+
+    def root(self, groupid):
+        """Top-level ancestor of groupid (itself for a top-level group), or None outside the tree"""
+        walked = []
+        node = groupid
+        while True:
+            if node in self._roots:
+                root = self._roots[node]
+                break
+            if node not in self.parent or node in walked:
+                root = None  # Dangling parent or a cycle: never reached from a top-level group
+                break
+            walked.append(node)
+            if self.parent[node] == "0":
+                root = node
+                break
+            node = self.parent[node]
+        for node in walked:
+            self._roots[node] = root
+        return root
+
+    def fullpath(self, groupid):
+        """
+        Device_Level_Data's fullpath: a top-level group's own label, else CONCAT(parent's rootname,
+        "...", label), where the CTE's rootname is the parent's label for a top-level parent and the
+        grandparent's label below that - so deeper groups show their grandparent, not the whole chain.
+        NULL outside the tree, and (like CONCAT) when either part is NULL
+        """
+        path = self._paths.get(groupid)
+        if path is not None:
+            return path
+        if self.root(groupid) is None:
+            path = MYSQL_NULL
+        elif self.parent[groupid] == "0":
+            path = self.label[groupid]
+        else:
+            parent = self.parent[groupid]
+            grandparent = self.parent[parent]
+            prefix = self.label[parent] if grandparent == "0" else self.label[grandparent]
+            label = self.label[groupid]
+            path = MYSQL_NULL if MYSQL_NULL in (prefix, label) else f"{prefix}...{label}"
+        self._paths[groupid] = path
+        return path
+
+    def hierarchy_rows(self):
+        """Group_Hierarchy_Path rows (rootid, rootgroup, groupid, groupname), ordered by rootid, groupid"""
+        rows = []
+        for groupid in self.parent:
+            root = self.root(groupid)
+            if root is not None:
+                rows.append((root, self.label[root], groupid, self.label[groupid]))
+        query_name = "Group_Hierarchy_Path"
+        rows.sort(key=order_by_key(EXPECTED_COLUMNS[query_name], ORDER_BY[query_name], COLUMN_TYPES[query_name]))
+        return rows
+
+    def with_fullpath(self, rows, index):
+        """Rows (TSV lines or row tuples) with the groupid at index replaced by the group's fullpath"""
+        for row in rows:
+            if isinstance(row, str):
+                fields = row.split('\t')
+                if index < len(fields):
+                    fields[index] = self.fullpath(fields[index])
+                yield '\t'.join(fields)
+            else:
+                row = list(row)
+                if index < len(row):
+                    path = self.fullpath(tsv_value(row[index]))
+                    row[index] = None if path == MYSQL_NULL else path
+                yield row
+
+
+def group_tree_query(query_name, header):
+    """
+    Query to write before query_name, judging by its header line: Device_Level_Data with groupids
+    instead of fullpaths needs the group tree built from the Group_Hierarchy_Path extract
+    """
+    columns = header.rstrip('\n').split('\t')
+    if query_name == "Device_Level_Data" and "groupid" in columns and "fullpath" not in columns:
+        return "Group_Hierarchy_Path"
+    return None
+
+
+def write_error_sheet(sink, sheet_name, error):
+    """Create a sheet describing a processing failure"""
+    sink.begin_sheet(sheet_name, None)
+    sink.write_notice(["Error"], STYLE_ERROR)
+    sink.write_notice([sanitize(f"Failed: {str(error)}")])
+    sink.end_sheet()
+
+
+# Abbreviated sheet names to avoid 31-character Excel limit
+# Maps full query name to abbreviated sheet name
+SHEET_NAME_MAPPING = {
+    "Group_Hierarchy_Path": "GroupHierarchyPath",
+    "Gateway_Count_By_Group": "GatewayCountByGroup",
+    "User_List_With_Groups": "UserListWithGroups",
+    "Gateways_Registered_Last_30_Days": "GatewaysLast30Days",
+    "Device_Level_Data": "DeviceLevelData"
+}
+
+# Expected column headers for each query (when no data)
+# These match the SELECT columns from each query's SQL
+EXPECTED_COLUMNS = {
+    "Group_Hierarchy_Path": ["rootid", "rootgroup", "groupid", "groupname"],
+    "Gateway_Count_By_Group": ["groupname", "groupid", "num_gateways"],
+    "User_List_With_Groups": ["groupid", "groupname", "username", "email"],
+    "Gateways_Registered_Last_30_Days": ["gateways_registered_last_30_days"],
+   "Device_Level_Data": ["serial", "name", "fullpath", "device_type", "platform", "last_comm"]
+
+}
+
+# Column types for each query (int, float, datetime; unlisted columns are text)
+# Converters are chosen once per sheet from these, so large datasets keep their types
+COLUMN_TYPES = {
+    "Group_Hierarchy_Path": {"rootid": "int", "groupid": "int"},
+    "Gateway_Count_By_Group": {"groupid": "int", "num_gateways": "int"},
+    "User_List_With_Groups": {"groupid": "int"},
+    "Gateways_Registered_Last_30_Days": {"gateways_registered_last_30_days": "int"},
+    "Device_Level_Data": {"last_comm": "datetime"}
+}
+
+# With GROUP_PATHS_ON_JUMPHOST the remote script answers Group_Hierarchy_Path with im_group as it
+# is and Device_Level_Data with each device's groupid instead of its fullpath; GroupTree rebuilds both
+GROUP_LIST_COLUMNS = ["groupid", "parentgroupid", "label"]
+
+# Columns of each query's ORDER BY, so the remote SQL can leave sorting to the jumphost (and chunked
+# Device_Level_Data, which arrives in im_node primary key order, can be ordered); --sort applies them
+ORDER_BY = {
+    "Group_Hierarchy_Path": ["rootid", "groupid"],
+    "Gateway_Count_By_Group": ["groupname", "groupid"],
+    "User_List_With_Groups": ["groupid", "groupname"],
+    "Device_Level_Data": ["last_comm"]
+}
+
+# Query definitions for "Queries" index sheet
+QUERIES = {
+    "Group_Hierarchy_Path": """WITH RECURSIVE grp_path (groupid, label, rootid, rootlabel) AS
 (
   SELECT groupid, label, groupid AS rootid, label AS rootlabel
   FROM im_group WHERE parentgroupid = 0
@@ -83,8 +1637,8 @@ def create_excel_from_tsv_files(tsv_dir, excel_file, server_name):
 SELECT rootid, rootlabel AS rootgroup, groupid, label AS groupname
 FROM grp_path
 ORDER BY rootid, groupid;""",
-        
-        "Gateway_Count_By_Group": """SELECT grp.label AS groupname, grp.groupid, count(*) AS num_gateways
+    
+    "Gateway_Count_By_Group": """SELECT grp.label AS groupname, grp.groupid, count(*) AS num_gateways
 FROM im_group grp
   JOIN im_node node ON grp.groupid = node.groupid
   JOIN im_lateststatitem latest ON latest.nodeid = node.nodeid
@@ -96,19 +1650,19 @@ AND latest.value < 2592000
 GROUP BY grp.groupid, grp.label
 ORDER BY grp.label, grp.groupid;""",
 
-        "User_List_With_Groups": """SELECT perm.groupid, g.label AS groupname, u.loginname AS username, u.email
+    "User_List_With_Groups": """SELECT perm.groupid, g.label AS groupname, u.loginname AS username, u.email
 FROM im_user u
   JOIN im_permissiongroup perm ON u.userid = perm.userid
   JOIN im_group g ON perm.groupid = g.groupid
 ORDER BY perm.groupid, g.label;""",
 
-        "Gateways_Registered_Last_30_Days": """SELECT COUNT(*) AS gateways_registered_last_30_days
+    "Gateways_Registered_Last_30_Days": """SELECT COUNT(*) AS gateways_registered_last_30_days
 FROM im_audit
 WHERE time > DATE_SUB(NOW(), INTERVAL 30 DAY)
 AND text LIKE '%create node %';""",
 
 
-    "Device_Level_Data": """WITH RECURSIVE grp_path (path_grpid, label, rootid, rootname, fullpath) AS
+"Device_Level_Data": """WITH RECURSIVE grp_path (path_grpid, label, rootid, rootname, fullpath) AS
 (
   SELECT groupid, label, groupid AS rootid, label AS rootname, label AS fullpath
   FROM im_group WHERE parentgroupid = 0
@@ -154,43 +1708,181 @@ FROM im_node n
   LEFT JOIN grp_path ON path_grpid = n.groupid
   LEFT JOIN hbt ON statnode = n.nodeid
 ORDER BY last_comm;"""
-    }
+}
+
+
+def create_excel_from_tsv_files(tsv_dir, excel_file, server_name, streaming=False, engine="openpyxl", jobs=1,
+                                memory_profiler=None, columnar=None, backends=None, sort=False, sort_buffer_rows=None,
+                                sort_dir=None):
+    """
+    Create an Excel file with multiple sheets from TSV files
+    Automatically splits sheets if data exceeds Excel's row limit
+    
+    Args:
+        tsv_dir: Directory containing TSV files, or the mysql_results_<server>_<date>.tar.gz
+                 whose <Query>_<server>_<date>.tsv members are streamed without extracting
+                 (with jobs > 1 they are extracted to a temporary directory, see TarTsvMember)
+        excel_file: Output Excel file path
+        server_name: Name of the server (for Server column)
+        streaming: Use write-only worksheets so rows are flushed as they are appended
+                   instead of being held as Cell objects until save
+        engine: "openpyxl" (default) or "native" to write the SpreadsheetML parts directly
+                with xlsx_stream_writer (always streams, ignores the streaming flag)
+        jobs: Worker processes for data sheets (native engine only); each sheet and each
+              split part is rendered in its own process and assembled in sheet order
+        memory_profiler: Optional MemoryProfiler, snapshotted after each sheet and after save
+        columnar: "parquet" or "arrow" to also write <excel name>_<Query>.<ext> per query
+                  (needs pyarrow; Parquet falls back to Arrow IPC, skipped with a warning otherwise)
+        backends: Explicit list of BACKENDS names, overriding streaming/engine/columnar: at most
+                  one workbook backend plus any per-query file formats (csv.gz, parquet, arrow)
+        sort: Order the rows of the ORDER_BY queries on the jumphost before writing them, for
+              inputs the remote script extracted without ORDER BY (those queries are written serially)
+        sort_buffer_rows: Rows per in-memory sorted run (default SORT_BUFFER_ROWS); more are spilled
+        sort_dir: Directory for the spilled runs (default: the system temporary directory)
+    """
+    
+    metrics = ConversionMetrics()
+    
+    # Tarball input: locate every query's member up front (this pass also validates the archive);
+    # parallel workers get the members extracted once instead
+    tar_members = None
+    extract_dir = None
+    if is_tar_input(tsv_dir):
+        try:
+            with metrics.timed("count"):
+                if jobs > 1:
+                    extract_dir = tempfile.mkdtemp(prefix="tsv_")
+                    tar_members = extract_tar_tsv_members(tsv_dir, QUERIES.keys(), extract_dir)
+                else:
+                    tar_members = index_tar_tsv_members(tsv_dir, QUERIES.keys())
+        except (tarfile.TarError, EOFError, OSError) as e:
+            print(f"ERROR: Corrupted tarball {tsv_dir}: {str(e)}")
+            if extract_dir is not None:
+                shutil.rmtree(extract_dir, ignore_errors=True)
+            return 1
+        if extract_dir is not None:
+            print(f"Extracted {len(tar_members)} TSV members from {tsv_dir} for the worker processes")
+        else:
+            print(f"Reading {len(tar_members)} TSV members directly from {tsv_dir}")
     
-    # Create workbook
-    wb = Workbook()
-    wb.remove(wb.active)
+    inputs = {}
+    for query_name in QUERIES:
+        if tar_members is not None:
+            inputs[query_name] = tar_members.get(query_name, f"{tsv_dir}:{query_name}_*.tsv")
+        else:
+            inputs[query_name] = os.path.join(tsv_dir, f"{query_name}.tsv")
     
-    # Styling
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
+    try:
+        return write_workbook(inputs, excel_file, server_name, streaming, engine, jobs, memory_profiler, columnar,
+                              backends, metrics, sort, sort_buffer_rows, sort_dir)
+    finally:
+        if extract_dir is not None:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+
+
+def create_excel_from_rows(query_rows, excel_file, server_name, streaming=False, engine="openpyxl", jobs=1,
+                           memory_profiler=None, columnar=None, backends=None, sort=False, sort_buffer_rows=None,
+                           sort_dir=None):
+    """
+    Create the same workbook as create_excel_from_tsv_files from rows that are not TSV files,
+    e.g. straight from an SSH/MySQL stream, without temporary files
+    
+    Args:
+        query_rows: {query name: rows}; rows yields the header first, then the data rows, either
+                    as row tuples (None for SQL NULL) or as TSV text lines - a file object, a pipe,
+                    a generator or a list all work. Each is read once, so sheets are split as the
+                    rows arrive. Queries that are left out get a placeholder sheet
+        Everything else as for create_excel_from_tsv_files; jobs only applies to TSV files,
+        so rows given here are always written by the calling process
+    """
+    unknown = [query_name for query_name in query_rows if query_name not in QUERIES]
+    if unknown:
+        print(f"WARNING: Ignoring rows for unknown queries: {', '.join(unknown)}")
+    return write_workbook(dict(query_rows), excel_file, server_name, streaming, engine, jobs, memory_profiler,
+                          columnar, backends, sort=sort, sort_buffer_rows=sort_buffer_rows, sort_dir=sort_dir)
+
+
+def create_excel_from_stream(stream, excel_file, server_name, streaming=False, engine="openpyxl", jobs=1,
+                             memory_profiler=None, columnar=None, backends=None, sort=False, sort_buffer_rows=None,
+                             sort_dir=None):
+    """
+    Create the workbook from the framed query stream the remote dump script writes in stream mode
+    (see QueryStream), converting each query's rows while the next ones are still being produced
+    
+    Args:
+        stream: Text stream of frames, e.g. open_query_stream('-') over the ssh pipe
+        Everything else as for create_excel_from_rows
+    """
+    return write_workbook(QueryStream(stream), excel_file, server_name, streaming, engine, jobs, memory_profiler,
+                          columnar, backends, sort=sort, sort_buffer_rows=sort_buffer_rows, sort_dir=sort_dir)
+
+
+def create_excel(tsv_dir, excel_file, server_name, stream=False, **options):
+    """Convert one server's input: TSV directory or tarball, or with stream=True a framed stream file ('-' = stdin)"""
+    if not stream:
+        return create_excel_from_tsv_files(tsv_dir, excel_file, server_name, **options)
+    with open_query_stream(tsv_dir) as f:
+        return create_excel_from_stream(f, excel_file, server_name, **options)
+
+
+def write_workbook(inputs, excel_file, server_name, streaming=False, engine="openpyxl", jobs=1,
+                   memory_profiler=None, columnar=None, backends=None, metrics=None, sort=False,
+                   sort_buffer_rows=None, sort_dir=None):
+    """
+    Write the workbook (and any per-query files) for every query in QUERIES
+    inputs maps a query name to its TSV (path or TarTsvMember) or to an iterable of rows
+    (see IterRowSource), or is a QueryStream; a missing TSV path or query gets a placeholder sheet.
+    Queries are written in QUERIES order, a QueryStream's in the order its frames arrive, and
+    the sheets are put into QUERIES order before saving
+    Returns the process exit code (0 on success)
+    """
+    if metrics is None:
+        metrics = ConversionMetrics()
+    
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    
+    if backends is None:
+        backends = default_backends(engine, streaming, columnar)
+    
+    # Columnar backends need pyarrow; Parquet falls back to Arrow IPC when it has no Parquet support
+    resolved = []
+    for backend in backends:
+        if backend in COLUMNAR_FORMATS:
+            fmt = resolve_format(backend)
+            if fmt is None:
+                print(f"WARNING: pyarrow is not installed - skipping {backend} export")
+                continue
+            if fmt != backend:
+                print(f"WARNING: pyarrow has no {backend} support - writing {fmt} files instead")
+            backend = fmt
+        resolved.append(backend)
+    backends = resolved
+    
+    workbook_backend = next((backend for backend in backends if backend in WORKBOOK_BACKENDS), None)
+    if jobs > 1 and workbook_backend not in ("native", None):
+        print(f"WARNING: Parallel sheet generation needs --engine native - running serially")
+        jobs = 1
+    
+    if workbook_backend == "native":
+        print(f"Native engine: writing XLSX parts directly")
+    elif workbook_backend == "openpyxl-streaming":
+        print(f"Streaming mode: rows are written through write-only worksheets")
+    
+    sinks = [make_sink(backend, excel_file, COLUMN_TYPES) for backend in backends]
+    workbook = next((sink for sink in sinks if not isinstance(sink, QueryFileSink)), None)
+    file_sinks = [sink for sink in sinks if isinstance(sink, QueryFileSink)]
+    sink = SinkGroup(sinks)
+    for file_sink in file_sinks:
+        print(f"Writing one {file_sink.backend} file per query: {file_sink.path_for('<Query>')}")
     
     # Create "Queries" index sheet
     print(f"Creating 'Queries' index sheet...")
-    queries_sheet = wb.create_sheet("Queries", 0)
-    queries_sheet['A1'] = "Query Name"
-    queries_sheet['B1'] = "SQL Query"
-    queries_sheet['C1'] = "Server"
-    queries_sheet['D1'] = "Generated Date"
-    
-    for cell in ['A1', 'B1', 'C1', 'D1']:
-        queries_sheet[cell].font = header_font
-        queries_sheet[cell].fill = header_fill
-        queries_sheet[cell].alignment = header_alignment
-    
-    row = 2
-    for query_name, query_sql in queries.items():
-        queries_sheet[f'A{row}'] = query_name
-        queries_sheet[f'B{row}'] = query_sql
-        queries_sheet[f'C{row}'] = server_name
-        queries_sheet[f'D{row}'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        queries_sheet[f'B{row}'].alignment = Alignment(wrap_text=True, vertical="top")
-        row += 1
-    
-    queries_sheet.column_dimensions['A'].width = 30
-    queries_sheet.column_dimensions['B'].width = 80
-    queries_sheet.column_dimensions['C'].width = 15
-    queries_sheet.column_dimensions['D'].width = 20
+    sink.begin_sheet("Queries", ["Query Name", "SQL Query", "Server", "Generated Date"], [30, 80, 15, 20],
+                     styles=[STYLE_DEFAULT, STYLE_WRAP_TOP, STYLE_DEFAULT, STYLE_DEFAULT])
+    sink.write_rows([[query_name, query_sql, server_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
+                     for query_name, query_sql in QUERIES.items()])
+    sink.end_sheet()
     
     print(f"'Queries' sheet created")
     sys.stdout.flush()  # Flush output immediately
@@ -198,52 +1890,66 @@ ORDER BY last_comm;"""
     # Process each TSV file
     sheets_created = 0
     
-    for query_name in queries.keys():
-        tsv_file = os.path.join(tsv_dir, f"{query_name}.tsv")
+    # Parallel mode: data sheets are rendered by workers into reserved slots of the native workbook,
+    # per-query files by one worker per query
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    pending = []  # (slot index in the workbook's sheets, query name, sheet title, future)
+    files_pending = []  # (query name, future)
+    if pool is not None:
+        print(f"Parallel mode: rendering data sheets in up to {jobs} worker processes")
+    
+    def submit_sheet(title, start_offset, row_count):
+        tmp_dir, index, slot = workbook.reserve_sheet()
+        task = {"title": title, "tmp_dir": tmp_dir, "index": index, "tsv_file": tsv_file,
+                "start_offset": start_offset, "row_count": row_count, "headers": headers,
+                "types": COLUMN_TYPES.get(query_name, {}), "server_name": server_name,
+                "is_large_dataset": is_large_dataset}
+        pending.append((slot, query_name, title, pool.submit(render_sheet_part, task)))
+    
+    # Built from Group_Hierarchy_Path when that is the flat im_group extract, for Device_Level_Data
+    group_tree = None
+    
+    if isinstance(inputs, QueryStream):
+        query_inputs = inputs.frames(QUERIES, group_tree_query)
+    else:
+        query_inputs = ((query_name, inputs.get(query_name)) for query_name in QUERIES)
+    
+    # (query name, workbook sheet count when it began): its sheets run up to the next query's count
+    query_starts = []
+    
+    # TSV path, TarTsvMember or iterable of rows
+    for query_name, tsv_file in query_inputs:
+        if workbook is not None:
+            query_starts.append((query_name, workbook.sheet_count()))
+        from_file = isinstance(tsv_file, (str, TarTsvMember))
         
         # Get abbreviated sheet name (max 31 chars for Excel)
-        base_sheet_name = sheet_name_mapping.get(query_name, query_name[:20])
+        base_sheet_name = SHEET_NAME_MAPPING.get(query_name, query_name[:20])
         
-        if not os.path.exists(tsv_file):
-            print(f"TSV not found: {tsv_file} - creating placeholder sheet with expected columns")
+        if tsv_file is None or isinstance(tsv_file, str) and not os.path.exists(tsv_file):
+            if tsv_file is None:
+                print(f"No rows given for {query_name} - creating placeholder sheet with expected columns")
+            else:
+                print(f"TSV not found: {tsv_file} - creating placeholder sheet with expected columns")
             print(f"  Query name: {query_name}")
             print(f"  Base sheet name: {base_sheet_name}")
             
-            ws = wb.create_sheet(base_sheet_name)
-            
             # Get expected column headers for this query
-            expected_cols = expected_columns.get(query_name, [])
+            expected_cols = EXPECTED_COLUMNS.get(query_name, [])
             print(f"  Expected columns for '{query_name}': {expected_cols}")
             print(f"  Number of expected columns: {len(expected_cols)}")
             
             if len(expected_cols) == 0:
                 print(f"  WARNING: No expected columns found for query '{query_name}'!")
-                print(f"  Available keys in expected_columns: {list(expected_columns.keys())}")
-            
-            # Write Server column header
-            ws.cell(row=1, column=1, value="Server")
-            ws.cell(row=1, column=1).font = header_font
-            ws.cell(row=1, column=1).fill = header_fill
-            ws.cell(row=1, column=1).alignment = header_alignment
+                print(f"  Available keys in EXPECTED_COLUMNS: {list(EXPECTED_COLUMNS.keys())}")
             
-            # Write all expected column headers
+            # Server column header followed by all expected column headers
             for col_idx, col_name in enumerate(expected_cols, start=2):
                 print(f"  Writing column {col_idx}: {col_name}")
-                cell = ws.cell(row=1, column=col_idx, value=col_name)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
             
-            # Write data row: server name + "No Data Available" for each column
-            ws.cell(row=2, column=1, value=server_name)
-            for col_idx in range(2, len(expected_cols) + 2):
-                ws.cell(row=2, column=col_idx, value="No Data Available")
-            
-            # Adjust column widths
-            ws.column_dimensions['A'].width = 15
-            for col_idx in range(2, len(expected_cols) + 2):
-                col_letter = ws.cell(row=1, column=col_idx).column_letter
-                ws.column_dimensions[col_letter].width = 20
+            # Data row: server name + "No Data Available" for each column
+            write_fixed_sheet(sink, base_sheet_name, expected_cols, server_name, query_name,
+                              notice="No Data Available")
             
             print(f"  Created placeholder sheet '{base_sheet_name}' with {len(expected_cols)} data columns (+ Server column)")
             sheets_created += 1
@@ -253,255 +1959,217 @@ ORDER BY last_comm;"""
         sys.stdout.flush()  # Flush immediately
         
         try:
-            # Read all lines from TSV
-            with open(tsv_file, 'r') as f:
-                lines = [line.rstrip('\n') for line in f.readlines()]
+            # Count lines in one pass - data rows are streamed later, never held in memory
+            # (rows that don't come from a file are not counted, only the first one is read ahead)
+            with metrics.timed("count"):
+                source = TsvRowSource(tsv_file) if from_file else IterRowSource(tsv_file)
             
-            # Check if this is a "No Data Available" placeholder file from shell script
-            if len(lines) == 1 and lines[0].strip() == "No Data Available":
-                print(f"  TSV contains 'No Data Available' placeholder - creating headers-only sheet")
-                ws = wb.create_sheet(base_sheet_name)
-                
-                # Use expected headers for this query
-                headers = expected_columns.get(query_name, [])
-                
-                # Write Server column header
-                ws.cell(row=1, column=1, value="Server")
-                ws.cell(row=1, column=1).font = header_font
-                ws.cell(row=1, column=1).fill = header_fill
-                ws.cell(row=1, column=1).alignment = header_alignment
-                
-                # Write all other column headers
-                for col_idx, header in enumerate(headers, start=2):
-                    cell = ws.cell(row=1, column=col_idx, value=header)
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = header_alignment
-                
-                # NO DATA ROW - Only headers
-                
-                # Adjust column widths
-                ws.column_dimensions['A'].width = 15
-                for col_idx in range(2, len(headers) + 2):
-                    col_letter = ws.cell(row=1, column=col_idx).column_letter
-                    ws.column_dimensions[col_letter].width = 20
-                
-                print(f"  Created sheet with headers only ({len(headers)} columns, no data)")
-                sheets_created += 1
-                continue
+            # Flat im_group extract: the hierarchy is built here and written like the query's rows
+            if query_name == "Group_Hierarchy_Path" and source.headers == GROUP_LIST_COLUMNS:
+                with metrics.timed("groups"):
+                    group_tree = GroupTree(source.rows(), source.parse)
+                    hierarchy = group_tree.hierarchy_rows()
+                print(f"  Built group tree from {len(group_tree.parent):,} im_group rows "
+                      f"({len(hierarchy):,} below a top-level group)")
+                source = IterRowSource([EXPECTED_COLUMNS[query_name]] + hierarchy)
             
-            if len(lines) == 0 or len(lines) == 1:
-                # Empty file or only header
-                print(f"  Empty or header-only TSV - creating headers-only sheet")
-                ws = wb.create_sheet(base_sheet_name)
-                
-                # Determine headers - use from file if available, else use expected
-                if len(lines) == 1:
-                    headers = lines[0].split('\t')
+            # Device groupids instead of fullpaths: resolved through the group tree as rows are read
+            headers = source.headers
+            groupid_index = None
+            if query_name == "Device_Level_Data" and "groupid" in headers and "fullpath" not in headers:
+                if group_tree is None:
+                    print(f"  WARNING: No im_group extract - every fullpath is NULL")
+                    group_tree = GroupTree([])
+                groupid_index = headers.index("groupid")
+                headers = headers[:groupid_index] + ["fullpath"] + headers[groupid_index + 1:]
+            
+            # A "No Data Available" placeholder file from the shell script, an empty file or only
+            # a header: headers-only sheet (NO DATA ROW)
+            if not source.has_rows:
+                if source.is_placeholder():
+                    print(f"  TSV contains 'No Data Available' placeholder - creating headers-only sheet")
                 else:
-                    headers = expected_columns.get(query_name, [])
-                
-                # Write Server column header
-                ws.cell(row=1, column=1, value="Server")
-                ws.cell(row=1, column=1).font = header_font
-                ws.cell(row=1, column=1).fill = header_fill
-                ws.cell(row=1, column=1).alignment = header_alignment
+                    print(f"  Empty or header-only TSV - creating headers-only sheet")
                 
-                # Write all other column headers
-                for col_idx, header in enumerate(headers, start=2):
-                    cell = ws.cell(row=1, column=col_idx, value=header)
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = header_alignment
+                # Headers from the file if it has them, else the expected headers for this query
+                if not headers or source.is_placeholder():
+                    headers = EXPECTED_COLUMNS.get(query_name, [])
                 
-                # NO DATA ROW - Only headers
-                
-                # Adjust column widths
-                ws.column_dimensions['A'].width = 15
-                for col_idx in range(2, len(headers) + 2):
-                    col_letter = ws.cell(row=1, column=col_idx).column_letter
-                    ws.column_dimensions[col_letter].width = 20
+                write_fixed_sheet(sink, base_sheet_name, headers, server_name, query_name)
                 
                 print(f"  Created sheet with headers only ({len(headers)} columns, no data)")
                 sheets_created += 1
                 continue
             
-            # Extract headers and data
-            headers = lines[0].split('\t')
-            data_lines = lines[1:]
-            total_rows = len(data_lines)
+            # Extract data
+            data_lines = source.rows()
+            if groupid_index is not None:
+                data_lines = group_tree.with_fullpath(data_lines, groupid_index)
+            total_rows = source.total_rows
+            converter = RowConverter(headers, COLUMN_TYPES.get(query_name, {}))
+            
+            # Rows extracted without ORDER BY are sorted here (bounded memory, spilling to disk),
+            # and then written by this process
+            sort_columns = ORDER_BY.get(query_name) if sort else None
+            if sort_columns and not set(sort_columns) <= set(headers):
+                print(f"  WARNING: Sort columns {', '.join(sort_columns)} not in headers - keeping input order")
+                sort_columns = None
+            if sort_columns:
+                with metrics.timed("sort"):
+                    key = order_by_key(headers, sort_columns, COLUMN_TYPES.get(query_name, {}))
+                    data_lines, runs = external_sort(data_lines, key, sort_buffer_rows, sort_dir)
+                print(f"  Sorted rows by {', '.join(sort_columns)} "
+                      + (f"({runs} runs spilled to disk)" if runs else "(in memory)"))
+            # Workers read the TSV file themselves, so rewritten rows are written here too
+            parallel = pool is not None and not sort_columns and groupid_index is None
+            
+            if total_rows is None:
+                # Streamed rows: split as they arrive, always in this process
+                print(f"  Streaming rows (count not known up front)")
+                num_sheets, rows_written = write_unsized_query(sink, base_sheet_name, headers, data_lines, server_name,
+                                                               converter, metrics, memory_profiler, query_name,
+                                                               source.parse)
+                sink.end_query()
+                sheets_created += num_sheets
+                if num_sheets > 1:
+                    print(f"  Successfully split {query_name} into {num_sheets} sheets ({rows_written:,} rows)")
+                else:
+                    print(f"  Sheet '{query_name}' created: {rows_written:,} rows")
+                continue
             
             print(f"  Total data rows: {total_rows:,}")
             
             # Determine if dataset is large (optimize processing for large datasets)
-            is_large_dataset = total_rows > 100000
+            is_large_dataset = total_rows > LARGE_DATASET_ROWS
             
             if is_large_dataset:
                 print(f"  Large dataset detected - using optimized processing")
             
-            # Check if we need to split
-            if total_rows > EXCEL_MAX_ROWS:
-                # Calculate number of sheets needed
-                num_sheets = (total_rows + EXCEL_MAX_ROWS - 1) // EXCEL_MAX_ROWS
+            # One sheet per EXCEL_MAX_ROWS rows: GatewayCount_1, GatewayCount_2, etc. when split
+            num_sheets = (total_rows + EXCEL_MAX_ROWS - 1) // EXCEL_MAX_ROWS
+            if num_sheets > 1:
                 print(f"  Splitting into {num_sheets} sheets (exceeds {EXCEL_MAX_ROWS:,} row limit)")
-                sys.stdout.flush()  # Flush immediately
-                
-                # Create multiple sheets
-                for sheet_idx in range(num_sheets):
-                    # Use abbreviated name with part number: GatewayCount_1, GatewayCount_2, etc.
-                    sheet_name = f"{base_sheet_name}_{sheet_idx + 1}"
-                    
-                    # Ensure sheet name is still under 31 characters
-                    if len(sheet_name) > 31:
-                        sheet_name = f"{base_sheet_name[:25]}_{sheet_idx + 1}"
-                    
-                    start_row = sheet_idx * EXCEL_MAX_ROWS
-                    end_row = min(start_row + EXCEL_MAX_ROWS, total_rows)
-                    chunk = data_lines[start_row:end_row]
-                    
-                    print(f"  Creating '{sheet_name}': rows {start_row+1:,} to {end_row:,} ({len(chunk):,} rows)")
-                    sys.stdout.flush()  # Flush immediately
-                    
-                    ws = wb.create_sheet(sheet_name)
-                    
-                    # Write headers with Server column first
-                    ws.cell(row=1, column=1, value="Server")
-                    ws.cell(row=1, column=1).font = header_font
-                    ws.cell(row=1, column=1).fill = header_fill
-                    ws.cell(row=1, column=1).alignment = header_alignment
-                    
-                    for col_idx, header in enumerate(headers, start=2):
-                        cell = ws.cell(row=1, column=col_idx, value=header)
-                        cell.font = header_font
-                        cell.fill = header_fill
-                        cell.alignment = header_alignment
-                    
-                    # Write data rows
-                    for row_idx, line in enumerate(chunk, start=2):
-                        # Show progress for large datasets
-                        if is_large_dataset and row_idx % 100000 == 0:
-                            print(f"    Progress: {row_idx-1:,}/{len(chunk):,} rows written")
-                            sys.stdout.flush()  # Flush progress updates
-                        
-                        ws.cell(row=row_idx, column=1, value=server_name)
-                        
-                        values = line.split('\t')
-                        for col_idx, value in enumerate(values, start=2):
-                            # Skip type conversion for large datasets to save CPU
-                            if is_large_dataset:
-                                ws.cell(row=row_idx, column=col_idx, value=sanitize(value))
-                            else:
-                                try:
-                                    if value.isdigit():
-                                        ws.cell(row=row_idx, column=col_idx, value=int(value))
-                                    elif '.' in value and value.replace('.', '', 1).isdigit():
-                                        ws.cell(row=row_idx, column=col_idx, value=float(value))
-                                    else:
-                                        ws.cell(row=row_idx, column=col_idx, value=sanitize(value))
-                                except:
-                                    ws.cell(row=row_idx, column=col_idx, value=value)
-                    
-                    # Adjust column widths - simplified for large datasets
-                    if is_large_dataset:
-                        # Use fixed widths for large datasets to save CPU time
-                        ws.column_dimensions['A'].width = 15  # Server column
-                        for col_idx in range(2, len(headers) + 2):
-                            col_letter = ws.cell(row=1, column=col_idx).column_letter
-                            ws.column_dimensions[col_letter].width = 20  # Fixed width
-                    else:
-                        # Sample first 100 rows for column width
-                        sample_rows = min(100, len(chunk))
-                        for col in range(1, len(headers) + 2):
-                            max_len = 0
-                            for row in range(1, sample_rows + 2):
-                                try:
-                                    val = ws.cell(row=row, column=col).value
-                                    if val and len(str(val)) > max_len:
-                                        max_len = len(str(val))
-                                except:
-                                    pass
-                            ws.column_dimensions[ws.cell(row=1, column=col).column_letter].width = min(max_len + 2, 50)
-                    
-                    sheets_created += 1
-                
-                print(f"  Successfully split {query_name} into {num_sheets} sheets")
-            
             else:
-                # Single sheet - data fits
                 print(f"  Creating single sheet (fits within limit)")
-                ws = wb.create_sheet(base_sheet_name)
+            sys.stdout.flush()  # Flush immediately
+            
+            if parallel:
+                # Per-query files for the whole query (all split parts) in one worker
+                if file_sinks:
+                    task = {"backends": [file_sink.backend for file_sink in file_sinks], "excel_file": excel_file,
+                            "query": query_name, "headers": headers, "types": COLUMN_TYPES.get(query_name, {}),
+                            "server_name": server_name, "tsv_file": tsv_file, "row_count": total_rows}
+                    files_pending.append((query_name, pool.submit(render_query_files, task)))
+                if workbook is None:
+                    continue
+                # Byte offset where each sheet's first data row starts (workers seek straight to it)
+                with metrics.timed("count"):
+                    part_offsets = find_line_offsets(tsv_file, [1 + part * EXCEL_MAX_ROWS
+                                                                for part in range(num_sheets)])
+            
+            for sheet_idx in range(num_sheets):
+                sheet_name = part_sheet_name(base_sheet_name, sheet_idx + 1) if num_sheets > 1 else base_sheet_name
                 
-                # Write headers
-                ws.cell(row=1, column=1, value="Server")
-                ws.cell(row=1, column=1).font = header_font
-                ws.cell(row=1, column=1).fill = header_fill
-                ws.cell(row=1, column=1).alignment = header_alignment
+                start_row = sheet_idx * EXCEL_MAX_ROWS
+                end_row = min(start_row + EXCEL_MAX_ROWS, total_rows)
+                chunk_rows = end_row - start_row
                 
-                for col_idx, header in enumerate(headers, start=2):
-                    cell = ws.cell(row=1, column=col_idx, value=header)
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = header_alignment
+                if num_sheets > 1:
+                    print(f"  Creating '{sheet_name}': rows {start_row+1:,} to {end_row:,} ({chunk_rows:,} rows)")
+                    sys.stdout.flush()  # Flush immediately
                 
-                # Write data
-                for row_idx, line in enumerate(data_lines, start=2):
-                    # Show progress for large datasets
-                    if is_large_dataset and row_idx % 100000 == 0:
-                        print(f"    Progress: {row_idx-1:,}/{total_rows:,} rows written")
-                    
-                    ws.cell(row=row_idx, column=1, value=server_name)
-                    
-                    values = line.split('\t')
-                    for col_idx, value in enumerate(values, start=2):
-                        # Skip type conversion for large datasets to save CPU
-                        if is_large_dataset:
-                            ws.cell(row=row_idx, column=col_idx, value=sanitize(value))
-                        else:
-                            try:
-                                if value.isdigit():
-                                    ws.cell(row=row_idx, column=col_idx, value=int(value))
-                                elif '.' in value and value.replace('.', '', 1).isdigit():
-                                    ws.cell(row=row_idx, column=col_idx, value=float(value))
-                                else:
-                                    ws.cell(row=row_idx, column=col_idx, value=sanitize(value))
-                            except:
-                                ws.cell(row=row_idx, column=col_idx, value=sanitize(value))
+                if parallel:
+                    submit_sheet(sheet_name, part_offsets[sheet_idx], chunk_rows)
+                    sheets_created += 1
+                    continue
                 
-                # Adjust columns - simplified for large datasets
-                if is_large_dataset:
-                    # Fixed widths to save CPU
-                    ws.column_dimensions['A'].width = 15
-                    for col_idx in range(2, len(headers) + 2):
-                        col_letter = ws.cell(row=1, column=col_idx).column_letter
-                        ws.column_dimensions[col_letter].width = 20
-                else:
-                    # Auto-adjust for small datasets
-                    for column in ws.columns:
-                        max_len = 0
-                        col_letter = column[0].column_letter
-                        for cell in column:
-                            try:
-                                if cell.value and len(str(cell.value)) > max_len:
-                                    max_len = len(str(cell.value))
-                            except:
-                                pass
-                        ws.column_dimensions[col_letter].width = min(max_len + 2, 50)
+                # Consume the next chunk of the shared row generator - no list copies; the sheet
+                # and the per-query files are fed from the same rows
+                write_table(sink, sheet_name, headers, islice(data_lines, chunk_rows), server_name, converter,
+                            is_large_dataset, chunk_rows, metrics, query_name)
+                if memory_profiler is not None:
+                    memory_profiler.snapshot(f"after sheet {sheet_name}")
                 
                 sheets_created += 1
+            
+            if parallel:
+                print(f"  Sheet '{query_name}' queued for workers: {total_rows:,} rows")
+                continue
+            
+            sink.end_query()
+            if num_sheets > 1:
+                print(f"  Successfully split {query_name} into {num_sheets} sheets")
+            else:
                 print(f"  Sheet '{query_name}' created: {total_rows:,} rows")
         
         except Exception as e:
             print(f"ERROR processing {query_name}: {str(e)}")
-            ws = wb.create_sheet(query_name)
-            ws['A1'] = "Error"
-            ws['A1'].font = Font(bold=True, color="FF0000")
-            ws['A2'] = sanitize(f"Failed: {str(e)}")
+            sink.end_query(failed=True)
+            # One error sheet per query, titled by the query name, which no data sheet uses
+            # (a part that failed half-written may still hold its own title)
+            write_error_sheet(sink, query_name, e)
             sheets_created += 1
     
-    # Save workbook
+    # Collect worker-rendered sheets into their reserved slots, keeping sheet order
+    worker_cpu = 0.0
+    if pool is not None:
+        for slot, query_name, title, future in pending:
+            try:
+                sheet, sheet_cpu, sheet_metrics = future.result()
+                workbook.place_sheet(slot, sheet)
+                worker_cpu += sheet_cpu
+                metrics.merge(sheet_metrics)
+                print(f"  Worker finished '{sheet.title}': {sheet.max_row - 1:,} rows in {sheet_cpu:.2f}s CPU")
+            except Exception as e:
+                # Titled after the failed part, so several failed parts of one query stay distinct
+                print(f"ERROR processing {query_name} ({title}): {str(e)}")
+                write_error_sheet(workbook, title, e)
+                workbook.place_sheet(slot)
+        for query_name, future in files_pending:
+            try:
+                query_metrics = future.result()
+                # With a workbook the sheet workers already account for these rows
+                if workbook is None:
+                    metrics.merge(query_metrics)
+            except Exception as e:
+                print(f"ERROR writing per-query files for {query_name}: {str(e)}")
+                # The worker drops its partial files unless it died outright
+                for file_sink in file_sinks:
+                    if os.path.exists(file_sink.path_for(query_name)):
+                        os.remove(file_sink.path_for(query_name))
+        pool.shutdown()
+    
+    # Sheets in QUERIES order, whatever order the queries were written in
+    if workbook is not None:
+        ends = [start for _, start in query_starts[1:]] + [workbook.sheet_count()]
+        spans = {query_name: (start, end) for (query_name, start), end in zip(query_starts, ends)}
+        workbook.order_sheets([spans[query_name] for query_name in QUERIES if query_name in spans])
+    
+    # Save workbook and close per-query files
     try:
-        wb.save(excel_file)
-        print(f"SUCCESS: Excel created with {sheets_created + 1} total sheets")
+        with metrics.timed("save"):
+            sink.save()
+        if memory_profiler is not None:
+            memory_profiler.snapshot("after save")
+        if pool is not None:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start + worker_cpu
+            print(f"Timing: wall {wall:.2f}s, CPU {cpu:.2f}s (workers {worker_cpu:.2f}s), "
+                  f"speedup x{cpu / wall if wall else 0:.2f}")
+        output_files = ([excel_file] if workbook is not None else []) + [
+            file_sink.path_for(query_name) for file_sink in file_sinks for query_name in QUERIES]
+        summary = metrics.summary(server_name, "+".join(backends), output_files)
+        print("Phases: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in summary["phases"].items()))
+        print(f"Throughput: {summary['rows']:,} rows in {summary['total_seconds']:.2f}s "
+              f"({summary['rows_per_sec'] or 0:,} rows/s), peak RSS {summary['peak_rss_mb']:.1f} MB, "
+              f"output {summary['output_bytes']:,} bytes")
+        print("METRICS " + json.dumps(summary))
+        if workbook is not None:
+            print(f"SUCCESS: Excel created with {sheets_created + 1} total sheets")
+        else:
+            written = [path for path in output_files if os.path.exists(path)]
+            print(f"SUCCESS: No workbook, {len(written)} per-query files written: "
+                  + ", ".join(os.path.basename(path) for path in written))
         sys.stdout.flush()
         return 0
     except Exception as e:
@@ -509,21 +2177,191 @@ ORDER BY last_comm;"""
         sys.stdout.flush()
         return 1
 
+def read_batch_manifest(manifest_file):
+    """
+    Read a batch manifest: one job per line, tab separated <tsv_dir> <output_excel> <server_name>
+    Blank lines and lines starting with # are ignored
+    """
+    jobs = []
+    with open(manifest_file, 'r') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 3:
+                raise ValueError(f"{manifest_file}:{line_no}: expected 3 tab-separated fields, got {len(fields)}")
+            jobs.append(tuple(fields))
+    return jobs
+
+
+def run_conversion(tsv_dir, excel_file, server_name, options, profile=None):
+    """
+    Convert one server, optionally under the CPU and/or memory profiler
+    profile: {"cpu": bool, "memory": bool, "dir": report directory} or None
+    Reports are named profile_cpu_<server>_<timestamp>.txt (+ .prof) and
+    profile_memory_<server>_<timestamp>.txt
+    """
+    if not profile or not (profile["cpu"] or profile["memory"]):
+        return create_excel(tsv_dir, excel_file, server_name, **options)
+    
+    os.makedirs(profile["dir"], exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    profiler = cProfile.Profile() if profile["cpu"] else None
+    
+    memory_profiler = None
+    if profile["memory"]:
+        memory_profiler = MemoryProfiler(os.path.join(profile["dir"], f"profile_memory_{server_name}_{stamp}.txt"),
+                                         profiler)
+        memory_profiler.start()
+    
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return create_excel(tsv_dir, excel_file, server_name, memory_profiler=memory_profiler, **options)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            write_cpu_report(profiler, os.path.join(profile["dir"], f"profile_cpu_{server_name}_{stamp}.txt"))
+        if memory_profiler is not None:
+            memory_profiler.stop()
+
+
+def run_batch_job(tsv_dir, excel_file, server_name, options, profile=None):
+    """
+    Batch worker: convert one server and return (exit_code, seconds, captured output)
+    Output is captured so concurrent jobs don't interleave in the log
+    """
+    start = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        if not os.path.isdir(tsv_dir) and not is_tar_input(tsv_dir):
+            print(f"ERROR: TSV directory or tarball not found: {tsv_dir}")
+            exit_code = 1
+        else:
+            try:
+                exit_code = run_conversion(tsv_dir, excel_file, server_name, options, profile)
+            except Exception as e:
+                print(f"ERROR: Unexpected failure: {str(e)}")
+                exit_code = 1
+    return exit_code, time.perf_counter() - start, output.getvalue()
+
+
+def run_batch(manifest_file, workers, options, profile=None):
+    """
+    Run every manifest job through a bounded worker pool
+    Each finished job prints its log (prefixed with the server name) followed by one
+    machine-readable line for the shell script:
+        BATCH_RESULT|<server_name>|<exit_code>|<output_excel>|<seconds>
+    Returns 0 if all jobs succeeded, 1 otherwise
+    """
+    jobs = read_batch_manifest(manifest_file)
+    print(f"Batch mode: {len(jobs)} jobs from {manifest_file}, {workers} workers")
+    sys.stdout.flush()
+    
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_batch_job, tsv_dir, excel_file, server_name, options, profile): (excel_file, server_name)
+                   for tsv_dir, excel_file, server_name in jobs}
+        for future in as_completed(futures):
+            excel_file, server_name = futures[future]
+            try:
+                exit_code, seconds, output = future.result()
+            except Exception as e:
+                exit_code, seconds, output = 1, 0.0, f"ERROR: Worker failed: {str(e)}\n"
+            for line in output.splitlines():
+                print(f"[{server_name}] {line}")
+            print(f"BATCH_RESULT|{server_name}|{exit_code}|{excel_file}|{seconds:.1f}")
+            sys.stdout.flush()
+            failed += exit_code != 0
+    
+    print(f"Batch complete: {len(jobs) - failed}/{len(jobs)} succeeded")
+    return 0 if failed == 0 else 1
+
+
+def parse_args(argv):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Convert TSV query results to an Excel workbook",
+        epilog="Example:\n  python3 create_excel_from_tsv.py /tmp/tsv_AMM01 /tmp/AMM01_20251010_120000.xlsx AMM01",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("tsv_dir", nargs="?",
+                        help="Directory containing the <Query>.tsv files, or the mysql_results tar.gz "
+                             "(with --stream: framed query stream, '-' for stdin)")
+    parser.add_argument("output_excel", nargs="?", help="Output Excel file path")
+    parser.add_argument("server_name", nargs="?", help="Server name written into the Server column")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Write rows through write-only worksheets (constant memory, widths fitted to the first rows)")
+    parser.add_argument("--engine", choices=ENGINES, default="openpyxl",
+                        help="Workbook writer: openpyxl (default) or native (direct SpreadsheetML, always streaming)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes rendering data sheets in parallel (native engine only, default 1; "
+                             "a tarball input is then extracted to a temporary directory first)")
+    parser.add_argument("--columnar", choices=COLUMNAR_FORMATS,
+                        help="Also write one typed columnar file per query next to the workbook (needs pyarrow)")
+    parser.add_argument("--backend", action="append", choices=BACKENDS,
+                        help="Output backend, repeatable: one workbook (openpyxl, openpyxl-streaming, native) "
+                             "and/or per-query csv.gz, parquet or arrow files; default from --engine/--streaming, "
+                             "--columnar adds its format")
+    parser.add_argument("--stream", action="store_true",
+                        help="tsv_dir is a framed query stream from the remote script in stream mode "
+                             "(plain or gzip, '-' for stdin) instead of a directory or tarball")
+    parser.add_argument("--sort", action="store_true",
+                        help="Order each query by its SQL ORDER BY columns here, for results the remote "
+                             "script extracted without ORDER BY (external merge sort, bounded memory)")
+    parser.add_argument("--sort-buffer-rows", type=int, default=SORT_BUFFER_ROWS,
+                        help=f"Rows per in-memory sorted run with --sort; more are spilled to disk "
+                             f"(default {SORT_BUFFER_ROWS})")
+    parser.add_argument("--sort-dir",
+                        help="Directory for the spilled sort runs (default: the system temporary directory)")
+    parser.add_argument("--batch", metavar="MANIFEST",
+                        help="Convert every <tsv_dir> <output_excel> <server_name> line of a tab-separated manifest")
+    parser.add_argument("--batch-workers", type=int, default=2,
+                        help="Servers converted concurrently in batch mode (default 2)")
+    parser.add_argument("--profile-cpu", action="store_true",
+                        help="Run under cProfile and write a sorted hot-function report")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Take tracemalloc snapshots after each sheet and write them to a report")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR,
+                        help=f"Directory for profile reports (default {DEFAULT_PROFILE_DIR})")
+    args = parser.parse_args(argv)
+    
+    if args.batch is None and args.server_name is None:
+        parser.error("tsv_dir, output_excel and server_name are required unless --batch is given")
+    if args.batch is not None and args.tsv_dir is not None:
+        parser.error("positional arguments cannot be combined with --batch")
+    if args.batch is not None and args.stream:
+        parser.error("--stream converts one server and cannot be combined with --batch")
+    
+    args.backends = args.backend or default_backends(args.engine, args.streaming)
+    if args.columnar and args.columnar not in args.backends:
+        args.backends.append(args.columnar)
+    if sum(backend in WORKBOOK_BACKENDS for backend in args.backends) > 1:
+        parser.error("only one workbook backend (openpyxl, openpyxl-streaming, native) can be selected")
+    return args
+
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python3 create_excel_from_tsv.py <tsv_dir> <output_excel> <server_name>")
-        print("")
-        print("Example:")
-        print("  python3 create_excel_from_tsv.py /tmp/tsv_AMM01 /tmp/AMM01_20251010_120000.xlsx AMM01")
-        sys.exit(1)
+    args = parse_args(sys.argv[1:])
+    options = {"backends": args.backends, "jobs": args.jobs, "sort": args.sort,
+               "sort_buffer_rows": args.sort_buffer_rows, "sort_dir": args.sort_dir}
+    profile = {"cpu": args.profile_cpu, "memory": args.profile_memory, "dir": args.profile_dir}
     
-    tsv_directory = sys.argv[1]
-    output_excel = sys.argv[2]
-    server_name = sys.argv[3]
+    if args.batch is not None:
+        if not os.path.isfile(args.batch):
+            print(f"ERROR: Batch manifest not found: {args.batch}")
+            sys.exit(1)
+        sys.exit(run_batch(args.batch, args.batch_workers, options, profile))
     
-    if not os.path.isdir(tsv_directory):
-        print(f"ERROR: TSV directory not found: {tsv_directory}")
+    if args.stream:
+        if args.tsv_dir != "-" and not os.path.isfile(args.tsv_dir):
+            print(f"ERROR: Query stream not found: {args.tsv_dir}")
+            sys.exit(1)
+        options["stream"] = True
+    elif not os.path.isdir(args.tsv_dir) and not is_tar_input(args.tsv_dir):
+        print(f"ERROR: TSV directory or tarball not found: {args.tsv_dir}")
         sys.exit(1)
     
-    exit_code = create_excel_from_tsv_files(tsv_directory, output_excel, server_name)
+    exit_code = run_conversion(args.tsv_dir, args.output_excel, args.server_name, options, profile)
     sys.exit(exit_code)
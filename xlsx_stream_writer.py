@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Script: xlsx_stream_writer.py
+Purpose: Minimal streaming XLSX writer used by create_excel_from_tsv.py (--engine native)
+         Emits the SpreadsheetML parts directly into the zip container without building
+         per-cell Python objects. Rows go to a temporary sheetData file as they are appended,
+         so memory stays flat and column widths can still be set after the data is written.
+         Strings are written inline (t="inlineStr") instead of through a shared string table,
+         which would have to be held in memory until save.
+Author: Infrastructure Team
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape, quoteattr
+
+# Style ids - index into cellXfs in STYLES_XML
+STYLE_DEFAULT = 0
+STYLE_HEADER = 1      # Bold white text on 366092, centered (same as the openpyxl header)
+STYLE_WRAP_TOP = 2    # Wrapped text aligned to the top (Queries sheet SQL column)
+STYLE_ERROR = 3       # Bold red text (error sheets)
+STYLE_DATETIME = 4    # Date and time, same number format openpyxl uses for datetime cells
+
+# Excel serial dates count days from this epoch (1900 date system)
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+STYLES_XML = XML_DECLARATION + f"""<styleSheet xmlns="{MAIN_NS}">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd h:mm:ss"/></numFmts>
+<fonts count="3">
+<font><sz val="11"/><color theme="1"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>
+<font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>
+<font><b/><sz val="11"/><color rgb="FFFF0000"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>
+</fonts>
+<fills count="3">
+<fill><patternFill patternType="none"/></fill>
+<fill><patternFill patternType="gray125"/></fill>
+<fill><patternFill patternType="solid"><fgColor rgb="00366092"/><bgColor rgb="00366092"/></patternFill></fill>
+</fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1"><alignment vertical="top" wrapText="1"/></xf>
+<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>
+"""
+
+SHEET_HEAD = XML_DECLARATION + f'<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+SHEET_TAIL = ('<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/>'
+              '</worksheet>')
+
+# Cached column letters, extended on demand
+_COLUMN_LETTERS = []
+
+
+def column_letter(col_idx):
+    """1-based column index to Excel column letters (1 -> A, 27 -> AA)"""
+    while len(_COLUMN_LETTERS) < col_idx:
+        n = len(_COLUMN_LETTERS) + 1
+        letters = ''
+        while n:
+            n, rem = divmod(n - 1, 26)
+            letters = chr(65 + rem) + letters
+        _COLUMN_LETTERS.append(letters)
+    return _COLUMN_LETTERS[col_idx - 1]
+
+
+def excel_serial(value):
+    """datetime to Excel serial day number"""
+    delta = value - EXCEL_EPOCH
+    return delta.days + (delta.seconds + delta.microseconds / 1000000) / 86400
+
+
+def render_cell(ref, value, style=STYLE_DEFAULT):
+    """Render one <c> element, or '' for empty cells"""
+    style_attr = f' s="{style}"' if style else ''
+    if isinstance(value, str):
+        return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{escape(value)}</t></is></c>'
+    if value is None:
+        return f'<c r="{ref}"{style_attr}/>' if style else ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, int):
+        return f'<c r="{ref}"{style_attr}><v>{value}</v></c>'
+    if isinstance(value, float):
+        return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+    if isinstance(value, datetime):
+        return f'<c r="{ref}" s="{style or STYLE_DATETIME}"><v>{excel_serial(value)!r}</v></c>'
+    return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+class XlsxStreamSheet:
+    """
+    One worksheet being streamed to a temporary sheetData file
+    Rows are rendered to XML as they are appended; widths are collected and written on save
+    """
+
+    def __init__(self, title, tmp_dir, index):
+        self.title = title
+        self.widths = {}
+        self.max_row = 0
+        self.max_col = 0
+        self.data_path = os.path.join(tmp_dir, f"sheet{index}.xml.part")
+        self._data = open(self.data_path, 'w', encoding='utf-8', newline='')
+
+    def set_column_width(self, col_idx, width):
+        """Set width for a 1-based column; may be called before or after rows are appended"""
+        self.widths[col_idx] = width
+
+    def append(self, values, style=STYLE_DEFAULT):
+        """
+        Append one row
+        style is either a single style id for the whole row or a list with one id per cell
+        """
+        row_idx = self.max_row + 1
+        cells = []
+        if isinstance(style, int):
+            for col_idx, value in enumerate(values, start=1):
+                cells.append(render_cell(f"{column_letter(col_idx)}{row_idx}", value, style))
+        else:
+            for col_idx, (value, cell_style) in enumerate(zip(values, style), start=1):
+                cells.append(render_cell(f"{column_letter(col_idx)}{row_idx}", value, cell_style))
+        self._data.write(f'<row r="{row_idx}">{"".join(cells)}</row>')
+        self.max_row = row_idx
+        if len(cells) > self.max_col:
+            self.max_col = len(cells)
+
+    def close(self):
+        if self._data is not None and not self._data.closed:
+            self._data.close()
+
+    def __getstate__(self):
+        # Finished sheets are handed back from worker processes - the data file travels by path
+        self.close()
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def write_to(self, zf, arcname):
+        """Write the complete worksheet part into the open zip file"""
+        self.close()
+        with zf.open(arcname, 'w', force_zip64=True) as out:
+            head = [SHEET_HEAD]
+            if self.max_row and self.max_col:
+                head.append(f'<dimension ref="A1:{column_letter(self.max_col)}{self.max_row}"/>')
+            head.append('<sheetViews><sheetView workbookViewId="0"/></sheetViews>')
+            head.append('<sheetFormatPr defaultRowHeight="15"/>')
+            if self.widths:
+                head.append('<cols>')
+                for col_idx in sorted(self.widths):
+                    head.append(f'<col min="{col_idx}" max="{col_idx}" width="{self.widths[col_idx]}" customWidth="1"/>')
+                head.append('</cols>')
+            head.append('<sheetData>')
+            out.write(''.join(head).encode('utf-8'))
+            with open(self.data_path, 'rb') as data:
+                shutil.copyfileobj(data, out, 1024 * 1024)
+            out.write(('</sheetData>' + SHEET_TAIL).encode('utf-8'))
+
+
+class XlsxStreamWorkbook:
+    """
+    Workbook assembled from streamed sheets
+    Mirrors the small part of the openpyxl Workbook API the converter uses: create_sheet() and save()
+    """
+
+    def __init__(self):
+        self.sheets = []
+        self._tmp_dir = tempfile.mkdtemp(prefix="xlsx_stream_")
+        self._sheet_counter = 0
+
+    def create_sheet(self, title, index=None):
+        sheet = XlsxStreamSheet(title, *self.reserve_part())
+        if index is None:
+            self.sheets.append(sheet)
+        else:
+            self.sheets.insert(index, sheet)
+        return sheet
+
+    def reserve_part(self):
+        """
+        (tmp_dir, index) for a sheet rendered elsewhere, e.g. in a worker process
+        The finished XlsxStreamSheet is then placed into self.sheets by the caller
+        """
+        self._sheet_counter += 1
+        return self._tmp_dir, self._sheet_counter
+
+    def _workbook_xml(self):
+        parts = [XML_DECLARATION, f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">',
+                 '<bookViews><workbookView activeTab="0"/></bookViews><sheets>']
+        for sheet_id, sheet in enumerate(self.sheets, start=1):
+            parts.append(f'<sheet name={quoteattr(sheet.title)} sheetId="{sheet_id}" r:id="rId{sheet_id}"/>')
+        parts.append('</sheets></workbook>')
+        return ''.join(parts)
+
+    def _workbook_rels_xml(self):
+        parts = [XML_DECLARATION, f'<Relationships xmlns="{PKG_REL_NS}">']
+        for sheet_id in range(1, len(self.sheets) + 1):
+            parts.append(f'<Relationship Id="rId{sheet_id}" Type="{REL_NS}/worksheet" '
+                         f'Target="worksheets/sheet{sheet_id}.xml"/>')
+        parts.append(f'<Relationship Id="rId{len(self.sheets) + 1}" Type="{REL_NS}/styles" Target="styles.xml"/>')
+        parts.append('</Relationships>')
+        return ''.join(parts)
+
+    def _content_types_xml(self):
+        ct = "application/vnd.openxmlformats-officedocument"
+        parts = [XML_DECLARATION,
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">',
+                 f'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>',
+                 '<Default Extension="xml" ContentType="application/xml"/>',
+                 f'<Override PartName="/xl/workbook.xml" ContentType="{ct}.spreadsheetml.sheet.main+xml"/>',
+                 f'<Override PartName="/xl/styles.xml" ContentType="{ct}.spreadsheetml.styles+xml"/>',
+                 '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>',
+                 f'<Override PartName="/docProps/app.xml" ContentType="{ct}.extended-properties+xml"/>']
+        for sheet_id in range(1, len(self.sheets) + 1):
+            parts.append(f'<Override PartName="/xl/worksheets/sheet{sheet_id}.xml" '
+                         f'ContentType="{ct}.spreadsheetml.worksheet+xml"/>')
+        parts.append('</Types>')
+        return ''.join(parts)
+
+    @staticmethod
+    def _root_rels_xml():
+        return (XML_DECLARATION + f'<Relationships xmlns="{PKG_REL_NS}">'
+                f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+                '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/'
+                'metadata/core-properties" Target="docProps/core.xml"/>'
+                f'<Relationship Id="rId3" Type="{REL_NS}/extended-properties" Target="docProps/app.xml"/>'
+                '</Relationships>')
+
+    @staticmethod
+    def _core_xml():
+        created = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return (XML_DECLARATION +
+                '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+                'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+                '<dc:creator>create_excel_from_tsv</dc:creator>'
+                f'<dcterms:created xsi:type="dcterms:W3CDTF">{created}</dcterms:created>'
+                f'<dcterms:modified xsi:type="dcterms:W3CDTF">{created}</dcterms:modified>'
+                '</cp:coreProperties>')
+
+    @staticmethod
+    def _app_xml():
+        return (XML_DECLARATION +
+                '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+                '<Application>Microsoft Excel</Application></Properties>')
+
+    def save(self, filename):
+        """Assemble all parts into the .xlsx file and remove the temporary sheet data"""
+        try:
+            with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr('[Content_Types].xml', self._content_types_xml())
+                zf.writestr('_rels/.rels', self._root_rels_xml())
+                zf.writestr('docProps/core.xml', self._core_xml())
+                zf.writestr('docProps/app.xml', self._app_xml())
+                zf.writestr('xl/workbook.xml', self._workbook_xml())
+                zf.writestr('xl/_rels/workbook.xml.rels', self._workbook_rels_xml())
+                zf.writestr('xl/styles.xml', STYLES_XML)
+                for sheet_id, sheet in enumerate(self.sheets, start=1):
+                    sheet.write_to(zf, f'xl/worksheets/sheet{sheet_id}.xml')
+        finally:
+            self.close()
+
+    def close(self):
+        """Discard temporary sheet data (called by save)"""
+        for sheet in self.sheets:
+            sheet.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)